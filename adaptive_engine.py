@@ -0,0 +1,163 @@
+"""適応的学習エンジン
+
+構文・形式の遷移ルールを Flask や DB に依存しない純粋な関数として実装する。
+app_sqlite.py の「次の問題」処理と、ログのリプレイ・ベンチマークの両方から使う。
+"""
+from collections import namedtuple
+
+FORMATS = ["選択式", "穴埋め式", "記述式", "意味説明"]
+
+# 8構文のリスト
+TOPICS = ['SELECT', 'WHERE', 'ORDERBY', '集約関数', 'GROUPBY', 'HAVING', 'JOIN', 'サブクエリ']
+
+# logs.verdict の値（判定不明は結果が空・想定外の文字列の回答。得点は不正解と同じ 0 点）
+VERDICT_UNKNOWN = -1
+VERDICT_INCORRECT = 0
+VERDICT_PARTIAL = 1
+VERDICT_CORRECT = 2
+
+# 形式ごとの直近の判定結果の最大件数
+MAX_WINDOW_SIZE = 5
+
+# 「次の問題」押下時の遷移結果
+# next_topic が None なら構文・形式は変わらない
+Transition = namedtuple('Transition', ['format_question_count', 'next_topic', 'next_format', 'completed'])
+
+# リプレイ用の状態
+# windows: {(構文, 形式): 現在の形式に入ってからの直近の得点のタプル}
+ProgressState = namedtuple('ProgressState', ['topic', 'format', 'question_count', 'windows'])
+
+def extract_topic_from_problem_id(problem_id):
+    """問題IDから構文名を抽出"""
+    if '_' in problem_id:
+        prefix = problem_id.split('_')[0].upper()
+        prefix_to_topic = {
+            'SELECT': 'SELECT',
+            'WHERE': 'WHERE',
+            'ORDERBY': 'ORDERBY',
+            'AGG': '集約関数',
+            'GROUPBY': 'GROUPBY',
+            'HAVING': 'HAVING',
+            'JOIN': 'JOIN',
+            'SUBQUERY': 'サブクエリ'
+        }
+        return prefix_to_topic.get(prefix, 'SELECT')
+    return 'SELECT'
+
+def score_verdict(sql_result, meaning_result):
+    """正解: 1点、部分正解: 0.5点、不正解: 0点"""
+    if sql_result == '正解 ✅' or meaning_result == '正解 ✅':
+        return 1
+    elif '部分正解' in str(sql_result) or '部分正解' in str(meaning_result):
+        return 0.5
+    return 0
+
+def verdict_code(sql_result, meaning_result):
+    """判定結果の文字列を logs.verdict の値（判定不明 -1・不正解 0・部分正解 1・正解 2）に変換"""
+    if sql_result == '正解 ✅' or meaning_result == '正解 ✅':
+        return VERDICT_CORRECT
+    elif '部分正解' in str(sql_result) or '部分正解' in str(meaning_result):
+        return VERDICT_PARTIAL
+    elif sql_result == '不正解 ❌' or meaning_result == '不正解 ❌':
+        return VERDICT_INCORRECT
+    return VERDICT_UNKNOWN
+
+def verdict_score(verdict):
+    """logs.verdict を得点に変換（判定不明は 0 点）"""
+    return max(verdict or 0, 0) / 2
+
+def get_format_question_threshold(test_mode=False):
+    """形式変更までの問題数"""
+    # テストモード
+    if test_mode:
+        return 2
+
+    # 通常モード - 全ての形式で5問に統一
+    return 5
+
+def get_window_size(format, test_mode=False):
+    """正答率を計算する直近の問題数"""
+    if test_mode:
+        return 2
+    elif format in ['記述式', '意味説明']:
+        return 3
+    else:
+        return 5
+
+def compute_accuracy(scores):
+    """得点のリストから正答率を計算（空ならNone）"""
+    if not scores:
+        return None
+
+    correct_count = 0
+    for score in scores:
+        correct_count += score
+
+    accuracy = (correct_count / len(scores)) * 100
+    return {
+        'total': len(scores),
+        'correct': correct_count,
+        'accuracy': round(accuracy, 1)
+    }
+
+def get_next_format(current_format, accuracy):
+    formats = ['選択式', '穴埋め式', '記述式', '意味説明']
+    current_index = formats.index(current_format)
+
+    if accuracy >= 80:
+        next_index = min(current_index + 1, len(formats) - 1)
+        return formats[next_index]
+    elif accuracy >= 70:
+        return current_format
+    else:
+        next_index = max(current_index - 1, 0)
+        return formats[next_index]
+
+def decide_transition(topic, current_format, format_question_count, recent_scores, test_mode=False):
+    """
+    「次の問題」押下時の遷移を決める
+    topic: 直前に解いた問題の構文
+    format_question_count: 直前の回答を数える前の、現在の形式での問題数
+    recent_scores: 現在の形式に入ってからの直近の得点（古い順、形式ごとの件数で切り詰め済み）
+    """
+    format_question_count += 1
+    threshold = get_format_question_threshold(test_mode)
+    accuracy_data = compute_accuracy(recent_scores)
+
+    if not (format_question_count >= threshold and accuracy_data and accuracy_data['total'] >= threshold):
+        return Transition(format_question_count, None, None, ())
+
+    if current_format == '意味説明':
+        if accuracy_data['accuracy'] >= 70:
+            current_index = TOPICS.index(topic) if topic in TOPICS else 0
+            if current_index < len(TOPICS) - 1:
+                return Transition(format_question_count, TOPICS[current_index + 1], '選択式', ((topic, '意味説明'),))
+            return Transition(format_question_count, None, None, ((topic, '意味説明'),))
+        return Transition(format_question_count, topic, '記述式', ())
+
+    next_format = get_next_format(current_format, accuracy_data['accuracy'])
+    if next_format != current_format:
+        return Transition(format_question_count, topic, next_format, ((topic, next_format),))
+    return Transition(format_question_count, None, None, ())
+
+def initial_state(topic='SELECT', format='選択式'):
+    """リプレイの初期状態"""
+    return ProgressState(topic, format, 0, {})
+
+def step(state, problem_topic, score, test_mode=False):
+    """
+    回答1件と「次の問題」押下を反映した次の状態を返す
+    形式が変わると format_start_time が更新されるため、それまでの得点は全て捨てる
+    """
+    key = (problem_topic, state.format)
+    window = (state.windows.get(key, ()) + (score,))[-MAX_WINDOW_SIZE:]
+
+    transition = decide_transition(problem_topic, state.format, state.question_count,
+                                   window[-get_window_size(state.format, test_mode):], test_mode)
+
+    if transition.next_topic:
+        return ProgressState(transition.next_topic, transition.next_format, 0, {}), transition
+
+    windows = dict(state.windows)
+    windows[key] = window
+    return ProgressState(state.topic, state.format, transition.format_question_count, windows), transition
@@ -1,32 +1,293 @@
-from flask import Flask, request, render_template_string, redirect, url_for, session
-import openai
+from flask import Flask, request, render_template, redirect, url_for, session, has_request_context, Response, g
+from flask import before_render_template, template_rendered
+from flask.sessions import SecureCookieSessionInterface
+from jinja2 import FileSystemBytecodeCache
 import os
 import sqlite3
-from datetime import datetime
+import csv
+import gzip
+import hashlib
+import hmac
+import html
+import json
+import logging
+import tempfile
+import traceback
+from io import StringIO
+from urllib.parse import urlencode
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 import re
 import random
-import openpyxl
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import time
+from werkzeug.http import is_resource_modified
+try:
+    import brotli
+except ImportError:
+    brotli = None
+import adaptive_engine
+import class_dashboard
+import metrics
+import problem_selector
+import profiling
+import query_counter
+from stats_cache import LocalStatsCache, create_stats_cache
+from adaptive_engine import FORMATS, TOPICS, extract_topic_from_problem_id, get_next_format, verdict_code, verdict_score
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "s2221079")
 
-# 安定版の初期化方法
-openai.api_key = os.environ.get("OPENAI_API_KEY")
+# リクエストごとの処理時間（METRICS_ENABLED=0 で計測ごと止める。REQUEST_LOG=0 ならログ行だけ止める）
+REQUEST_LOG = os.environ.get("REQUEST_LOG", "1") != "0"
+# 1リクエストのクエリ数の上限と、同じ文を繰り返してよい回数（超えたら警告をログに出す）
+DB_QUERY_BUDGET = int(os.environ.get("DB_QUERY_BUDGET", "30"))
+DB_QUERY_REPEAT_LIMIT = int(os.environ.get("DB_QUERY_REPEAT_LIMIT", "10"))
+# デバッグモードか DB_QUERY_HEADER=1 なら、応答ヘッダーにクエリ数・時間を付ける（負荷試験で使う）
+DB_QUERY_HEADER = os.environ.get("DB_QUERY_HEADER") == "1"
+request_logger = logging.getLogger("sql_learning.request")
+if not request_logger.handlers:
+    request_logger.addHandler(logging.StreamHandler())
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
+metrics.define_histogram('http_request_duration_seconds', 'ルートごとの応答時間', ['route', 'method', 'status'])
+metrics.define_counter('app_db_queries_total', 'ルートごとのクエリ数', ['route'])
+metrics.define_counter('app_db_query_budget_exceeded_total', 'クエリ数の上限・同じ文の繰り返しの上限を超えたリクエスト数',
+                       ['route', 'kind'])
+
+class RequestTimer:
+    """セッションの復号より前から計測を始める WSGI ミドルウェア"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        environ['sql_learning.started'] = time.perf_counter()
+        metrics.start_request()
+        query_counter.start_request()
+        return self.wsgi_app(environ, start_response)
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """セッション（署名付き Cookie）の復号・保存の時間を計測する"""
+
+    def open_session(self, app, request):
+        with metrics.span('session.open'):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with metrics.span('session.save'):
+            return super().save_session(app, session, response)
+
+def template_render_started(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+def template_render_finished(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        metrics.record_span('template', time.perf_counter() - started)
+
+if metrics.ENABLED:
+    app.wsgi_app = RequestTimer(app.wsgi_app)
+    app.session_interface = TimedSessionInterface()
+    before_render_template.connect(template_render_started, app)
+    template_rendered.connect(template_render_finished, app)
+
+@app.after_request
+def record_request_metrics(response):
+    # 最初に登録しているので、圧縮などほかの after_request より後に走る
+    started = request.environ.get('sql_learning.started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    # 404 などで URL がそのままラベルにならないよう、ルートの定義で数える
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('http_request_duration_seconds', (route, request.method, str(response.status_code)), elapsed)
+    spans = metrics.finish_request()
+    queries = query_counter.finish_request() or query_counter.RequestQueries()
+    metrics.increment('app_db_queries_total', (route,), queries.count)
+    check_query_budget(route, queries)
+    if app.debug or DB_QUERY_HEADER:
+        response.headers['X-DB-Queries'] = str(queries.count)
+        response.headers['X-DB-Time-Ms'] = f"{queries.seconds * 1000:.2f}"
+    if REQUEST_LOG:
+        request_logger.info(json.dumps({
+            'time': current_epoch(),
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 2),
+            'bytes': response.calculate_content_length(),
+            'db_queries': queries.count,
+            'db_ms': round(queries.seconds * 1000, 2),
+            'spans': spans,
+        }, ensure_ascii=False))
+    return response
+
+def check_query_budget(route, queries):
+    """クエリが多すぎる・同じ文を繰り返している（N+1）リクエストを警告する"""
+    statement, repeats = queries.most_repeated()
+    exceeded = []
+    if queries.count > DB_QUERY_BUDGET:
+        exceeded.append('budget')
+    if repeats > DB_QUERY_REPEAT_LIMIT:
+        exceeded.append('repeated')
+    for kind in exceeded:
+        metrics.increment('app_db_query_budget_exceeded_total', (route, kind))
+    if exceeded:
+        request_logger.warning(json.dumps({
+            'warning': 'db_queries',
+            'route': route,
+            'db_queries': queries.count,
+            'budget': DB_QUERY_BUDGET,
+            'repeated': repeats,
+            'repeated_statement': ' '.join(statement.split())[:300] if statement else None,
+        }, ensure_ascii=False))
+
+# テンプレート（templates/）のコンパイル結果をファイルに保存し、再起動やワーカー間で使い回す
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sql_learning_jinja"))
+try:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)}
+except Exception as e:
+    pass
+
+# 静的ファイルの内容ハッシュ（URL の ?v= に付けて長期キャッシュさせる）
+_static_versions = {}
+
+def static_version(filename):
+    version = _static_versions.get(filename)
+    if version is None:
+        try:
+            with open(os.path.join(app.static_folder, filename), 'rb') as f:
+                version = hashlib.sha1(f.read()).hexdigest()[:10]
+        except OSError:
+            version = ''
+        _static_versions[filename] = version
+    return version
+
+def static_url(filename):
+    version = static_version(filename)
+    return url_for('static', filename=filename, v=version) if version else url_for('static', filename=filename)
+
+app.jinja_env.globals['static_url'] = static_url
+
+# テンプレートの内容のハッシュ（画面の ETag に含め、デプロイで見た目が変わったら一致しないようにする）
+TEMPLATE_VERSION = ''
+
+def precompile_templates():
+    """起動時にすべてのテンプレートをコンパイルしておく（最初のリクエストで待たせない）"""
+    global TEMPLATE_VERSION
+    digest = hashlib.sha1()
+    for name in sorted(app.jinja_env.list_templates(extensions=['html'])):
+        app.jinja_env.get_template(name)
+        digest.update(app.jinja_env.loader.get_source(app.jinja_env, name)[0].encode('utf-8'))
+    digest.update(static_version('css/app.css').encode('utf-8'))
+    TEMPLATE_VERSION = digest.hexdigest()[:16]
+
+@app.after_request
+def cache_static_files(response):
+    # ?v= 付きの静的ファイルは内容が変われば URL も変わるので、ブラウザに長期間キャッシュさせる
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+# これより小さい応答は圧縮しない（圧縮の手間とヘッダーの分で得にならない）
+COMPRESS_MIN_SIZE = 500
+COMPRESS_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/csv', 'application/json', 'application/javascript'}
+
+@app.after_request
+def compress_response(response):
+    """Accept-Encoding に応じて brotli（入っていれば）か gzip で圧縮する"""
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    if response.is_streamed:
+        # CSV のような逐次送信は対象外。静的ファイルは小さいので読み込んで圧縮する
+        if request.endpoint != 'static':
+            return response
+        response.direct_passthrough = False
+    
+    response.vary.add('Accept-Encoding')
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        encoding = 'br'
+    elif accept['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+    
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=5)
+    else:
+        data = gzip.compress(data, compresslevel=6)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    # 圧縮後は別の表現になるので、ETag は弱い比較にする
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# 起動時の処理ごとの時間（秒、bench.startup で使う）
+STARTUP_SECONDS = {}
+
+def run_startup_step(name, func):
+    started = time.perf_counter()
+    result = func()
+    STARTUP_SECONDS[name] = time.perf_counter() - started
+    return result
+
+# GPT のクライアント（読み込みに時間がかかるので、最初に評価するときに読み込む）
+_openai = None
+
+def get_openai():
+    global _openai
+    if _openai is None:
+        import openai
+        # 安定版の初期化方法
+        openai.api_key = os.environ.get("OPENAI_API_KEY")
+        _openai = openai
+    return _openai
 
 # データベース設定
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
 if DATABASE_URL:
     # PostgreSQL（本番環境）
-    import psycopg2
-    from psycopg2.extras import DictCursor
-    
     # Render の postgres:// を postgresql:// に変換
     if DATABASE_URL.startswith("postgres://"):
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
     
+    # psycopg2 は最初に接続するときに読み込む。計測が有効なら、クエリ数を数えるカーソルにする
+    _cursor_factory = None
+    
+    def connect_postgresql(url, **kwargs):
+        global _cursor_factory
+        import psycopg2
+        if _cursor_factory is None and metrics.ENABLED:
+            _cursor_factory = query_counter.counting_cursor_class(psycopg2.extensions.cursor)
+        return psycopg2.connect(url, cursor_factory=_cursor_factory, **kwargs)
+    
     def get_db_connection():
-        return psycopg2.connect(DATABASE_URL)
+        return connect_postgresql(DATABASE_URL)
+    
+    # 読み取り専用のレプリカ（任意）
+    READ_DATABASE_URL = os.environ.get("READ_DATABASE_URL")
+    if READ_DATABASE_URL and READ_DATABASE_URL.startswith("postgres://"):
+        READ_DATABASE_URL = READ_DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    
+    def connect_read_database():
+        return connect_postgresql(READ_DATABASE_URL, connect_timeout=3)
     
     DB_TYPE = "postgresql"
     pass
@@ -34,16 +295,402 @@ else:
     # SQLite（ローカル開発）
     DB_FILE = "学習履歴.db"
     
+    # 計測が有効なら、クエリ数を数えるカーソルを返す接続にする
+    CONNECTION_FACTORY = query_counter.CountingSQLiteConnection if metrics.ENABLED else sqlite3.Connection
+    
     def get_db_connection():
-        return sqlite3.connect(DB_FILE)
+        return sqlite3.connect(DB_FILE, factory=CONNECTION_FACTORY)
+    
+    # 読み取り専用の接続（任意、例: file:学習履歴.db?mode=ro）
+    READ_DATABASE_URL = os.environ.get("READ_DATABASE_URL")
+    
+    def connect_read_database():
+        return sqlite3.connect(READ_DATABASE_URL, uri=True, factory=CONNECTION_FACTORY)
     
     DB_TYPE = "sqlite"
     pass
 
+def get_read_connection(consistent=False):
+    """
+    読み取り用の接続（READ_DATABASE_URL がなければプライマリ）
+    consistent=True のときは、このセッションで最後に書き込んだ位置までレプリカに
+    反映されている場合だけレプリカを使い、遅れていればプライマリを使う。
+    リクエスト外（先読みのスレッドなど）では書き込み位置がわからないのでプライマリを使う。
+    """
+    if not READ_DATABASE_URL:
+        return get_db_connection()
+    
+    write_position = None
+    if consistent:
+        if not has_request_context():
+            return get_db_connection()
+        write_position = session.get('write_lsn')
+    
+    try:
+        conn = connect_read_database()
+    except Exception as e:
+        return get_db_connection()
+    
+    if write_position and DB_TYPE == "postgresql":
+        try:
+            cursor = conn.cursor()
+            # レプリカでない（pg_last_wal_replay_lsn() が NULL）なら自分の書き込みは見える
+            cursor.execute('SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, true)', (write_position,))
+            caught_up = cursor.fetchone()[0]
+            conn.rollback()
+        except Exception as e:
+            caught_up = False
+        if not caught_up:
+            conn.close()
+            return get_db_connection()
+    
+    return conn
+
+def remember_write_position(cursor):
+    """コミット後に呼び、レプリカが追いついたかを判定するためのWALの位置をセッションに記録
+    
+    書き込みはコミット済みなので、位置を取れなくても例外は出さない（次の読み取りがレプリカの遅れを拾うだけ）
+    """
+    if READ_DATABASE_URL and DB_TYPE == "postgresql" and has_request_context():
+        try:
+            cursor.execute('SELECT pg_current_wal_lsn()')
+            session['write_lsn'] = cursor.fetchone()[0]
+        except Exception as e:
+            metrics.record_error('remember_write_position')
+
+# 時刻はDBにはPostgreSQLならTIMESTAMPTZ、SQLiteならUNIX時間（秒）で保存し、
+# アプリ内・セッションではUNIX時間（秒）で扱う
+# 表示に使うタイムゾーン（未設定ならサーバーのローカル時刻）
+DISPLAY_TIMEZONE = ZoneInfo(os.environ["APP_TIMEZONE"]) if os.environ.get("APP_TIMEZONE") else None
+
+def current_epoch():
+    return int(time.time())
+
+def to_epoch(value):
+    """UNIX時間・datetime・旧形式の文字列（ローカル時刻）をUNIX時間（秒）に変換"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    value = str(value)
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return int(datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp())
+
+def to_db_time(value):
+    """DBに保存する時刻の値に変換"""
+    epoch = to_epoch(value)
+    if epoch is None:
+        return None
+    if DB_TYPE == "postgresql":
+        return datetime.fromtimestamp(epoch, timezone.utc)
+    return epoch
+
+def format_timestamp(value):
+    """画面・CSV表示用の時刻文字列"""
+    epoch = to_epoch(value)
+    if epoch is None:
+        return ''
+    if DISPLAY_TIMEZONE:
+        return datetime.fromtimestamp(epoch, DISPLAY_TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+SQLITE_CREATE_LOGS = '''
+    CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        problem_id TEXT NOT NULL,
+        format TEXT,
+        user_sql TEXT,
+        user_explanation TEXT,
+        sql_result TEXT,
+        sql_feedback TEXT,
+        meaning_result TEXT,
+        meaning_feedback TEXT,
+        verdict INTEGER
+    )
+'''
+
+SQLITE_CREATE_LEARNING_PROGRESS = '''
+    CREATE TABLE IF NOT EXISTS learning_progress (
+        user_id TEXT PRIMARY KEY,
+        current_topic TEXT NOT NULL,
+        current_format TEXT NOT NULL,
+        format_question_count INTEGER DEFAULT 0,
+        format_start_time INTEGER,
+        last_updated INTEGER NOT NULL
+    )
+'''
+
+# PostgreSQLで logs を期間ごとに分割する単位（"month" または "semester"、未設定なら分割しない）
+LOG_PARTITION = os.environ.get("LOG_PARTITION", "").lower()
+
+def get_local_timezone():
+    return DISPLAY_TIMEZONE or datetime.now().astimezone().tzinfo
+
+def get_log_partition_range(moment, scheme):
+    """moment を含むパーティションの (名前, 開始, 終了)。学期は4月〜9月を前期、10月〜3月を後期とする"""
+    moment = moment.astimezone(get_local_timezone())
+    if scheme == "semester":
+        if 4 <= moment.month <= 9:
+            year, half, start_month = moment.year, 1, 4
+        elif moment.month >= 10:
+            year, half, start_month = moment.year, 2, 10
+        else:
+            year, half, start_month = moment.year - 1, 2, 10
+        start = datetime(year, start_month, 1, tzinfo=moment.tzinfo)
+        end = datetime(year + 1, 4, 1, tzinfo=moment.tzinfo) if half == 2 else datetime(year, 10, 1, tzinfo=moment.tzinfo)
+        return f"logs_s{year}_{half}", start, end
+    
+    start = datetime(moment.year, moment.month, 1, tzinfo=moment.tzinfo)
+    if moment.month == 12:
+        end = datetime(moment.year + 1, 1, 1, tzinfo=moment.tzinfo)
+    else:
+        end = datetime(moment.year, moment.month + 1, 1, tzinfo=moment.tzinfo)
+    return f"logs_p{moment.year}_{moment.month:02d}", start, end
+
+def create_log_partition(cursor, moment, scheme):
+    """moment を含むパーティションがなければ作る（既定パーティションに入った行は移す）"""
+    name, start, end = get_log_partition_range(moment, scheme)
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0] is not None:
+        return end
+    
+    cursor.execute(f'CREATE TABLE {name} (LIKE logs INCLUDING DEFAULTS)')
+    cursor.execute(f'''
+        WITH moved AS (
+            DELETE FROM logs_default WHERE timestamp >= %s AND timestamp < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    ''', (start, end))
+    cursor.execute(f'ALTER TABLE logs ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', (start, end))
+    return end
+
+def partition_postgresql_logs(cursor, scheme):
+    """logs を宣言的パーティションに変換し、現在と次の期間のパーティションを用意する"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')")
+    if cursor.fetchone()[0] != 'p':
+        # 既存の logs を退避して、同じ列・同じ連番のパーティションテーブルに入れ直す
+        cursor.execute("SELECT pg_get_serial_sequence('logs', 'id')")
+        sequence = cursor.fetchone()[0]
+        # ダッシュボードの集計ビューは logs_unpartitioned に依存してしまうので外しておく（init_db で作り直す）
+        class_dashboard.drop_postgresql_summaries(cursor)
+        cursor.execute('ALTER TABLE logs RENAME TO logs_unpartitioned')
+        cursor.execute('DROP INDEX IF EXISTS idx_logs_user_timestamp')
+        cursor.execute('DROP INDEX IF EXISTS idx_logs_timestamp_brin')
+        cursor.execute('ALTER TABLE logs_unpartitioned DROP CONSTRAINT IF EXISTS logs_pkey')
+        
+        cursor.execute('''
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = 'logs_unpartitioned' ORDER BY ordinal_position
+        ''')
+        columns = [(name, data_type) for name, data_type in cursor.fetchall() if name != 'id']
+        column_defs = ",\n".join(
+            f'"{name}" {data_type}{" NOT NULL" if name in ("user_id", "timestamp", "problem_id") else ""}'
+            for name, data_type in columns
+        )
+        cursor.execute(f'''
+            CREATE TABLE logs (
+                id INTEGER NOT NULL DEFAULT nextval('{sequence}'::regclass),
+                {column_defs},
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        ''')
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY logs.id")
+        cursor.execute('CREATE TABLE logs_default PARTITION OF logs DEFAULT')
+        
+        # 既存の行がある期間のパーティションを先に作ってから移す
+        cursor.execute('SELECT MIN(timestamp) FROM logs_unpartitioned')
+        oldest = cursor.fetchone()[0]
+        if oldest is not None:
+            moment = oldest
+            while moment <= datetime.now(timezone.utc):
+                moment = create_log_partition(cursor, moment, scheme)
+        
+        column_list = ", ".join(['id'] + [f'"{name}"' for name, data_type in columns])
+        cursor.execute(f'INSERT INTO logs ({column_list}) SELECT {column_list} FROM logs_unpartitioned')
+        cursor.execute('DROP TABLE logs_unpartitioned')
+    
+    # アプリの起動ごとに現在と次の期間のパーティションを用意する
+    current_end = create_log_partition(cursor, datetime.now(timezone.utc), scheme)
+    create_log_partition(cursor, current_end, scheme)
+    
+    # SQLiteからの移行などで既定パーティションに入った過去の行も期間ごとに移す
+    cursor.execute('SELECT MIN(timestamp), MAX(timestamp) FROM logs_default')
+    oldest, newest = cursor.fetchone()
+    moment = oldest
+    while moment is not None and moment <= newest:
+        moment = create_log_partition(cursor, moment, scheme)
+
+# 判定結果の文字列から logs.verdict を埋める（adaptive_engine.verdict_code と同じ判定）
+BACKFILL_VERDICT = '''
+    UPDATE logs SET verdict = CASE
+        WHEN sql_result = '正解 ✅' OR meaning_result = '正解 ✅' THEN 2
+        WHEN sql_result LIKE '%部分正解%' OR meaning_result LIKE '%部分正解%' THEN 1
+        WHEN sql_result = '不正解 ❌' OR meaning_result = '不正解 ❌' THEN 0
+        ELSE -1 END
+    WHERE verdict IS NULL
+'''
+
+# 判定不明の回答を以前は不正解（0）として埋めていたので、判定不明（-1）に直す
+RECLASSIFY_UNKNOWN_VERDICT = '''
+    UPDATE logs SET verdict = -1
+    WHERE verdict = 0
+      AND COALESCE(sql_result, '') <> '不正解 ❌' AND COALESCE(meaning_result, '') <> '不正解 ❌'
+'''
+
+def migrate_postgresql_timestamps(cursor):
+    """旧形式（TEXT）の時刻列をTIMESTAMPTZに変換（文字列はサーバーのローカル時刻として解釈）"""
+    cursor.execute('''
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_name IN ('logs', 'learning_progress')
+        AND column_name IN ('timestamp', 'format_start_time', 'last_updated')
+        AND data_type = 'text'
+    ''')
+    legacy_offset = f"{int(datetime.now().astimezone().utcoffset().total_seconds())} seconds"
+    for table, column in cursor.fetchall():
+        cursor.execute(f'''
+            ALTER TABLE {table} ALTER COLUMN "{column}" TYPE TIMESTAMPTZ
+            USING NULLIF("{column}", '')::timestamp AT TIME ZONE %s::interval
+        ''', (legacy_offset,))
+
+def migrate_sqlite_timestamps(cursor):
+    """旧形式（TEXT）の時刻列をUNIX時間（INTEGER）に変換（SQLiteは列の型を変えられないので作り直す）"""
+    def to_epoch_sql(column):
+        return f'''CASE WHEN typeof({column}) = 'text' AND {column} <> ''
+                    THEN CAST(strftime('%s', {column}, 'utc') AS INTEGER)
+                    WHEN {column} = '' THEN NULL ELSE {column} END'''
+    
+    cursor.execute("PRAGMA table_info(logs)")
+    if any(column[1] == 'timestamp' and column[2].upper() == 'TEXT' for column in cursor.fetchall()):
+        cursor.execute('ALTER TABLE logs RENAME TO logs_text_timestamp')
+        cursor.execute(SQLITE_CREATE_LOGS)
+        cursor.execute(f'''
+            INSERT INTO logs (id, user_id, timestamp, problem_id, format, user_sql, user_explanation,
+                              sql_result, sql_feedback, meaning_result, meaning_feedback, verdict)
+            SELECT id, user_id, {to_epoch_sql('timestamp')}, problem_id, format, user_sql, user_explanation,
+                   sql_result, sql_feedback, meaning_result, meaning_feedback, verdict
+            FROM logs_text_timestamp
+        ''')
+        cursor.execute('DROP TABLE logs_text_timestamp')
+    
+    cursor.execute("PRAGMA table_info(learning_progress)")
+    if any(column[1] == 'last_updated' and column[2].upper() == 'TEXT' for column in cursor.fetchall()):
+        cursor.execute('ALTER TABLE learning_progress RENAME TO learning_progress_text_timestamp')
+        cursor.execute(SQLITE_CREATE_LEARNING_PROGRESS)
+        cursor.execute(f'''
+            INSERT INTO learning_progress (user_id, current_topic, current_format, format_question_count,
+                                           format_start_time, last_updated)
+            SELECT user_id, current_topic, current_format, format_question_count,
+                   {to_epoch_sql('format_start_time')}, {to_epoch_sql('last_updated')}
+            FROM learning_progress_text_timestamp
+        ''')
+        cursor.execute('DROP TABLE learning_progress_text_timestamp')
+
+# これより長くかかった回答は離席などとみなし、平均回答時間に含めない
+PROBLEM_TIME_LIMIT_SECONDS = 1800
+
+PROBLEM_STATS_UPSERT = '''
+    INSERT INTO problem_stats (problem_id, attempts, correct, partial, timed_attempts, total_answer_seconds, updated_at)
+    VALUES ({placeholder}, 1, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})
+    ON CONFLICT (problem_id) DO UPDATE SET
+        attempts = problem_stats.attempts + 1,
+        correct = problem_stats.correct + EXCLUDED.correct,
+        partial = problem_stats.partial + EXCLUDED.partial,
+        timed_attempts = problem_stats.timed_attempts + EXCLUDED.timed_attempts,
+        total_answer_seconds = problem_stats.total_answer_seconds + EXCLUDED.total_answer_seconds,
+        updated_at = EXCLUDED.updated_at
+'''
+
+def create_problem_stats(cursor):
+    """問題ごとの回答数・正解数・部分正解数・回答時間の合計（save_log で1行ずつ足していく）"""
+    if DB_TYPE == "postgresql":
+        cursor.execute("SELECT to_regclass('problem_stats')")
+        exists = cursor.fetchone()[0] is not None
+        time_type = 'TIMESTAMPTZ'
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'problem_stats'")
+        exists = cursor.fetchone() is not None
+        time_type = 'INTEGER'
+    
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS problem_stats (
+            problem_id TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            partial INTEGER NOT NULL,
+            timed_attempts INTEGER NOT NULL,
+            total_answer_seconds BIGINT NOT NULL,
+            updated_at {time_type}
+        )
+    ''')
+    if not exists:
+        # これまでの回答から回答数を入れておく（回答時間は記録がないので 0 件）
+        rebuild_problem_stats(cursor)
+
+def rebuild_problem_stats(cursor):
+    """problem_stats の回答数・正解数・部分正解数を logs から数え直す（回答時間はそのまま）"""
+    placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+    cursor.execute(f'''
+        INSERT INTO problem_stats (problem_id, attempts, correct, partial, timed_attempts, total_answer_seconds, updated_at)
+        SELECT problem_id, COUNT(*),
+               SUM(CASE WHEN verdict = 2 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN verdict = 1 THEN 1 ELSE 0 END),
+               0, 0, {placeholder}
+        FROM logs
+        WHERE 1 = 1  -- SQLite は INSERT ... SELECT に WHERE がないと ON CONFLICT を結合の ON と読み違えるので消さない
+        GROUP BY problem_id
+        ON CONFLICT (problem_id) DO UPDATE SET
+            attempts = EXCLUDED.attempts,
+            correct = EXCLUDED.correct,
+            partial = EXCLUDED.partial,
+            updated_at = EXCLUDED.updated_at
+    ''', (to_db_time(current_epoch()),))
+
+# スキーマの版（init_db で作るテーブル・列・索引・集計を変えたら上げる）
+SCHEMA_VERSION = 2
+
+def schema_marker(partitioned=True):
+    """init_db を実行済みかの印（logs を分割しているなら、期間が変わったときも実行してパーティションを用意する）
+    
+    分割に失敗したときは partitioned=False で期間を含めない印を書き、次の起動で分割をやり直す。
+    """
+    marker = str(SCHEMA_VERSION)
+    if partitioned and DB_TYPE == "postgresql" and LOG_PARTITION in ("month", "semester"):
+        name, start, end = get_log_partition_range(datetime.now(timezone.utc), LOG_PARTITION)
+        marker += f":{name}"
+    return marker
+
+def ensure_schema():
+    """DB の印が今の版と違うときだけ init_db を実行する（FORCE_INIT_DB=1 なら必ず実行）"""
+    if os.environ.get("FORCE_INIT_DB") != "1":
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM schema_version WHERE id = 1')
+            row = cursor.fetchone()
+            if row and row[0] == schema_marker():
+                return False
+        except Exception as e:
+            # 初回（schema_version がない）
+            pass
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    init_db()
+    return True
+
 # データベース初期化
 def init_db():
     conn = get_db_connection()
     cursor = conn.cursor()
+    placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+    partitioned = True
     
     if DB_TYPE == "postgresql":
         # logsテーブル（既存）
@@ -51,7 +698,7 @@ def init_db():
             CREATE TABLE IF NOT EXISTS logs (
                 id SERIAL PRIMARY KEY,
                 user_id TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
+                timestamp TIMESTAMPTZ NOT NULL,
                 problem_id TEXT NOT NULL,
                 format TEXT,
                 user_sql TEXT,
@@ -59,7 +706,8 @@ def init_db():
                 sql_result TEXT,
                 sql_feedback TEXT,
                 meaning_result TEXT,
-                meaning_feedback TEXT
+                meaning_feedback TEXT,
+                verdict SMALLINT
             )
         ''')
         
@@ -70,39 +718,41 @@ def init_db():
                 current_topic TEXT NOT NULL,
                 current_format TEXT NOT NULL,
                 format_question_count INTEGER DEFAULT 0,
-                format_start_time TEXT,
-                last_updated TEXT NOT NULL
+                format_start_time TIMESTAMPTZ,
+                last_updated TIMESTAMPTZ NOT NULL
             )
         ''')
+        
+        migrate_postgresql_timestamps(cursor)
+        
+        cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = 'logs' AND column_name = 'verdict'")
+        if cursor.fetchone() is None:
+            cursor.execute('ALTER TABLE logs ADD COLUMN verdict SMALLINT')
+            cursor.execute(BACKFILL_VERDICT)
+        
+        if LOG_PARTITION in ("month", "semester"):
+            # 他のワーカーと同時に作ろうとした場合などは、分割せずにそのまま起動する
+            cursor.execute('SAVEPOINT log_partition')
+            try:
+                partition_postgresql_logs(cursor, LOG_PARTITION)
+            except Exception as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT log_partition')
+                partitioned = False
+                metrics.record_error('partition_postgresql_logs')
+                request_logger.warning(json.dumps({
+                    'warning': 'log_partition',
+                    'partition': LOG_PARTITION,
+                    'error': str(e),
+                }, ensure_ascii=False))
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_user_timestamp ON logs (user_id, timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp_brin ON logs USING BRIN (timestamp)')
     else:
         # SQLite用のCREATE TABLE
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                problem_id TEXT NOT NULL,
-                format TEXT,
-                user_sql TEXT,
-                user_explanation TEXT,
-                sql_result TEXT,
-                sql_feedback TEXT,
-                meaning_result TEXT,
-                meaning_feedback TEXT
-            )
-        ''')
+        cursor.execute(SQLITE_CREATE_LOGS)
         
         # SQLite用：学習進捗テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS learning_progress (
-                user_id TEXT PRIMARY KEY,
-                current_topic TEXT NOT NULL,
-                current_format TEXT NOT NULL,
-                format_question_count INTEGER DEFAULT 0,
-                format_start_time TEXT,
-                last_updated TEXT NOT NULL
-            )
-        ''')
+        cursor.execute(SQLITE_CREATE_LEARNING_PROGRESS)
         
         # format列の追加チェック（SQLiteのみ）
         cursor.execute("PRAGMA table_info(logs)")
@@ -110,17 +760,46 @@ def init_db():
         if 'format' not in columns:
             cursor.execute('ALTER TABLE logs ADD COLUMN format TEXT')
             pass
+        if 'verdict' not in columns:
+            cursor.execute('ALTER TABLE logs ADD COLUMN verdict INTEGER')
+            cursor.execute(BACKFILL_VERDICT)
+        
+        migrate_sqlite_timestamps(cursor)
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_user_timestamp ON logs (user_id, timestamp, id)')
+    
+    cursor.execute(RECLASSIFY_UNKNOWN_VERDICT)
+    
+    create_problem_stats(cursor)
+    
+    # 教員用ダッシュボードの集計
+    class_dashboard.create_summaries(cursor, DB_TYPE)
+    
+    # 次の起動からは印が一致すれば init_db を省く
+    cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (id INTEGER PRIMARY KEY, version TEXT NOT NULL)')
+    cursor.execute(f'''
+        INSERT INTO schema_version (id, version) VALUES (1, {placeholder})
+        ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version
+    ''', (schema_marker(partitioned),))
     
     conn.commit()
     conn.close()
     
-# アプリ起動時にDBを初期化
-init_db()
-
-FORMATS = ["選択式", "穴埋め式", "記述式", "意味説明"]
-
-# 8構文のリスト
-TOPICS = ['SELECT', 'WHERE', 'ORDERBY', '集約関数', 'GROUPBY', 'HAVING', 'JOIN', 'サブクエリ']
+# アプリ起動時にDBを初期化（デプロイ後の最初の起動だけ）
+run_startup_step('schema', ensure_schema)
+run_startup_step('templates', precompile_templates)
+
+# 構文の表示名
+TOPIC_NAMES = {
+    'SELECT': 'SELECT句',
+    'WHERE': 'WHERE句',
+    'ORDERBY': 'ORDER BY句',
+    '集約関数': '集約関数',
+    'GROUPBY': 'GROUP BY句',
+    'HAVING': 'HAVING句',
+    'JOIN': 'JOIN句',
+    'サブクエリ': 'サブクエリ'
+}
 
 # 構文説明の辞書
 TOPIC_EXPLANATIONS = {
@@ -307,13 +986,31 @@ WHERE department_id IN (SELECT id FROM departments WHERE location = 'Tokyo');</p
 '''
 }
 
+# 構文説明ページのブラウザキャッシュの有効期間（秒）
+TOPIC_PAGE_MAX_AGE = 3600
+
+# 事前にレンダリングした構文説明ページ（topic -> (HTML, ETag)）
+_topic_pages = {}
+
+def render_topic_pages():
+    """構文説明ページは構文だけで決まるので、起動時にまとめてレンダリングしておく"""
+    with app.test_request_context('/'):
+        for topic, explanation_html in TOPIC_EXPLANATIONS.items():
+            page = render_template("topic_explanation.html", topic_name=TOPIC_NAMES.get(topic, topic),
+                                   explanation_html=explanation_html).encode('utf-8')
+            _topic_pages[topic] = (page, hashlib.sha1(page).hexdigest())
+
+run_startup_step('topic_pages', render_topic_pages)
+
+@metrics.timed('db.save_learning_progress')
 def save_learning_progress(user_id, topic, format, question_count, start_time):
     """学習進捗をDBに保存"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        last_updated = to_db_time(current_epoch())
+        start_time = to_db_time(start_time)
         
         if DB_TYPE == "postgresql":
             cursor.execute('''
@@ -338,16 +1035,18 @@ def save_learning_progress(user_id, topic, format, question_count, start_time):
             ''', (user_id, topic, format, question_count, start_time, last_updated))
         
         conn.commit()
+        remember_write_position(cursor)
         conn.close()
         pass
         
     except Exception as e:
-        pass
+        metrics.record_error('save_learning_progress')
 
+@metrics.timed('db.load_learning_progress')
 def load_learning_progress(user_id):
     """学習進捗をDBから読み込む"""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection(consistent=True)
         cursor = conn.cursor()
         
         placeholder = '%s' if DB_TYPE == "postgresql" else '?'
@@ -366,14 +1065,14 @@ def load_learning_progress(user_id):
                 'current_topic': row[0],
                 'current_format': row[1],
                 'format_question_count': row[2],
-                'format_start_time': row[3],
-                'last_updated': row[4]
+                'format_start_time': to_epoch(row[3]),
+                'last_updated': to_epoch(row[4])
             }
         else:
             return None
             
     except Exception as e:
-        pass
+        metrics.record_error('load_learning_progress')
         return None
 
 def get_time_elapsed():
@@ -427,9 +1126,14 @@ def get_progress_percentage(elapsed_minutes, target_minutes=480):
     percentage = min((elapsed_minutes / target_minutes) * 100, 100)
     return round(percentage, 1)
 
-def load_problems(sheet_name):
+PROBLEM_FILE = "problems.xlsx"
+PROBLEM_SHEETS = ("Sheet1", "Sheet2", "Sheet3", "Sheet4", "Sheet5", "Sheet6", "Sheet7", "Sheet8")
+
+def load_problems(sheet_name, wb=None):
     try:
-        wb = openpyxl.load_workbook("problems.xlsx")
+        if wb is None:
+            import openpyxl
+            wb = openpyxl.load_workbook(PROBLEM_FILE)
         ws = wb[sheet_name]
         problems = []
         for row in ws.iter_rows(min_row=2, values_only=True):
@@ -447,9 +1151,48 @@ def load_problems(sheet_name):
             problems.append(problem)
         return problems
     except Exception as e:
-        pass
+        metrics.record_error('load_problems')
         return []
 
+# 問題バンク（全シートの問題のタプル）と読み込んだときの problems.xlsx の更新時刻
+# 起動時に読み込むので、gunicorn の preload ではマスターで1回だけ読み、ワーカー間でコピーオンライトで共有する
+# （gunicorn.conf.py の pre_fork で gc.freeze() し、GC が共有ページに書き込まないようにする）
+_problem_bank = (None, ())
+_problem_bank_lock = threading.Lock()
+
+@metrics.timed('xlsx.load_problem_bank')
+def load_problem_bank():
+    """ブックを1回だけ開いて全シートの問題を読む"""
+    try:
+        import openpyxl
+        wb = openpyxl.load_workbook(PROBLEM_FILE)
+    except Exception as e:
+        metrics.record_error('load_problem_bank')
+        return ()
+    return tuple(problem for sheet in PROBLEM_SHEETS for problem in load_problems(sheet, wb))
+
+def get_problem_bank():
+    """問題バンクを返す（problems.xlsx が更新されていれば読み直す。読めなければ空のタプル）
+    
+    問題の辞書はリクエスト間で共有しているので書き換えないこと。
+    """
+    global _problem_bank
+    try:
+        modified = os.stat(PROBLEM_FILE).st_mtime_ns
+    except OSError:
+        return ()
+    loaded, problems = _problem_bank
+    if loaded == modified and problems:
+        return problems
+    with _problem_bank_lock:
+        loaded, problems = _problem_bank
+        if loaded != modified or not problems:
+            problems = load_problem_bank()
+            _problem_bank = (modified, problems)
+    return problems
+
+run_startup_step('problems', get_problem_bank)
+
 def normalize_sql_strict(sql):
     """SQL正規化関数（元のバグのまま）"""
     sql = sql.lower()
@@ -462,23 +1205,7 @@ def normalize_sql_strict(sql):
     sql = re.sub(r'\s+\)', ')', sql)
     return sql
 
-def extract_topic_from_problem_id(problem_id):
-    """問題IDから構文名を抽出"""
-    if '_' in problem_id:
-        prefix = problem_id.split('_')[0].upper()
-        prefix_to_topic = {
-            'SELECT': 'SELECT',
-            'WHERE': 'WHERE',
-            'ORDERBY': 'ORDERBY',
-            'AGG': '集約関数',
-            'GROUPBY': 'GROUPBY',
-            'HAVING': 'HAVING',
-            'JOIN': 'JOIN',
-            'SUBQUERY': 'サブクエリ'
-        }
-        return prefix_to_topic.get(prefix, 'SELECT')
-    return 'SELECT'
-
+@metrics.timed('evaluate_sql')
 def evaluate_sql(user_sql, correct_sql, format, problem=None, enable_gpt_feedback=True):
     """
     SQL評価関数
@@ -588,12 +1315,13 @@ def evaluate_sql(user_sql, correct_sql, format, problem=None, enable_gpt_feedbac
 判定結果: 正解/部分正解/不正解
 フィードバック: （建設的で具体的なアドバイス）"""
                 
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    temperature=0.3,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=250
-                )
+                with metrics.span('gpt'):
+                    response = get_openai().ChatCompletion.create(
+                        model="gpt-3.5-turbo",
+                        temperature=0.3,
+                        messages=[{"role": "user", "content": prompt}],
+                        max_tokens=250
+                    )
                 text = response['choices'][0]['message']['content'].strip()
                 
                 result_match = re.search(r"判定結果[:：]\s*(正解|部分正解|不正解)", text)
@@ -614,7 +1342,7 @@ def evaluate_sql(user_sql, correct_sql, format, problem=None, enable_gpt_feedbac
                 
                 return result, feedback
         except Exception as e:
-            pass
+            metrics.record_error('evaluate_sql')
     
     # APIエラー時のフォールバック
     if user_sql == correct_sql:
@@ -625,6 +1353,7 @@ def evaluate_sql(user_sql, correct_sql, format, problem=None, enable_gpt_feedbac
     else:
         return "不正解 ❌", ""
 
+@metrics.timed('evaluate_meaning')
 def evaluate_meaning(user_explanation, correct_explanation, enable_gpt_feedback=True, problem=None):
     """意味説明評価関数"""
     pass
@@ -700,12 +1429,13 @@ SQL文の動作を誤解している
 判定結果: 正解/部分正解/不正解
 フィードバック: （建設的なアドバイス）"""
         
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            temperature=0.1,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=250
-        )
+        with metrics.span('gpt'):
+            response = get_openai().ChatCompletion.create(
+                model="gpt-3.5-turbo",
+                temperature=0.1,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=250
+            )
         
         pass
         
@@ -733,7 +1463,7 @@ SQL文の動作を誤解している
         return result, feedback
         
     except Exception as e:
-        pass
+        metrics.record_error('evaluate_meaning')
     
     # APIエラー時のフォールバック
     pass
@@ -742,8 +1472,20 @@ SQL文の動作を誤解している
     else:
         return "不正解 ❌", ""
 
-def save_log(user_id, problem_id, format, user_sql, user_explanation, sql_result, sql_feedback, exp_result, exp_feedback):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+# logs.verdict の表示用の文字列
+VERDICT_LABELS = {
+    adaptive_engine.VERDICT_CORRECT: "正解 ✅",
+    adaptive_engine.VERDICT_PARTIAL: "部分正解 ⚠️",
+    adaptive_engine.VERDICT_INCORRECT: "不正解 ❌",
+    adaptive_engine.VERDICT_UNKNOWN: "-",
+}
+
+@metrics.timed('db.save_log')
+def save_log(user_id, problem_id, format, user_sql, user_explanation, sql_result, sql_feedback, exp_result, exp_feedback,
+             answer_seconds=None):
+    timestamp = current_epoch()
+    verdict = verdict_code(sql_result, exp_result)
+    conn = None
     try:
         pass
         
@@ -753,34 +1495,98 @@ def save_log(user_id, problem_id, format, user_sql, user_explanation, sql_result
         if DB_TYPE == "postgresql":
             query = '''
                 INSERT INTO logs (user_id, timestamp, problem_id, format, user_sql, user_explanation, 
-                                sql_result, sql_feedback, meaning_result, meaning_feedback)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                                sql_result, sql_feedback, meaning_result, meaning_feedback, verdict)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             '''
         else:
             query = '''
                 INSERT INTO logs (user_id, timestamp, problem_id, format, user_sql, user_explanation, 
-                                sql_result, sql_feedback, meaning_result, meaning_feedback)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                sql_result, sql_feedback, meaning_result, meaning_feedback, verdict)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             '''
         
         pass
-        cursor.execute(query, (user_id, timestamp, problem_id, format, user_sql, user_explanation, 
-                              sql_result, sql_feedback, exp_result, exp_feedback))
+        cursor.execute(query, (user_id, to_db_time(timestamp), problem_id, format, user_sql, user_explanation, 
+                              sql_result, sql_feedback, exp_result, exp_feedback, verdict))
+        
+        # 問題ごとの集計も同じトランザクションで更新する
+        timed = answer_seconds is not None and 0 <= answer_seconds <= PROBLEM_TIME_LIMIT_SECONDS
+        placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+        cursor.execute(PROBLEM_STATS_UPSERT.format(placeholder=placeholder), (
+            problem_id,
+            1 if verdict == adaptive_engine.VERDICT_CORRECT else 0,
+            1 if verdict == adaptive_engine.VERDICT_PARTIAL else 0,
+            1 if timed else 0,
+            answer_seconds if timed else 0,
+            to_db_time(timestamp)
+        ))
         
         pass
         conn.commit()
         
-        pass
-        conn.close()
+        log_version = get_log_version()
+        if log_version is not None:
+            log_version += 1
+            session['log_version'] = log_version
+        score = verdict_score(verdict)
+        record_recent_verdict(user_id, problem_id, format, timestamp, score, log_version)
+        record_problem_attempt(user_id, problem_id, timestamp, score, log_version)
+        invalidate_statistics(user_id)
         
-        pass
+        # レプリカ用の書き込み位置は、保存後の更新を済ませてから記録する
+        remember_write_position(cursor)
         
+    except Exception as e:
+        metrics.record_error('save_log')
+    finally:
+        if conn is not None:
+            conn.close()
+
+# 学習統計のキャッシュ（STATS_CACHE_URL に redis://... を指定するとワーカー間で共有する）
+try:
+    stats_cache = create_stats_cache(os.environ.get("STATS_CACHE_URL"))
+except Exception as e:
+    stats_cache = LocalStatsCache()
+
+def cached_statistics(kind, user_id, compute):
+    """統計をキャッシュから返し、なければ計算して保存する
+    
+    キーには保存先のバージョン（回答のたびに増える）に加えてセッションの log_version も含め、
+    プロセス内のキャッシュでも別ワーカーでの回答後に古い統計を返さないようにする
+    """
+    try:
+        key = f"{kind}:{user_id}:{stats_cache.get_version(user_id)}:{get_log_version()}"
+        value = stats_cache.get(key)
+    except Exception as e:
+        return compute(user_id)
+    if value is None:
+        value = compute(user_id)
+        # 回答がない・読み込みに失敗した結果は保存しない
+        if value:
+            try:
+                stats_cache.set(key, value)
+            except Exception as e:
+                pass
+    return value
+
+def invalidate_statistics(user_id):
+    try:
+        stats_cache.bump_version(user_id)
     except Exception as e:
         pass
 
 def get_user_statistics(user_id):
+    return cached_statistics('user', user_id, _compute_user_statistics)
+
+def get_detailed_statistics(user_id):
+    """構文別・形式別の詳細統計を取得"""
+    return cached_statistics('detailed', user_id, _compute_detailed_statistics)
+
+@metrics.timed('db.user_statistics')
+def _compute_user_statistics(user_id):
     try:
-        conn = get_db_connection()
+        # キャッシュに入れるので、レプリカの遅れで直前の回答が抜けないようにする
+        conn = get_read_connection(consistent=True)
         cursor = conn.cursor()
         
         if DB_TYPE == "postgresql":
@@ -793,47 +1599,15 @@ def get_user_statistics(user_id):
             conn.close()
             return None
         
-        if DB_TYPE == "postgresql":
-            cursor.execute('''
-                SELECT COUNT(*) FROM logs 
-                WHERE user_id = %s 
-                AND (sql_result = '正解 ✅' OR meaning_result = '正解 ✅')
-            ''', (user_id,))
-        else:
-            cursor.execute('''
-                SELECT COUNT(*) FROM logs 
-                WHERE user_id = ? 
-                AND (sql_result = '正解 ✅' OR meaning_result = '正解 ✅')
-            ''', (user_id,))
-        correct_count = cursor.fetchone()[0]
-        
-        if DB_TYPE == "postgresql":
-            cursor.execute('''
-                SELECT COUNT(*) FROM logs 
-                WHERE user_id = %s 
-                AND (sql_result = '部分正解 ⚠️' OR meaning_result = '部分正解 ⚠️')
-            ''', (user_id,))
-        else:
-            cursor.execute('''
-                SELECT COUNT(*) FROM logs 
-                WHERE user_id = ? 
-                AND (sql_result = '部分正解 ⚠️' OR meaning_result = '部分正解 ⚠️')
-            ''', (user_id,))
-        partial_count = cursor.fetchone()[0]
-        
-        if DB_TYPE == "postgresql":
-            cursor.execute('''
-                SELECT COUNT(*) FROM logs 
-                WHERE user_id = %s 
-                AND (sql_result = '不正解 ❌' OR meaning_result = '不正解 ❌')
-            ''', (user_id,))
-        else:
-            cursor.execute('''
-                SELECT COUNT(*) FROM logs 
-                WHERE user_id = ? 
-                AND (sql_result = '不正解 ❌' OR meaning_result = '不正解 ❌')
-            ''', (user_id,))
-        incorrect_count = cursor.fetchone()[0]
+        placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+        cursor.execute(f'''
+            SELECT COALESCE(SUM(CASE WHEN verdict = 2 THEN 1 ELSE 0 END), 0),
+                   COALESCE(SUM(CASE WHEN verdict = 1 THEN 1 ELSE 0 END), 0),
+                   COALESCE(SUM(CASE WHEN verdict = 0 THEN 1 ELSE 0 END), 0)
+            FROM logs 
+            WHERE user_id = {placeholder}
+        ''', (user_id,))
+        correct_count, partial_count, incorrect_count = cursor.fetchone()
         
         overall_accuracy = (correct_count / total_count * 100) if total_count > 0 else 0
         
@@ -855,14 +1629,12 @@ def get_user_statistics(user_id):
                 if DB_TYPE == "postgresql":
                     cursor.execute('''
                         SELECT COUNT(*) FROM logs 
-                        WHERE user_id = %s AND format = %s
-                        AND (sql_result = '正解 ✅' OR meaning_result = '正解 ✅')
+                        WHERE user_id = %s AND format = %s AND verdict = 2
                     ''', (user_id, format_name))
                 else:
                     cursor.execute('''
                         SELECT COUNT(*) FROM logs 
-                        WHERE user_id = ? AND format = ?
-                        AND (sql_result = '正解 ✅' OR meaning_result = '正解 ✅')
+                        WHERE user_id = ? AND format = ? AND verdict = 2
                     ''', (user_id, format_name))
                 format_correct = cursor.fetchone()[0]
                 
@@ -881,7 +1653,7 @@ def get_user_statistics(user_id):
         
         if DB_TYPE == "postgresql":
             cursor.execute('''
-                SELECT timestamp, problem_id, sql_result, meaning_result 
+                SELECT timestamp, problem_id, verdict 
                 FROM logs 
                 WHERE user_id = %s 
                 ORDER BY timestamp DESC 
@@ -889,13 +1661,14 @@ def get_user_statistics(user_id):
             ''', (user_id,))
         else:
             cursor.execute('''
-                SELECT timestamp, problem_id, sql_result, meaning_result 
+                SELECT timestamp, problem_id, verdict 
                 FROM logs 
                 WHERE user_id = ? 
                 ORDER BY timestamp DESC 
                 LIMIT 10
             ''', (user_id,))
-        recent_logs = cursor.fetchall()
+        # キャッシュに保存できるよう時刻は UNIX時間にしておく
+        recent_logs = [(to_epoch(timestamp), problem_id, verdict) for timestamp, problem_id, verdict in cursor.fetchall()]
         
         conn.close()
         
@@ -909,13 +1682,13 @@ def get_user_statistics(user_id):
             'recent_logs': recent_logs
         }
     except Exception as e:
-        pass
+        metrics.record_error('_compute_user_statistics')
         return None
 
-def get_detailed_statistics(user_id):
-    """構文別・形式別の詳細統計を取得"""
+@metrics.timed('db.detailed_statistics')
+def _compute_detailed_statistics(user_id):
     try:
-        conn = get_db_connection()
+        conn = get_read_connection(consistent=True)
         cursor = conn.cursor()
         
         placeholder = '%s' if DB_TYPE == "postgresql" else '?'
@@ -952,7 +1725,7 @@ def get_detailed_statistics(user_id):
                     cursor.execute(f'''
                         SELECT COUNT(*) FROM logs 
                         WHERE user_id = {placeholder} AND problem_id LIKE {placeholder} AND format = {placeholder}
-                        AND (sql_result = '正解 ✅' OR meaning_result = '正解 ✅')
+                        AND verdict = 2
                     ''', (user_id, f"{prefix}%", format_name))
                     correct = cursor.fetchone()[0]
                     
@@ -972,30 +1745,118 @@ def get_detailed_statistics(user_id):
         conn.close()
         return detailed_stats
     except Exception as e:
-        pass
+        metrics.record_error('_compute_detailed_statistics')
         return {}
 
 def is_test_mode():
     """テストモードかどうかを判定"""
     return session.get('test_mode', False)
 
-def get_format_question_threshold(format=None):
+def get_format_question_threshold(format=None, test_mode=None):
     """形式変更までの問題数"""
-    # テストモード
-    if is_test_mode():
-        return 2
-    
-    # 通常モード - 全ての形式で5問に統一
-    return 5
-
-def get_recent_accuracy(user_id, topic, format, limit=5, start_time=None):
-    # テストモード、または形式に応じたlimitを設定
-    if is_test_mode():
-        limit = 2
-    elif format in ['記述式', '意味説明']:
-        limit = 3
-    else:
-        limit = 5
+    if test_mode is None:
+        test_mode = is_test_mode()
+    return adaptive_engine.get_format_question_threshold(test_mode)
+
+# 直近の判定結果（ユーザー×構文×形式ごとのリングバッファ）
+# 別ワーカーでの書き込みはセッションの log_version とのずれで検出し、DBから再構築する
+# ユーザー数の上限を超えたら、最も長く使っていないユーザーから捨てる（LRU、先読みの PREFETCH_MAX_ENTRIES と同じ）
+RECENT_VERDICT_WINDOW = adaptive_engine.MAX_WINDOW_SIZE
+RECENT_VERDICT_MAX_USERS = 1000
+_recent_verdicts = OrderedDict()
+_recent_verdicts_lock = threading.Lock()
+
+def store_user_entry(entries, user_id, entry, max_users):
+    """ユーザーごとのキャッシュ（OrderedDict）に入れ、上限を超えた古いものを捨てる（呼び出し側でロックを持つ）"""
+    entries[user_id] = entry
+    entries.move_to_end(user_id)
+    while len(entries) > max_users:
+        entries.popitem(last=False)
+
+def get_log_version():
+    """セッションに記録された回答保存のバージョン（リクエスト外ではNone）"""
+    if not has_request_context():
+        return None
+    if 'log_version' not in session:
+        # ログアウト等でリセットされても古いキャッシュと一致しないよう乱数から始める
+        session['log_version'] = random.getrandbits(31)
+    return session['log_version']
+
+def record_recent_verdict(user_id, problem_id, format, timestamp, score, log_version=None):
+    """保存した判定結果をリングバッファに追加"""
+    with _recent_verdicts_lock:
+        entry = _recent_verdicts.get(user_id)
+        if entry is None:
+            return
+        
+        if log_version is not None and entry['version'] != log_version - 1:
+            # このワーカーが知らない書き込みがある
+            _recent_verdicts.pop(user_id, None)
+            return
+        
+        for (prefix, window_format), (since, window) in entry['windows'].items():
+            if window_format == format and problem_id.startswith(prefix):
+                window.append((timestamp, score))
+        entry['version'] = log_version
+        _recent_verdicts.move_to_end(user_id)
+
+@metrics.timed('db.load_recent_verdicts')
+def load_recent_verdicts(user_id, prefix, format, since=None, log_version=None):
+    """
+    リングバッファから since 以降の直近の判定結果を取得（なければDBから再構築）
+    since を条件に入れることで、logs を期間で分割している場合は新しいパーティションだけを読む
+    """
+    key = (prefix, format)
+    with _recent_verdicts_lock:
+        entry = _recent_verdicts.get(user_id)
+        if entry is not None and log_version is not None and entry['version'] != log_version:
+            entry = None
+        if entry is not None and key in entry['windows']:
+            cached_since, window = entry['windows'][key]
+            if cached_since is None or (since is not None and since >= cached_since):
+                _recent_verdicts.move_to_end(user_id)
+                return list(window)
+    
+    conn = get_read_connection(consistent=True)
+    cursor = conn.cursor()
+    
+    placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+    since_condition = f"AND timestamp >= {placeholder}" if since is not None else ""
+    params = (user_id, f"{prefix}%", format) + ((to_db_time(since),) if since is not None else ()) + (RECENT_VERDICT_WINDOW,)
+    cursor.execute(f'''
+        SELECT timestamp, verdict 
+        FROM logs 
+        WHERE user_id = {placeholder} AND problem_id LIKE {placeholder} AND format = {placeholder}
+        {since_condition}
+        ORDER BY timestamp DESC, id DESC 
+        LIMIT {placeholder}
+    ''', params)
+    
+    rows = cursor.fetchall()
+    conn.close()
+    
+    window = deque(
+        ((to_epoch(timestamp), verdict_score(verdict)) for timestamp, verdict in reversed(rows)),
+        maxlen=RECENT_VERDICT_WINDOW
+    )
+    
+    with _recent_verdicts_lock:
+        entry = _recent_verdicts.get(user_id)
+        if entry is None or (log_version is not None and entry['version'] != log_version):
+            entry = {'version': log_version, 'windows': {}}
+        store_user_entry(_recent_verdicts, user_id, entry, RECENT_VERDICT_MAX_USERS)
+        entry['windows'][key] = (since, window)
+    
+    return list(window)
+
+def get_recent_scores(user_id, topic, format, start_time=None, test_mode=None, log_version=None):
+    """format_start_time 以降の直近の得点（古い順、形式ごとの件数まで）"""
+    if test_mode is None:
+        test_mode = is_test_mode()
+    if log_version is None:
+        log_version = get_log_version()
+    
+    limit = adaptive_engine.get_window_size(format, test_mode)
     
     topic_prefix_map = {
         'SELECT': 'SELECT_',
@@ -1011,64 +1872,16 @@ def get_recent_accuracy(user_id, topic, format, limit=5, start_time=None):
     prefix = topic_prefix_map.get(topic, f"{topic}_")
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if DB_TYPE == "postgresql" else '?'
-        
-        if start_time:
-            cursor.execute(f'''
-                SELECT sql_result, meaning_result 
-                FROM logs 
-                WHERE user_id = {placeholder} AND problem_id LIKE {placeholder} AND format = {placeholder} AND timestamp >= {placeholder}
-                ORDER BY timestamp DESC 
-                LIMIT {placeholder}
-            ''', (user_id, f"{prefix}%", format, start_time, limit))
-        else:
-            cursor.execute(f'''
-                SELECT sql_result, meaning_result 
-                FROM logs 
-                WHERE user_id = {placeholder} AND problem_id LIKE {placeholder} AND format = {placeholder}
-                ORDER BY timestamp DESC 
-                LIMIT {placeholder}
-            ''', (user_id, f"{prefix}%", format, limit))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        if not results:
-            return None
-        
-        correct_count = 0
-        for sql_result, meaning_result in results:
-            # 正解: 1点、部分正解: 0.5点、不正解: 0点
-            if sql_result == '正解 ✅' or meaning_result == '正解 ✅':
-                correct_count += 1
-            elif '部分正解' in str(sql_result) or '部分正解' in str(meaning_result):
-                correct_count += 0.5
-        
-        accuracy = (correct_count / len(results)) * 100
-        return {
-            'total': len(results),
-            'correct': correct_count,
-            'accuracy': round(accuracy, 1)
-        }
+        start_time = to_epoch(start_time)
+        verdicts = load_recent_verdicts(user_id, prefix, format, start_time, log_version)
+        return [score for timestamp, score in verdicts if start_time is None or timestamp >= start_time][-limit:]
     except Exception as e:
         pass
-        return None
+        return []
 
-def get_next_format(current_format, accuracy):
-    formats = ['選択式', '穴埋め式', '記述式', '意味説明']
-    current_index = formats.index(current_format)
-    
-    if accuracy >= 80:
-        next_index = min(current_index + 1, len(formats) - 1)
-        return formats[next_index]
-    elif accuracy >= 70:
-        return current_format
-    else:
-        next_index = max(current_index - 1, 0)
-        return formats[next_index]
+def get_recent_accuracy(user_id, topic, format, limit=5, start_time=None, test_mode=None, log_version=None):
+    scores = get_recent_scores(user_id, topic, format, start_time, test_mode, log_version)
+    return adaptive_engine.compute_accuracy(scores)
 
 def get_learning_progress(user_id):
     """学習進捗を取得"""
@@ -1085,7 +1898,7 @@ def update_learning_progress(user_id, topic, format):
     progress['current_topic'] = topic
     progress['current_format'] = format
     progress['format_question_count'] = 0
-    progress['format_start_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    progress['format_start_time'] = current_epoch()
     
     if topic in TOPICS:
         progress['topic_index'] = TOPICS.index(topic)
@@ -1108,32 +1921,26 @@ def get_topic_overall_accuracy(user_id, topic, format):
     prefix = topic_prefix_map.get(topic, f"{topic}_")
     
     try:
-        conn = get_db_connection()
+        conn = get_read_connection(consistent=True)
         cursor = conn.cursor()
         
         placeholder = '%s' if DB_TYPE == "postgresql" else '?'
         
         cursor.execute(f'''
-            SELECT sql_result, meaning_result 
+            SELECT COUNT(*), COALESCE(SUM(CASE WHEN verdict = 2 THEN 1 ELSE 0 END), 0)
             FROM logs 
             WHERE user_id = {placeholder} AND problem_id LIKE {placeholder} AND format = {placeholder}
-            ORDER BY timestamp DESC
         ''', (user_id, f"{prefix}%", format))
         
-        results = cursor.fetchall()
+        total, correct_count = cursor.fetchone()
         conn.close()
         
-        if not results:
+        if not total:
             return None
         
-        correct_count = 0
-        for sql_result, meaning_result in results:
-            if sql_result == '正解 ✅' or meaning_result == '正解 ✅':
-                correct_count += 1
-        
-        accuracy = (correct_count / len(results)) * 100
+        accuracy = (correct_count / total) * 100
         return {
-            'total': len(results),
+            'total': total,
             'correct': correct_count,
             'accuracy': round(accuracy, 1)
         }
@@ -1190,8 +1997,273 @@ def get_available_back_buttons(current_topic, current_format):
     
     return buttons
 
+def compute_adaptive_transition(user_id, topic, progress, test_mode, log_version=None):
+    """「次の問題」で行う形式・構文の遷移を計算する（セッションは変更しない）"""
+    current_format = progress.get('current_format', '選択式')
+    recent_scores = get_recent_scores(user_id, topic, current_format, progress.get('format_start_time'),
+                                      test_mode, log_version)
+    return adaptive_engine.decide_transition(topic, current_format, progress.get('format_question_count', 0),
+                                             recent_scores, test_mode)
+
+def apply_adaptive_transition(user_id, topic, transition):
+    """計算済みの遷移をセッションとDBに反映"""
+    progress = session.get('learning_progress', {
+        'current_topic': 'SELECT',
+        'current_format': '選択式',
+        'format_question_count': 0,
+        'format_start_time': None
+    })
+    progress['format_question_count'] = transition.format_question_count
+    session['learning_progress'] = progress
+
+    for completed_topic, completed_format in transition.completed:
+        add_completed_format(completed_topic, completed_format)
+
+    if transition.next_topic:
+        update_learning_progress(user_id, transition.next_topic, transition.next_format)
+        if transition.next_topic != topic:
+            session.pop('topic_explained', None)
+
+    save_learning_progress(
+        user_id,
+        progress.get('current_topic', 'SELECT'),
+        progress.get('current_format', '選択式'),
+        progress.get('format_question_count', 0),
+        progress.get('format_start_time')
+    )
+
+# ユーザー×構文ごとの出題インデックス（problem_selector.TopicSelector）
+# 直近の判定結果と同じく log_version で別ワーカーでの書き込みを検出し、ユーザー数の上限を超えたら LRU で捨てる
+PROBLEM_SELECTOR_MAX_USERS = 1000
+_problem_selectors = OrderedDict()
+_problem_selectors_lock = threading.Lock()
+
+# クラス全体の回答がこれ未満の問題は、難しさを出題に使わない
+CLASS_DIFFICULTY_MIN_ATTEMPTS = 10
+
+@metrics.timed('db.get_problem_stats')
+def get_problem_stats(problem_ids):
+    """問題ごとのクラス全体の集計（problem_stats を主キーで引くだけ）"""
+    problem_ids = list(problem_ids)
+    if not problem_ids:
+        return {}
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+    cursor.execute(f'''
+        SELECT problem_id, attempts, correct, partial, timed_attempts, total_answer_seconds
+        FROM problem_stats
+        WHERE problem_id IN ({", ".join([placeholder] * len(problem_ids))})
+    ''', problem_ids)
+    rows = cursor.fetchall()
+    conn.close()
+    return {problem_id: problem_stats_entry(attempts, correct, partial, timed_attempts, total_seconds)
+            for problem_id, attempts, correct, partial, timed_attempts, total_seconds in rows}
+
+def problem_stats_entry(attempts, correct, partial, timed_attempts, total_seconds):
+    score = (correct + partial * 0.5) / attempts if attempts else 0.0
+    return {
+        'attempts': attempts,
+        'correct': correct,
+        'partial': partial,
+        'score_rate': score,
+        'accuracy': round(score * 100, 1),
+        'average_seconds': round(total_seconds / timed_attempts, 1) if timed_attempts else None
+    }
+
+def get_class_miss_rates(problem_ids):
+    """出題の重みに使うクラス全体の不正解率（回答が少ない問題は含めない）"""
+    try:
+        stats = get_problem_stats(problem_ids)
+    except Exception as e:
+        return {}
+    return {problem_id: 1 - entry['score_rate'] for problem_id, entry in stats.items()
+            if entry['attempts'] >= CLASS_DIFFICULTY_MIN_ATTEMPTS}
+
+@metrics.timed('db.load_problem_stats')
+def load_problem_stats(user_id, prefix):
+    """問題ごとの回答回数・得点の合計・最後に解いた時刻をDBから集計"""
+    conn = get_read_connection(consistent=True)
+    cursor = conn.cursor()
+    
+    placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+    cursor.execute(f'''
+        SELECT problem_id, COUNT(*), 
+               SUM(CASE WHEN verdict > 0 THEN verdict ELSE 0 END) / 2.0,
+               MAX(timestamp)
+        FROM logs 
+        WHERE user_id = {placeholder} AND problem_id LIKE {placeholder}
+        GROUP BY problem_id
+    ''', (user_id, f"{prefix}%"))
+    
+    rows = cursor.fetchall()
+    conn.close()
+    
+    return {
+        problem_id: (attempts, float(score_total or 0), to_epoch(last_seen))
+        for problem_id, attempts, score_total, last_seen in rows
+    }
+
+def get_topic_selector(user_id, topic, topic_problems, log_version=None):
+    """出題インデックスを取得（なければDBから構築）
+    
+    DB を読む間は _problem_selectors_lock を持たない（スレッドワーカーでほかのユーザーの出題を待たせない）。
+    同じユーザーの別のスレッドが先に作っていれば、そちらを使う。
+    """
+    problem_ids = tuple(p['id'] for p in topic_problems)
+    
+    def cached_entry():
+        entry = _problem_selectors.get(user_id)
+        if entry is None or (log_version is not None and entry['version'] != log_version):
+            entry = {'version': log_version, 'topics': {}}
+        store_user_entry(_problem_selectors, user_id, entry, PROBLEM_SELECTOR_MAX_USERS)
+        selector = entry['topics'].get(topic)
+        return entry, (selector if selector is not None and selector.problem_ids == problem_ids else None)
+    
+    with _problem_selectors_lock:
+        entry, selector = cached_entry()
+    if selector is not None:
+        return selector
+    
+    built = problem_selector.TopicSelector(problem_ids, load_problem_stats(user_id, get_topic_prefix(topic)),
+                                           current_epoch(), get_class_miss_rates(problem_ids))
+    with _problem_selectors_lock:
+        entry, selector = cached_entry()
+        if selector is None:
+            selector = entry['topics'][topic] = built
+    return selector
+
+def record_problem_attempt(user_id, problem_id, timestamp, score, log_version=None):
+    """保存した回答を出題インデックスに反映"""
+    with _problem_selectors_lock:
+        entry = _problem_selectors.get(user_id)
+        if entry is None:
+            return
+        
+        if log_version is not None and entry['version'] != log_version - 1:
+            _problem_selectors.pop(user_id, None)
+            return
+        
+        selector = entry['topics'].get(extract_topic_from_problem_id(problem_id))
+        if selector is not None:
+            selector.record(problem_id, score, timestamp)
+        entry['version'] = log_version
+        _problem_selectors.move_to_end(user_id)
+
+def select_topic_problem(user_id, topic, topic_problems, preferred_id=None, log_version=None):
+    """間違えた問題・しばらく解いていない問題を優先して構文内の問題を選ぶ"""
+    if log_version is None:
+        log_version = get_log_version()
+    
+    try:
+        selector = get_topic_selector(user_id, topic, topic_problems, log_version)
+        with _problem_selectors_lock:
+            now = time.time()
+            if preferred_id and selector.is_available(preferred_id, now):
+                selected_id = preferred_id
+            else:
+                selected_id = selector.sample(now)
+        return next(p for p in topic_problems if p['id'] == selected_id)
+    except Exception as e:
+        pass
+        return random.choice(topic_problems)
+
+# 次の問題の先読み（回答評価後、フィードバックを読んでいる間に計算しておく）
+PREFETCH_MAX_ENTRIES = 1000
+_prefetch_executor = ThreadPoolExecutor(max_workers=2)
+_prefetch_cache = {}
+_prefetch_lock = threading.Lock()
+
+def get_prefetch_key(problem_id, progress, test_mode, log_version):
+    """先読み結果が有効かどうかを判定するためのキー"""
+    return (
+        problem_id,
+        log_version,
+        progress.get('current_topic'),
+        progress.get('current_format'),
+        progress.get('format_question_count', 0),
+        progress.get('format_start_time'),
+        test_mode
+    )
+
+def _compute_prefetch(user_id, topic, progress, test_mode, log_version, topic_problems_by_prefix):
+    """遷移と次の問題候補を計算（バックグラウンドスレッドで実行）"""
+    transition = compute_adaptive_transition(user_id, topic, progress, test_mode, log_version)
+
+    next_topic = transition.next_topic or progress.get('current_topic', 'SELECT')
+    candidate_id = None
+    topic_problems = topic_problems_by_prefix.get(next_topic)
+    if topic_problems:
+        candidate_id = select_topic_problem(user_id, next_topic, topic_problems, log_version=log_version)['id']
+
+    return transition, candidate_id
+
+def start_prefetch(user_id, problem, all_problems):
+    """回答保存後に次の問題の先読みを開始"""
+    progress = dict(session.get('learning_progress', {
+        'current_topic': 'SELECT',
+        'current_format': '選択式',
+        'format_question_count': 0,
+        'format_start_time': None
+    }))
+    test_mode = is_test_mode()
+    log_version = get_log_version()
+    topic = extract_topic_from_problem_id(problem['id'])
+
+    # 遷移後に出題されうる構文（現在・次の構文）の問題だけを渡す
+    topic_problems_by_prefix = {}
+    current_index = TOPICS.index(topic) if topic in TOPICS else 0
+    for candidate_topic in TOPICS[current_index:current_index + 2] + [progress.get('current_topic')]:
+        prefix = get_topic_prefix(candidate_topic)
+        topic_problems_by_prefix[candidate_topic] = [p for p in all_problems if p['id'].startswith(prefix)]
+
+    key = get_prefetch_key(problem['id'], progress, test_mode, log_version)
+    try:
+        future = _prefetch_executor.submit(_compute_prefetch, user_id, topic, progress, test_mode, log_version,
+                                           topic_problems_by_prefix)
+    except RuntimeError:
+        return
+
+    with _prefetch_lock:
+        if len(_prefetch_cache) >= PREFETCH_MAX_ENTRIES and user_id not in _prefetch_cache:
+            _prefetch_cache.pop(next(iter(_prefetch_cache)))
+        _prefetch_cache[user_id] = (key, future)
+
+def take_prefetch(user_id, problem_id, progress, test_mode, log_version):
+    """先読み結果を取り出す（キー不一致・未完了・失敗ならNone）"""
+    with _prefetch_lock:
+        entry = _prefetch_cache.pop(user_id, None)
+
+    if not entry:
+        return None
+
+    key, future = entry
+    if key != get_prefetch_key(problem_id, progress, test_mode, log_version) or not future.done():
+        return None
+
+    try:
+        return future.result()
+    except Exception as e:
+        return None
+
+def get_topic_prefix(topic):
+    """構文名から問題IDのプレフィックスを取得"""
+    topic_prefix_map = {
+        'SELECT': 'SELECT_',
+        'WHERE': 'WHERE_',
+        'ORDER BY': 'ORDERBY_',
+        'ORDERBY': 'ORDERBY_',
+        '集約関数': 'AGG_',
+        'GROUP BY': 'GROUPBY_',
+        'GROUPBY': 'GROUPBY_',
+        'HAVING': 'HAVING_',
+        'JOIN': 'JOIN_',
+        'サブクエリ': 'SUBQUERY_'
+    }
+    return topic_prefix_map.get(topic, 'SELECT_')
+
 def login_page():
-    return """<!doctype html><html><head><title>SQL学習支援システム - ログイン</title><meta charset="utf-8"><style>body{font-family:Arial,sans-serif;margin:0;padding:0;display:flex;justify-content:center;align-items:center;min-height:100vh;background:linear-gradient(135deg,#667eea 0%,#764ba2 100%)}.login-container{background:white;padding:40px;border-radius:10px;box-shadow:0 10px 25px rgba(0,0,0,0.2);width:100%;max-width:400px}h1{text-align:center;color:#333;margin-bottom:30px}.form-group{margin:20px 0}label{display:block;margin-bottom:8px;color:#555;font-weight:bold}input[type="text"]{width:100%;padding:12px;font-size:16px;border:2px solid #ddd;border-radius:5px;box-sizing:border-box;transition:border-color 0.3s}input[type="text"]:focus{outline:none;border-color:#667eea}input[type="submit"]{width:100%;padding:12px;font-size:18px;background-color:#667eea;color:white;border:none;border-radius:5px;cursor:pointer;transition:background-color 0.3s}input[type="submit"]:hover{background-color:#5568d3}.info{text-align:center;color:#666;font-size:14px;margin-top:20px}</style></head><body><div class="login-container"><h1>SQL学習支援システム</h1><form action='/login' method='post'><div class="form-group"><label for="user_id">ユーザーID:</label><input type="text" id="user_id" name="user_id" required placeholder="例: student001" autofocus></div><input type="submit" value="ログイン"></form><div class="info">※ ユーザーIDを入力してログインしてください</div></div></body></html>"""
+    return render_template("login.html")
 
 def home_page():
     user_id = session.get('user_id', 'ゲスト')
@@ -1199,65 +2271,62 @@ def home_page():
     hours, minutes, elapsed_minutes = get_time_display()
     progress_percentage = get_progress_percentage(elapsed_minutes)
     
-    test_mode_indicator = ""
-    if is_test_mode():
-        test_mode_indicator = """
-        <div style='background-color:#fff3cd;padding:15px;border-radius:5px;margin:20px 0;border-left:5px solid #ffc107;'>
-            <h3>🧪 テストモード ON</h3>
-            <p>各形式<strong>2問ずつ</strong>で次の形式に進みます（テスト用）</p>
-            <a href='/test_mode' style='color:#856404;text-decoration:underline;'>テストモードをOFFにする</a>
-        </div>
-        """
-    else:
-        test_mode_indicator = """
-        <div style='text-align:center;margin:20px 0;'>
-            <a href='/test_mode' style='color:#667eea;text-decoration:underline;font-size:14px;'>🧪 テストモードをONにする（開発者用）</a>
-        </div>
-        """
-    
-    time_display = f"""
-    <script>
-    setInterval(function() {{
-        fetch('/save_session_time', {{method: 'POST'}});
-    }}, 5 * 60 * 1000);
-    
-    window.addEventListener('beforeunload', function() {{
-        navigator.sendBeacon('/save_session_time');
-    }});
-    </script>
-    
-    <div style='background-color:#e3f2fd;padding:20px;border-radius:10px;margin:20px 0;border-left:5px solid #2196f3;'>
-        <h3 style='margin-top:0;'>⏱️ 学習時間</h3>
-        <div style='font-size:32px;font-weight:bold;color:#1976d2;margin:10px 0;'>
-            {hours}時間 {minutes}分
-        </div>
-        <div style='background-color:#e0e0e0;border-radius:10px;height:30px;overflow:hidden;margin:15px 0;'>
-            <div style='background:linear-gradient(90deg, #4caf50 0%, #8bc34a 100%);height:100%;width:{progress_percentage}%;transition:width 0.3s;display:flex;align-items:center;justify-content:center;color:white;font-weight:bold;'>
-                {progress_percentage}%
-            </div>
-        </div>
-        <p style='margin:5px 0;color:#666;font-size:14px;'>
-            目標: 8時間（480分） | 残り: {max(0, 480 - elapsed_minutes)}分
-        </p>
-        <div style='margin-top:15px;'>
-            <form action='/reset_timer' method='post' style='display:inline;'>
-                <button type='submit' style='background-color:#ff9800;color:white;padding:8px 15px;border:none;border-radius:5px;cursor:pointer;font-size:14px;' onclick='return confirm(\"学習時間をリセットしますか？（学習履歴は保持されます）\")'>
-                    ⏱️ 学習時間をリセット
-                </button>
-            </form>
-        </div>
-    </div>
-    """
-    
-    time_notice = ""
-    if elapsed_minutes >= 60 and elapsed_minutes % 60 < 5:
-        time_notice = f"""<div style='background-color:#fff3cd;padding:15px;border-radius:5px;margin:20px 0;border-left:5px solid #ffc107;'>
-        <h3>⏰ 休憩のお知らせ</h3>
-        <p>学習開始から<strong>{hours}時間{minutes}分</strong>経過しました。</p>
-        <p>適度な休憩を取ることをお勧めします！目を休めて、水分補給をしましょう。</p>
-        </div>"""
-    
-    return f"""<!doctype html><html><head><title>SQL学習支援システム</title><meta charset="utf-8"><style>body{{font-family:Arial,sans-serif;margin:20px}}.container{{max-width:700px;margin:0 auto}}.user-info{{background-color:#f0f0f0;padding:15px;border-radius:5px;margin-bottom:20px;display:flex;justify-content:space-between;align-items:center}}.user-name{{font-weight:bold;color:#333}}.logout-button{{background-color:#dc3545;color:white;padding:8px 15px;border:none;border-radius:5px;cursor:pointer;text-decoration:none;font-size:14px}}.logout-button:hover{{background-color:#c82333}}select,input[type="submit"]{{padding:10px;margin:5px;font-size:16px}}.form-group{{margin:15px 0}}.continue-button{{background-color:#28a745;color:white}}.adaptive-section{{background-color:#e3f2fd;padding:20px;border-radius:10px;margin:20px 0;border-left:5px solid #2196f3}}.adaptive-section h3{{margin-top:0;color:#1976d2}}.group-buttons{{display:flex;gap:15px;margin-top:15px}}.group-button{{flex:1;padding:15px;background-color:#fff;border:2px solid #2196f3;border-radius:8px;cursor:pointer;transition:all 0.3s;text-align:center}}.group-button:hover{{background-color:#2196f3;color:white;transform:translateY(-2px);box-shadow:0 4px 8px rgba(0,0,0,0.2)}}.group-button h4{{margin:0 0 10px 0}}.group-button p{{margin:5px 0;font-size:14px;line-height:1.6}}.group-button-link{{text-decoration:none;color:inherit;display:block}}</style></head><body><div class="container"><div class="user-info"><span class="user-name">ログイン中: {user_id}</span><a href="/logout" class="logout-button">ログアウト</a></div><h1>SQL学習支援システム</h1>{test_mode_indicator}{time_display}{time_notice}<div class="adaptive-section"><h3>🎯 適応的学習モード（推奨）</h3><p>意味説明問題を含む4つの形式で学習し、正答率に応じて自動的に形式が変わります。</p><div class="group-buttons"><a href="/select_group?group=A" class="group-button-link"><div class="group-button"><h4>📘 グループA</h4><p>✅ 意味説明あり</p><p>✅ GPTフィードバックあり</p><p>✅ 出題形式動的変化</p></div></a><a href="/select_group?group=B" class="group-button-link"><div class="group-button"><h4>📕 グループB</h4><p>✅ 意味説明あり</p><p>❌ GPTフィードバックなし</p><p>✅ 出題形式動的変化</p><p style="font-size:12px;color:#666;margin-top:8px;">※不正解時は正解例のみ表示</p></div></a></div></div><form action="/history" method="get" style="margin-top:20px;"><input type="submit" value="履歴を見る"></form><form action="/stats" method="get" style="margin-top: 10px;"><input type="submit" value="学習統計を見る" style="background-color: #667eea;"></form><form action="/export_csv" method="get" style="margin-top: 10px;"><input type="submit" value="📥 学習履歴をダウンロード (CSV)" style="background-color: #28a745;"></form></div></body></html>"""
+    return render_template("home.html", user_id=user_id, test_mode=is_test_mode(),
+                           hours=hours, minutes=minutes, elapsed_minutes=elapsed_minutes,
+                           progress_percentage=progress_percentage)
+
+def get_latest_log(user_id):
+    """ユーザーの最新の回答の (id, UNIX時間)。回答がなければ (0, None)"""
+    try:
+        conn = get_read_connection(consistent=True)
+        cursor = conn.cursor()
+        placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+        cursor.execute(f'''
+            SELECT id, timestamp FROM logs
+            WHERE user_id = {placeholder}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ''', (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        if row:
+            return row[0], to_epoch(row[1])
+    except Exception as e:
+        pass
+    return 0, None
+
+def page_validators(user_id, *extra):
+    """ユーザーの最新の回答 id から画面の ETag と Last-Modified を決める"""
+    latest_id, latest_time = get_latest_log(user_id)
+    key = repr((TEMPLATE_VERSION, user_id, latest_id) + extra)
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    last_modified = datetime.fromtimestamp(latest_time, timezone.utc) if latest_time is not None else None
+    return etag, last_modified
+
+def is_page_modified(etag, last_modified):
+    return is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+def conditional_page(body, etag, last_modified, status=200):
+    """ETag・Last-Modified を付け、表示のたびにブラウザに再検証させる"""
+    response = app.make_response((body, status))
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# 履歴ページの1ページあたりの件数
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+# 履歴ページで表示する文字数（これを超えたら「...」で省略）
+HISTORY_CELL_LENGTH = 100
+
+def format_history_cell(value):
+    text = str(value)
+    if value and len(text) > HISTORY_CELL_LENGTH:
+        text = text[:HISTORY_CELL_LENGTH] + "..."
+    return text
 
 @app.route("/history")
 def history():
@@ -1266,31 +2335,76 @@ def history():
     user_id = session['user_id']
     
     try:
-        conn = get_db_connection()
+        per_page = int(request.args.get('per_page', HISTORY_PAGE_SIZE))
+    except ValueError:
+        per_page = HISTORY_PAGE_SIZE
+    per_page = max(1, min(per_page, HISTORY_MAX_PAGE_SIZE))
+    
+    validators = page_validators(user_id, request.query_string)
+    if not is_page_modified(*validators):
+        return conditional_page('', *validators, status=304)
+    
+    try:
+        before_timestamp = to_db_time(request.args.get('before_timestamp'))
+        before_id = int(request.args.get('before_id', ''))
+    except ValueError:
+        before_timestamp = None
+        before_id = None
+    
+    try:
+        # ETag・Last-Modified（page_validators）と同じく、直前の回答まで反映された接続で読む
+        # （遅れたレプリカの古い内容を新しい ETag で返すと、次の回答まで 304 で古いまま表示される）
+        conn = get_read_connection(consistent=True)
         cursor = conn.cursor()
         
-        if DB_TYPE == "postgresql":
-            cursor.execute('SELECT * FROM logs WHERE user_id = %s ORDER BY timestamp DESC', (user_id,))
+        placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+        # 長い列は表示に必要な分だけ読む
+        cut = HISTORY_CELL_LENGTH + 1
+        columns = f'''id, user_id, timestamp, problem_id, format,
+                   SUBSTR(user_sql, 1, {cut}), SUBSTR(user_explanation, 1, {cut}),
+                   sql_result, SUBSTR(sql_feedback, 1, {cut}),
+                   meaning_result, SUBSTR(meaning_feedback, 1, {cut})'''
+        
+        # (timestamp, id) のキーセットで前のページの続きから読む
+        if before_timestamp is not None and before_id is not None:
+            cursor.execute(f'''
+                SELECT {columns}
+                FROM logs 
+                WHERE user_id = {placeholder} 
+                AND (timestamp < {placeholder} OR (timestamp = {placeholder} AND id < {placeholder}))
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT {placeholder}
+            ''', (user_id, before_timestamp, before_timestamp, before_id, per_page + 1))
         else:
-            cursor.execute('SELECT * FROM logs WHERE user_id = ? ORDER BY timestamp DESC', (user_id,))
+            cursor.execute(f'''
+                SELECT {columns}
+                FROM logs 
+                WHERE user_id = {placeholder} 
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT {placeholder}
+            ''', (user_id, per_page + 1))
         
         rows = cursor.fetchall()
         conn.close()
         
-        if not rows:
-            return f"""<h1>学習履歴</h1><p>ユーザー「{user_id}」の学習履歴がありません。</p><br><a href='/home'>ホームに戻る</a>"""
+        if not rows and before_timestamp is None:
+            return f"""<h1>学習履歴</h1><p>ユーザー「{html.escape(user_id)}」の学習履歴がありません。</p><br><a href='/home'>ホームに戻る</a>"""
         
-        table_html = f"""<style>table{{border-collapse:collapse;width:100%}}th,td{{border:1px solid #ddd;padding:8px;text-align:left}}th{{background-color:#f2f2f2}}.container{{max-width:1200px;margin:20px auto}}</style><div class="container"><h1>学習履歴（ユーザー: {user_id}）</h1><table><tr><th>ID</th><th>ユーザーID</th><th>日時</th><th>問題ID</th><th>形式</th><th>学習者SQL</th><th>学習者説明</th><th>SQL結果</th><th>SQLフィードバック</th><th>意味結果</th><th>意味フィードバック</th></tr>"""
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
         
-        for row in rows:
-            table_html += "<tr>"
-            for v in row:
-                display_value = str(v)[:100] + "..." if v and len(str(v)) > 100 else str(v)
-                table_html += f"<td>{display_value}</td>"
-            table_html += "</tr>"
+        newest_url = None
+        if before_timestamp is not None:
+            newest_url = f"/history?per_page={per_page}"
+        older_url = None
+        if has_next:
+            last_row = rows[-1]
+            query = urlencode({'before_timestamp': to_epoch(last_row[2]), 'before_id': last_row[0], 'per_page': per_page})
+            older_url = f"/history?{query}"
         
-        table_html += """</table><br><a href='/home'>ホームに戻る</a></div>"""
-        return table_html
+        cells = [[format_history_cell(v) for v in row[:2] + (format_timestamp(row[2]),) + tuple(row[3:])] for row in rows]
+        return conditional_page(render_template("history.html", user_id=user_id, rows=cells,
+                                                newest_url=newest_url, older_url=older_url), *validators)
     except Exception as e:
         return f"""<h1>学習履歴</h1><p>履歴の読み込み中にエラーが発生しました: {e}</p><pre>{traceback.format_exc()}</pre><br><a href='/home'>ホームに戻る</a>"""
 
@@ -1303,7 +2417,7 @@ def check_sqlite():
     
     if exists:
         import sqlite3
-        conn = sqlite3.connect(sqlite_file)
+        conn = sqlite3.connect(f"file:{sqlite_file}?mode=ro", uri=True)
         cursor = conn.cursor()
         
         cursor.execute("SELECT user_id, COUNT(*) FROM logs GROUP BY user_id")
@@ -1335,68 +2449,164 @@ def check_sqlite():
         <br><a href='/home'>ホームに戻る</a>
         """
 
+@app.route("/migrate_sqlite_to_postgres", methods=["GET", "POST"])
+def migrate_sqlite_to_postgres():
+    """学習履歴.db を PostgreSQL に移行（管理者用、途中で止まっても再実行で続きから）"""
+    if not is_admin_request():
+        return "Forbidden（?token= に管理者用トークンを指定してください）", 403
+
+    sqlite_file = "学習履歴.db"
+    if DB_TYPE != "postgresql":
+        return "<h1>移行先の PostgreSQL（DATABASE_URL）が設定されていません</h1><br><a href='/home'>ホームに戻る</a>"
+    if not os.path.exists(sqlite_file):
+        return f"<h1>❌ {sqlite_file} が見つかりません</h1><br><a href='/home'>ホームに戻る</a>"
+
+    import sqlite_to_postgres
+    sqlite_conn = sqlite3.connect(sqlite_file)
+    pg_conn = get_db_connection()
+    try:
+        if request.method == "POST":
+            result = sqlite_to_postgres.migrate(sqlite_conn, pg_conn)
+            
+            if LOG_PARTITION in ("month", "semester"):
+                try:
+                    partition_postgresql_logs(pg_conn.cursor(), LOG_PARTITION)
+                    class_dashboard.create_summaries(pg_conn.cursor(), DB_TYPE)
+                    pg_conn.commit()
+                except Exception as e:
+                    pg_conn.rollback()
+
+            # 移行した履歴を反映させるため、このワーカーのキャッシュを捨てる
+            with _recent_verdicts_lock:
+                _recent_verdicts.clear()
+            with _problem_selectors_lock:
+                _problem_selectors.clear()
+            try:
+                stats_cache.clear()
+            except Exception as e:
+                pass
+
+            return f"""
+            <h1>✅ 移行が完了しました</h1>
+            <p>logs: {result['logs']}件 / learning_progress: {result['learning_progress']}件</p>
+            <p>{result['seconds']:.2f}秒（{result['rows_per_second']:,.0f} 件/秒）</p>
+            <br><a href='/home'>ホームに戻る</a>
+            """
+
+        pending = sqlite_to_postgres.count_pending_logs(sqlite_conn, pg_conn)
+        query = html.escape(urlencode({'token': request.args.get("token", "")}))
+        return f"""
+        <h1>SQLite → PostgreSQL 移行</h1>
+        <p>未移行の logs: {pending}件</p>
+        <form method="post" action="/migrate_sqlite_to_postgres?{query}">
+            <input type="submit" value="移行を開始する">
+        </form>
+        <br><a href='/check_sqlite'>戻る</a>
+        """
+    except Exception as e:
+        return f"<h1>移行中にエラーが発生しました</h1><p>{html.escape(str(e))}</p><pre>{html.escape(traceback.format_exc())}</pre><br><a href='/home'>ホームに戻る</a>"
+    finally:
+        sqlite_conn.close()
+        pg_conn.close()
+
 @app.route("/stats")
 def stats():
     if 'user_id' not in session:
         return redirect('/')
     
     user_id = session['user_id']
+    validators = page_validators(user_id)
+    if not is_page_modified(*validators):
+        return conditional_page('', *validators, status=304)
+    
     stats_data = get_user_statistics(user_id)
     detailed_stats = get_detailed_statistics(user_id)
     
     if not stats_data:
         return f"""<h1>学習統計</h1><p>ユーザー「{user_id}」の学習データがありません。</p><br><a href='/home'>ホームに戻る</a>"""
     
-    recent_html = ""
+    recent = []
     for log in stats_data['recent_logs']:
-        timestamp, problem_id, sql_result, meaning_result = log
-        result = sql_result if sql_result else meaning_result
-        recent_html += f"<tr><td>{timestamp}</td><td>{problem_id}</td><td>{result}</td></tr>"
-    
-    detailed_html = ""
-    topic_names = {
-        'SELECT': 'SELECT句',
-        'WHERE': 'WHERE句',
-        'ORDERBY': 'ORDER BY句',
-        '集約関数': '集約関数',
-        'GROUPBY': 'GROUP BY句',
-        'HAVING': 'HAVING句',
-        'JOIN': 'JOIN句',
-        'サブクエリ': 'サブクエリ'
-    }
+        timestamp, problem_id, verdict = log
+        result = VERDICT_LABELS.get(verdict, VERDICT_LABELS[adaptive_engine.VERDICT_INCORRECT])
+        recent.append((format_timestamp(timestamp), problem_id, result))
     
+    detailed = []
     for topic in TOPICS:
-        if topic in detailed_stats and any(detailed_stats[topic][f]['total'] > 0 for f in ['選択式', '穴埋め式', '記述式', '意味説明']):
-            detailed_html += f"""
-            <details style="margin: 20px 0; border: 1px solid #ddd; border-radius: 5px; padding: 10px;">
-                <summary style="cursor: pointer; font-weight: bold; font-size: 18px; padding: 10px;">
-                    📊 {topic_names[topic]}
-                </summary>
-                <table style="margin-top: 10px;">
-                    <tr>
-                        <th>形式</th>
-                        <th>回答数</th>
-                        <th>正解数</th>
-                        <th>正解率</th>
-                    </tr>
-            """
-            
-            for format_name in ['選択式', '穴埋め式', '記述式', '意味説明']:
-                stat = detailed_stats[topic][format_name]
-                if stat['total'] > 0:
-                    detailed_html += f"""
-                    <tr>
-                        <td>{format_name}</td>
-                        <td>{stat['total']}</td>
-                        <td>{stat['correct']}</td>
-                        <td>{stat['accuracy']}%</td>
-                    </tr>
-                    """
-            
-            detailed_html += "</table></details>"
+        if topic in detailed_stats and any(detailed_stats[topic][f]['total'] > 0 for f in FORMATS):
+            format_rows = [(format_name, detailed_stats[topic][format_name]) for format_name in FORMATS
+                           if detailed_stats[topic][format_name]['total'] > 0]
+            detailed.append((TOPIC_NAMES[topic], format_rows))
     
-    html = f"""<!doctype html><html><head><title>学習統計 - SQL学習支援システム</title><meta charset="utf-8"><style>body{{font-family:Arial,sans-serif;margin:20px;background-color:#f5f5f5}}.container{{max-width:800px;margin:0 auto;background:white;padding:30px;border-radius:10px;box-shadow:0 2px 10px rgba(0,0,0,0.1)}}h1{{color:#333;border-bottom:3px solid #667eea;padding-bottom:10px}}.stat-box{{background:linear-gradient(135deg,#667eea 0%,#764ba2 100%);color:white;padding:20px;border-radius:10px;margin:20px 0;text-align:center}}.stat-box h2{{margin:0;font-size:48px}}.stat-box p{{margin:5px 0 0 0;font-size:18px}}.stats-grid{{display:grid;grid-template-columns:1fr 1fr;gap:20px;margin:20px 0}}.stat-card{{background:#f9f9f9;padding:20px;border-radius:8px;border-left:4px solid #667eea}}.stat-card h3{{margin:0 0 10px 0;color:#555;font-size:14px}}.stat-card .number{{font-size:32px;font-weight:bold;color:#333}}table{{width:100%;border-collapse:collapse;margin-top:20px}}th,td{{padding:12px;text-align:left;border-bottom:1px solid #ddd}}th{{background-color:#667eea;color:white}}details summary{{background-color:#f0f0f0;}}details[open] summary{{background-color:#e3f2fd;}}.back-link{{display:inline-block;margin-top:20px;padding:10px 20px;background-color:#667eea;color:white;text-decoration:none;border-radius:5px}}.back-link:hover{{background-color:#5568d3}}</style></head><body><div class="container"><h1>📊 学習統計（ユーザー: {user_id}）</h1><div class="stat-box"><h2>{stats_data['overall_accuracy']}%</h2><p>全体の正解率</p></div><div class="stats-grid"><div class="stat-card"><h3>総回答数</h3><div class="number">{stats_data['total_count']}</div></div><div class="stat-card" style="border-left-color:#28a745;"><h3>正解数</h3><div class="number" style="color:#28a745;">{stats_data['correct_count']}</div></div><div class="stat-card" style="border-left-color:#ffc107;"><h3>部分正解数</h3><div class="number" style="color:#ffc107;">{stats_data['partial_count']}</div></div><div class="stat-card" style="border-left-color:#dc3545;"><h3>不正解数</h3><div class="number" style="color:#dc3545;">{stats_data['incorrect_count']}</div></div></div><h2>📈 構文別・形式別の正解率</h2>{detailed_html}<h2>📝 最近の学習履歴（10件）</h2><table><tr><th>日時</th><th>問題ID</th><th>結果</th></tr>{recent_html}</table><a href="/home" class="back-link">ホームに戻る</a></div></body></html>"""
-    return html
+    return conditional_page(render_template("stats.html", user_id=user_id, stats=stats_data,
+                                            detailed=detailed, recent=recent), *validators)
+
+# CSVエクスポートで一度にDBから読む行数
+EXPORT_FETCH_SIZE = 500
+
+CSV_HEADER = ['ユーザーID', '日時', '問題ID', '形式', 'ユーザーSQL', 
+              'ユーザー説明', 'SQL結果', 'SQLフィードバック', 
+              '意味結果', '意味フィードバック']
+
+def is_admin_request():
+    """管理者用トークン（環境変数 ADMIN_TOKEN）が一致するか"""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token:
+        return False
+    token = request.headers.get("X-Admin-Token") or request.args.get("token", "")
+    return hmac.compare_digest(token.encode('utf-8'), admin_token.encode('utf-8'))
+
+def open_log_export_cursor(user_id=None):
+    """エクスポート用にlogsを読むカーソルを開く（PostgreSQLはサーバーサイドカーソル）"""
+    conn = get_read_connection()
+    
+    if DB_TYPE == "postgresql":
+        cursor = conn.cursor(name='export_logs')
+        cursor.itersize = EXPORT_FETCH_SIZE
+    else:
+        cursor = conn.cursor()
+    
+    placeholder = '%s' if DB_TYPE == "postgresql" else '?'
+    columns = '''user_id, timestamp, problem_id, format, user_sql, user_explanation,
+                   sql_result, sql_feedback, meaning_result, meaning_feedback'''
+    try:
+        if user_id:
+            cursor.execute(f'''
+                SELECT {columns}
+                FROM logs 
+                WHERE user_id = {placeholder}
+                ORDER BY timestamp DESC
+            ''', (user_id,))
+        else:
+            cursor.execute(f'''
+                SELECT {columns}
+                FROM logs 
+                ORDER BY user_id, id
+            ''')
+    except Exception:
+        conn.close()
+        raise
+    
+    return conn, cursor
+
+def generate_log_csv(cursor):
+    """BOM付きCSVをバッチごとにエンコードして返す（全件をメモリに載せない）
+    
+    接続は返すレスポンスの call_on_close で閉じる（送信前に切断されてジェネレーターが始まらなくても閉じる）
+    """
+    si = StringIO()
+    writer = csv.writer(si)
+    writer.writerow(CSV_HEADER)
+    yield ('\ufeff' + si.getvalue()).encode('utf-8')
+    
+    while True:
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            break
+        si.seek(0)
+        si.truncate(0)
+        writer.writerows((row[0], format_timestamp(row[1])) + tuple(row[2:]) for row in rows)
+        yield si.getvalue().encode('utf-8')
 
 @app.route("/export_csv")
 def export_csv():
@@ -1404,56 +2614,215 @@ def export_csv():
     if 'user_id' not in session:
         return redirect('/')
     
-    import csv
-    from io import StringIO
-    from flask import Response
-    
     user_id = session.get('user_id')
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if DB_TYPE == "postgresql" else '?'
-        cursor.execute(f'''
-            SELECT user_id, timestamp, problem_id, format, user_sql, user_explanation,
-                   sql_result, sql_feedback, meaning_result, meaning_feedback
-            FROM logs 
-            WHERE user_id = {placeholder}
-            ORDER BY timestamp DESC
-        ''', (user_id,))
+        conn, cursor = open_log_export_cursor(user_id)
         
-        rows = cursor.fetchall()
-        
-        if DB_TYPE == "postgresql":
-            columns = [desc[0] for desc in cursor.description]
-        else:
-            columns = [description[0] for description in cursor.description]
-        
-        conn.close()
-        
-        si = StringIO()
-        writer = csv.writer(si)
-        
-        writer.writerow(['ユーザーID', '日時', '問題ID', '形式', 'ユーザーSQL', 
-                        'ユーザー説明', 'SQL結果', 'SQLフィードバック', 
-                        '意味結果', '意味フィードバック'])
-        
-        writer.writerows(rows)
+        response = Response(
+            generate_log_csv(cursor),
+            mimetype="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f"attachment;filename=learning_history_{user_id}.csv"}
+        )
+        response.call_on_close(conn.close)
+        return response
         
-        output = si.getvalue()
-        bom = '\ufeff'
-        output_with_bom = bom + output
+    except Exception as e:
+        return f"エラー: {e}<br><pre>{traceback.format_exc()}</pre>"
+
+@app.route("/admin/export_csv")
+def admin_export_csv():
+    """全ユーザーの学習履歴をCSV形式でエクスポート（管理者用）"""
+    if not is_admin_request():
+        return "Forbidden", 403
+    
+    try:
+        conn, cursor = open_log_export_cursor()
         
-        return Response(
-            output_with_bom.encode('utf-8'),
+        response = Response(
+            generate_log_csv(cursor),
             mimetype="text/csv; charset=utf-8",
-            headers={"Content-Disposition": f"attachment;filename=learning_history_{user_id}.csv"}
+            headers={"Content-Disposition": "attachment;filename=learning_history_all.csv"}
         )
+        response.call_on_close(conn.close)
+        return response
         
     except Exception as e:
         return f"エラー: {e}<br><pre>{traceback.format_exc()}</pre>"
 
+# ダッシュボードの集計を作り直す間隔（秒）。0 ならアプリでは作り直さない（tools/refresh_dashboard.py を cron 等で実行）
+DASHBOARD_REFRESH_SECONDS = int(os.environ.get("DASHBOARD_REFRESH_SECONDS", "300"))
+# この時間（分）以内に回答した学習者を「学習中」として表示する
+DASHBOARD_ACTIVE_MINUTES = 30
+
+# 集計を作り直すスレッドを起動したプロセス（gunicorn の fork 後はワーカーごとに起動し直す）
+_summary_refresher_pid = None
+_summary_refresher_lock = threading.Lock()
+
+def refresh_dashboard_summaries(max_age=0):
+    conn = get_db_connection()
+    try:
+        return class_dashboard.refresh_summaries(conn, DB_TYPE, max_age)
+    finally:
+        conn.close()
+
+def _summary_refresh_loop():
+    while True:
+        try:
+            # ほかのワーカーが間隔内に作り直していれば何もしない
+            refresh_dashboard_summaries(max_age=DASHBOARD_REFRESH_SECONDS)
+        except Exception as e:
+            pass
+        time.sleep(DASHBOARD_REFRESH_SECONDS)
+
+@app.before_request
+def start_summary_refresher():
+    global _summary_refresher_pid
+    if DASHBOARD_REFRESH_SECONDS <= 0 or _summary_refresher_pid == os.getpid():
+        return
+    with _summary_refresher_lock:
+        if _summary_refresher_pid != os.getpid():
+            threading.Thread(target=_summary_refresh_loop, daemon=True).start()
+            _summary_refresher_pid = os.getpid()
+
+@app.route("/admin/dashboard")
+def admin_dashboard():
+    """教員用ダッシュボード（集計ビュー・テーブルだけを読む）"""
+    if not is_admin_request():
+        return "Forbidden", 403
+    
+    token_query = urlencode({'token': request.args.get("token", "")})
+    try:
+        conn = get_read_connection()
+        cursor = conn.cursor()
+        if class_dashboard.get_refreshed_at(cursor, DB_TYPE) is None:
+            conn.close()
+            return render_template("dashboard.html", dashboard=None, token_query=token_query)
+        dashboard = class_dashboard.load_dashboard(cursor, DB_TYPE, current_epoch() - DASHBOARD_ACTIVE_MINUTES * 60)
+        conn.close()
+    except Exception as e:
+        return f"エラー: {e}<br><pre>{traceback.format_exc()}</pre>"
+    
+    dashboard['refreshed_at'] = format_timestamp(dashboard['refreshed_at'])
+    for student in dashboard['active']:
+        student['last_answer'] = format_timestamp(student['last_answer'])
+    return render_template("dashboard.html", dashboard=dashboard, token_query=token_query,
+                           topic_names=TOPIC_NAMES, buckets=class_dashboard.ACCURACY_BUCKETS,
+                           active_minutes=DASHBOARD_ACTIVE_MINUTES)
+
+@app.route("/admin/dashboard/refresh", methods=["POST"])
+def admin_dashboard_refresh():
+    """集計を今すぐ作り直す"""
+    if not is_admin_request():
+        return "Forbidden", 403
+    try:
+        refresh_dashboard_summaries()
+    except Exception as e:
+        return f"エラー: {e}<br><pre>{traceback.format_exc()}</pre>"
+    return redirect(f"/admin/dashboard?{urlencode({'token': request.args.get('token', '')})}")
+
+@app.route("/admin/problem_stats")
+def admin_problem_stats():
+    """問題ごとの難しさ（problem_stats を正解率の低い順に）"""
+    if not is_admin_request():
+        return "Forbidden", 403
+    
+    try:
+        conn = get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT problem_id, attempts, correct, partial, timed_attempts, total_answer_seconds
+            FROM problem_stats
+            WHERE attempts > 0
+            ORDER BY (correct + partial * 0.5) * 1.0 / attempts, attempts DESC
+        ''')
+        rows = cursor.fetchall()
+        conn.close()
+    except Exception as e:
+        return f"エラー: {e}<br><pre>{traceback.format_exc()}</pre>"
+    
+    problems = [dict(problem_id=problem_id, **problem_stats_entry(attempts, correct, partial, timed_attempts, total_seconds))
+                for problem_id, attempts, correct, partial, timed_attempts, total_seconds in rows]
+    return render_template("problem_stats.html", problems=problems,
+                           token_query=urlencode({'token': request.args.get("token", "")}))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """処理時間・エラー件数（Prometheus のテキスト形式。値はこのワーカーの分）"""
+    if not is_admin_request():
+        return "Forbidden", 403
+    if not metrics.ENABLED:
+        return "Not Found", 404
+
+    response = Response(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response.cache_control.no_store = True
+    return response
+
+# 管理者のリクエストに ?_profile=1 を付けると、応答の代わりに cProfile の結果（pstats のテキスト）を返す
+# ?_profile=raw なら pstats.Stats で読める .prof ファイル、&sort=tottime で並び順を変える
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'calls')
+# サンプリングの結果はワーカー間で共有するディレクトリに書き出す
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "sql_learning_profiles"))
+sampling_profiler = profiling.SamplingProfiler(PROFILE_DIR)
+
+@app.before_request
+def start_request_profile():
+    if request.args.get('_profile') and is_admin_request():
+        g.request_profile = profiling.RequestProfile()
+        g.request_profile.start()
+
+@app.after_request
+def finish_request_profile(response):
+    profile = g.pop('request_profile', None)
+    if profile is None:
+        return response
+    profile.stop()
+    
+    if request.args.get('_profile') == 'raw':
+        result = Response(profile.as_pstats_file(), mimetype='application/octet-stream')
+        result.headers['Content-Disposition'] = f'attachment; filename="{request.endpoint}.prof"'
+    else:
+        sort = request.args.get('sort')
+        result = Response(profile.as_text(sort if sort in PROFILE_SORT_KEYS else 'cumulative'), mimetype='text/plain')
+    # 計測したリクエスト本来のステータス
+    result.headers['X-Profiled-Status'] = str(response.status_code)
+    result.cache_control.no_store = True
+    return result
+
+@app.route("/admin/profile/sample", methods=["POST"])
+def admin_profile_sample():
+    """このワーカーでスタックのサンプリングを始める（?seconds=30&interval_ms=5）"""
+    if not is_admin_request():
+        return "Forbidden", 403
+    
+    try:
+        seconds = float(request.args.get("seconds", 30))
+        interval = float(request.args.get("interval_ms", 5)) / 1000
+    except ValueError:
+        return "seconds と interval_ms は数値で指定してください", 400
+    
+    name = sampling_profiler.start(seconds, interval)
+    if name is None:
+        return "このワーカーではサンプリング中です", 409
+    return Response(f"{name}\n", status=202, mimetype='text/plain')
+
+@app.route("/admin/profile/stacks")
+def admin_profile_stacks():
+    """サンプリング結果の一覧（?name= を付けるとそのファイルの collapsed 形式のスタック）"""
+    if not is_admin_request():
+        return "Forbidden", 403
+    
+    name = request.args.get("name")
+    if not name:
+        return Response(''.join(f"{output}\n" for output in sampling_profiler.list_outputs()), mimetype='text/plain')
+    
+    content = sampling_profiler.read_output(name)
+    if content is None:
+        return "Not Found", 404
+    response = Response(content, mimetype='text/plain')
+    response.cache_control.no_store = True
+    return response
+
 @app.route("/")
 def home():
     if 'user_id' not in session:
@@ -1509,80 +2878,7 @@ def test_mode():
     current_mode = session.get('test_mode', False)
     session['test_mode'] = not current_mode
     
-    new_status = "ON ✅" if session['test_mode'] else "OFF ❌"
-    threshold = "2問ずつ" if session['test_mode'] else "5問ずつ"
-    
-    return f"""
-    <!doctype html>
-    <html>
-    <head>
-        <title>テストモード設定</title>
-        <meta charset="utf-8">
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                margin: 20px;
-                background-color: #f5f5f5;
-            }}
-            .container {{
-                max-width: 600px;
-                margin: 50px auto;
-                background: white;
-                padding: 40px;
-                border-radius: 10px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                text-align: center;
-            }}
-            h1 {{
-                color: #333;
-            }}
-            .status {{
-                font-size: 48px;
-                margin: 20px 0;
-                font-weight: bold;
-                color: {'#28a745' if session['test_mode'] else '#dc3545'};
-            }}
-            p {{
-                font-size: 18px;
-                color: #666;
-                line-height: 1.6;
-            }}
-            .info-box {{
-                background-color: {'#fff3cd' if session['test_mode'] else '#e3f2fd'};
-                padding: 20px;
-                border-radius: 5px;
-                margin: 20px 0;
-                border-left: 5px solid {'#ffc107' if session['test_mode'] else '#2196f3'};
-            }}
-            .back-link {{
-                display: inline-block;
-                margin-top: 20px;
-                padding: 12px 30px;
-                background-color: #667eea;
-                color: white;
-                text-decoration: none;
-                border-radius: 5px;
-                font-size: 16px;
-            }}
-            .back-link:hover {{
-                background-color: #5568d3;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🧪 テストモード</h1>
-            <div class="status">{new_status}</div>
-            <div class="info-box">
-                <p><strong>現在の設定:</strong></p>
-                <p>各形式を<strong>{threshold}</strong>で次の形式に切り替わります。</p>
-                {'<p>⚠️ <strong>テストモード</strong>では、各形式2問で素早く全体をテストできます。</p>' if session['test_mode'] else '<p>通常モードでは、各形式5問で学習進捗を判定します。</p>'}
-            </div>
-            <a href="/home" class="back-link">ホームに戻る</a>
-        </div>
-    </body>
-    </html>
-    """
+    return render_template("test_mode.html", test_mode=session['test_mode'])
 
 @app.route("/debug_session")
 def debug_session_route():
@@ -1602,93 +2898,17 @@ def topic_explanation():
         return redirect('/')
     
     topic = request.args.get('topic', 'SELECT')
-    explanation_html = TOPIC_EXPLANATIONS.get(topic, '<p>説明が見つかりません。</p>')
-    
-    topic_names = {
-        'SELECT': 'SELECT句',
-        'WHERE': 'WHERE句',
-        'ORDERBY': 'ORDER BY句',
-        '集約関数': '集約関数',
-        'GROUPBY': 'GROUP BY句',
-        'HAVING': 'HAVING句',
-        'JOIN': 'JOIN句',
-        'サブクエリ': 'サブクエリ'
-    }
-    
-    topic_name = topic_names.get(topic, topic)
-    
-    html = f"""<!doctype html>
-<html>
-<head>
-    <title>{topic_name}の説明 - SQL学習支援システム</title>
-    <meta charset="utf-8">
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            margin: 20px;
-            background-color: #f5f5f5;
-        }}
-        .container {{
-            max-width: 800px;
-            margin: 0 auto;
-            background: white;
-            padding: 40px;
-            border-radius: 10px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }}
-        h2 {{
-            color: #667eea;
-            border-bottom: 3px solid #667eea;
-            padding-bottom: 10px;
-        }}
-        h3 {{
-            color: #555;
-            margin-top: 25px;
-        }}
-        pre {{
-            background-color: #f4f4f4;
-            padding: 15px;
-            border-left: 4px solid #667eea;
-            overflow-x: auto;
-            border-radius: 5px;
-        }}
-        code {{
-            background-color: #f4f4f4;
-            padding: 2px 6px;
-            border-radius: 3px;
-            font-family: monospace;
-        }}
-        ul {{
-            line-height: 1.8;
-        }}
-        .back-link {{
-            display: inline-block;
-            margin-top: 20px;
-            margin-right: 10px;
-            padding: 10px 20px;
-            background-color: #667eea;
-            color: white;
-            text-decoration: none;
-            border-radius: 5px;
-        }}
-        .back-link:hover {{
-            background-color: #5568d3;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        {explanation_html}
-        
-        <div style="margin-top: 20px;">
-            <a href="/practice?mode=adaptive&skip_explanation=1" class="back-link">← 学習に戻る</a>
-        </div>
-    </div>
-</body>
-</html>"""
-    return html
-
-HTML_TEMPLATE = """<!doctype html><html><head><title>SQL学習支援システム</title><meta charset="utf-8"><style>body{font-family:Arial,sans-serif;margin:20px}.container{max-width:800px;margin:0 auto}.back-buttons{margin:10px 0;padding:10px;background-color:#f0f0f0;border-radius:5px}.back-buttons button{padding:8px 15px;margin:5px;background-color:#6c757d;color:white;border:none;border-radius:5px;cursor:pointer;font-size:14px}.back-buttons button:hover{background-color:#5a6268}.return-button{background-color:#28a745 !important;margin-left:15px}.return-button:hover{background-color:#218838 !important}.adaptive-info{background-color:#e3f2fd;padding:10px;border-radius:5px;margin:10px 0}.adaptive-info-b{background-color:#ffe3e3;padding:10px;border-radius:5px;margin:10px 0}.time-notice{background-color:#fff3cd;padding:10px;border-radius:5px;margin:10px 0;border-left:5px solid #ffc107}.topic-link{display:inline-block;margin:10px 0;padding:8px 15px;background-color:#17a2b8;color:white;text-decoration:none;border-radius:5px;font-size:14px}.topic-link:hover{background-color:#138496}textarea{width:100%;padding:10px;font-size:14px}input[type="submit"],button{padding:10px 20px;font-size:16px}.result{background-color:#f9f9f9;padding:15px;border-left:4px solid #007cba;margin:15px 0}.result-correct{background-color:#e8f5e9;border-left:4px solid #4caf50}.result-incorrect{background-color:#ffebee;border-left:4px solid #f44336}pre{background-color:#f4f4f4;padding:10px;overflow-x:auto}.problem-section{margin:20px 0}.blank-template{background-color:#f0f8ff;padding:15px;border:1px solid #ccc;margin:10px 0}</style></head><body><div class="container"><h1><a href="/home" style="text-decoration:none;color:inherit" title="トップページに戻る">SQL学習支援システム</a></h1>{% if time_elapsed >= 60 %}<div class="time-notice">⏰ 学習開始から<strong>{{ time_elapsed }}分</strong>経過しました。適度な休憩をお勧めします！</div>{% endif %}<div><a href="/topic_explanation?topic={{ current_topic }}" class="topic-link">📖 {{ current_topic }}の説明を見る</a></div>{% if back_buttons %}<div class="back-buttons"><strong>📚 復習:</strong>{% for btn in back_buttons %}<form method="get" action="/practice" style="display:inline;"><input type="hidden" name="back_to_topic" value="{{ btn.topic }}"><input type="hidden" name="back_to_format" value="{{ btn.format }}"><button type="submit">{{ btn.label }}</button></form>{% endfor %}{% if is_reviewing %}<form method="get" action="/practice" style="display:inline;"><input type="hidden" name="return_to_main" value="1"><button type="submit" class="return-button">元の学習に戻る</button></form>{% endif %}</div>{% endif %}{% if mode == "adaptive" %}{% if enable_gpt_feedback %}<div class="adaptive-info">📘 <strong>グループA: 適応的学習モード</strong> | 現在: <strong>{{ current_topic }} - {{ current_format }}</strong> | GPTフィードバックあり</div>{% else %}<div class="adaptive-info-b">📕 <strong>グループB: 適応的学習モード</strong> | 現在: <strong>{{ current_topic }} - {{ current_format }}</strong> | GPTフィードバックなし（正解例のみ表示）</div>{% endif %}{% endif %}<form method="post"><input type="hidden" name="format" value="{{ current_format }}"><input type="hidden" name="mode" value="{{ mode }}"><div class="problem-section"><h3>問題 {{ problem.id }}: {{ current_format }}</h3>{% if current_format != "意味説明" %}<p><strong>問題:</strong> {{ problem.title }}</p>{% endif %}{% if current_format=="選択式" %}{% for choice in problem.choices %}{% if choice %}<label><input type="radio" name="student_sql" value="{{ choice }}"> {{ choice }}</label><br>{% endif %}{% endfor %}{% elif current_format=="穴埋め式" %}{% if problem.blank_template %}<div class="blank-template"><strong>穴埋め問題:</strong><br>{{ problem.blank_template }}</div><p><strong>{___} の部分に入る内容を入力してください:</strong></p><textarea name="student_sql" rows="2" cols="60" placeholder="穴埋め部分に入る内容を入力">{{ request.form.student_sql or "" }}</textarea>{% else %}<p>穴埋め問題のテンプレートが設定されていません。</p><textarea name="student_sql" rows="5" cols="80" placeholder="SQL文を入力">{{ request.form.student_sql or "" }}</textarea>{% endif %}{% elif current_format=="記述式" %}<textarea name="student_sql" rows="8" cols="80" placeholder="SQL文を入力してください">{{ request.form.student_sql or "" }}</textarea>{% elif current_format=="意味説明" %}<p><strong>以下のSQL文の意味を日本語で説明してください:</strong></p><pre>{{ problem.answer_sql }}</pre><textarea name="student_explanation" rows="6" cols="80" placeholder="SQL文の意味を日本語で詳しく説明してください">{{ request.form.student_explanation or "" }}</textarea>{% endif %}<br><br><input type="submit" value="評価する"></div></form>{% if result %}<div class="result {% if '正解' in (sql_result or exp_result) %}result-correct{% else %}result-incorrect{% endif %}"><h2>評価結果</h2>{% if current_format=="意味説明" %}<p><strong>結果:</strong> {{ exp_result }}</p>{% if enable_gpt_feedback and exp_feedback %}<p><strong>フィードバック:</strong></p><pre>{{ exp_feedback }}</pre>{% endif %}{% if not enable_gpt_feedback and '不正解' in exp_result and problem.explanation %}<p><strong>正解の説明:</strong></p><pre>{{ problem.explanation }}</pre>{% endif %}{% if enable_gpt_feedback and problem.explanation %}<p><strong>参考: 正解の説明</strong></p><pre>{{ problem.explanation }}</pre>{% endif %}{% else %}<p><strong>SQL評価:</strong> {{ sql_result }}</p>{% if enable_gpt_feedback and sql_feedback %}<p><strong>フィードバック:</strong></p><pre>{{ sql_feedback }}</pre>{% endif %}{% if not enable_gpt_feedback and '不正解' in sql_result and problem.answer_sql %}<p><strong>正解のSQL:</strong></p><pre>{{ problem.answer_sql }}</pre>{% endif %}{% if enable_gpt_feedback and problem.answer_sql %}<p><strong>参考: 正解のSQL</strong></p><pre>{{ problem.answer_sql }}</pre>{% endif %}{% endif %}<form method="get" action="/practice"><input type="hidden" name="format" value="{{ current_format }}"><input type="hidden" name="mode" value="{{ mode }}"><input type="hidden" name="next" value="1"><button type="submit">次の問題に進む</button></form></div>{% endif %}</div></body></html>"""
+    if topic not in _topic_pages:
+        return render_template("topic_explanation.html", topic_name=TOPIC_NAMES.get(topic, topic),
+                               explanation_html='<p>説明が見つかりません。</p>')
+    
+    # 同じ内容なら ETag で 304 を返し、有効期間内はブラウザのキャッシュを使わせる
+    page, etag = _topic_pages[topic]
+    response = Response(page, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = TOPIC_PAGE_MAX_AGE
+    return response.make_conditional(request)
 
 @app.route("/practice", methods=["GET", "POST"])
 def practice():
@@ -1706,13 +2926,7 @@ def practice():
     
     time_elapsed = get_time_elapsed()
     
-    all_problems = []
-    for sheet in ["Sheet1", "Sheet2", "Sheet3", "Sheet4", "Sheet5", "Sheet6", "Sheet7", "Sheet8"]:
-        try:
-            problems = load_problems(sheet)
-            all_problems.extend(problems)
-        except Exception as e:
-            pass
+    all_problems = get_problem_bank()
     
     if not all_problems:
         return """<h1>エラー</h1><p>問題ファイル (problems.xlsx) が見つからないか、問題が読み込めません。</p><a href='/home'>ホームに戻る</a>"""
@@ -1743,7 +2957,7 @@ def practice():
             'current_topic': start_topic,
             'current_format': '選択式',
             'format_question_count': 0,
-            'format_start_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            'format_start_time': current_epoch()
         }
         session['learning_progress'] = progress
     
@@ -1768,7 +2982,7 @@ def practice():
         topic_problems = [p for p in all_problems if p['id'].startswith(prefix)]
         
         if topic_problems:
-            selected_problem = random.choice(topic_problems)
+            selected_problem = select_topic_problem(user_id, back_to_topic, topic_problems)
             session["current_problem"] = selected_problem
             session['temp_format'] = back_to_format
             session['temp_topic'] = back_to_topic
@@ -1806,7 +3020,7 @@ def practice():
         topic_problems = [p for p in all_problems if p['id'].startswith(prefix)]
         
         if topic_problems:
-            selected_problem = random.choice(topic_problems)
+            selected_problem = select_topic_problem(user_id, current_topic, topic_problems)
             session["current_problem"] = selected_problem
             pass
     
@@ -1840,7 +3054,7 @@ def practice():
     if request.method == "POST":
         if "current_problem" not in session:
             if mode == "random":
-                session["remaining_problems"] = all_problems.copy()
+                session["remaining_problems"] = list(all_problems)
                 random.shuffle(session["remaining_problems"])
                 session["current_problem"] = session["remaining_problems"].pop()
             else:
@@ -1871,13 +3085,24 @@ def practice():
             else:
                 sql_result, sql_feedback = evaluate_sql(user_sql, problem["answer_sql"], eval_format, problem, enable_gpt_feedback)
 
+        # 問題を表示してから回答するまでの時間（次の回答はこの回答の時点から測る）
+        answer_seconds = None
+        shown = session.get('problem_shown')
+        if shown and shown[0] == problem["id"]:
+            answer_seconds = current_epoch() - shown[1]
+        session['problem_shown'] = [problem["id"], current_epoch()]
+        
         user_id = session.get('user_id', 'unknown')
-        save_log(user_id, problem["id"], eval_format, user_sql, user_exp, sql_result, sql_feedback, exp_result, exp_feedback)
+        save_log(user_id, problem["id"], eval_format, user_sql, user_exp, sql_result, sql_feedback, exp_result, exp_feedback,
+                 answer_seconds)
         
         if not session.get('is_reviewing'):
             problem_topic = extract_topic_from_problem_id(problem["id"])
             add_completed_format(problem_topic, eval_format)
 
+            if mode == "adaptive":
+                start_prefetch(user_id, problem, all_problems)
+
         result = True
     
     else:
@@ -1885,6 +3110,7 @@ def practice():
 
         if request.args.get("next") == "1":
             was_reviewing = session.get('is_reviewing', False)
+            prefetched_problem_id = None
             
             session.pop('temp_format', None)
             session.pop('temp_topic', None)
@@ -1904,69 +3130,17 @@ def practice():
                     'format_question_count': 0,
                     'format_start_time': None
                 })
-                current_format_for_check = progress['current_format']
-                start_time = progress.get('format_start_time')
-                
-                format_question_count = progress.get('format_question_count', 0) + 1
-                progress['format_question_count'] = format_question_count
-                session['learning_progress'] = progress
-                
-                threshold = get_format_question_threshold(current_format_for_check)
-
-                accuracy_data = get_recent_accuracy(user_id, topic, current_format_for_check, limit=threshold, start_time=start_time)
+                test_mode = is_test_mode()
+                log_version = get_log_version()
                 
-                pass
-                if start_time:
-                    pass
-                if accuracy_data:
-                    pass
+                # 回答評価時に先読みした結果があれば使い、なければここで計算する
+                prefetched = take_prefetch(user_id, last_problem["id"], progress, test_mode, log_version)
+                if prefetched:
+                    transition, prefetched_problem_id = prefetched
                 else:
-                    pass
-                
-                if format_question_count >= threshold and accuracy_data and accuracy_data['total'] >= threshold:
-                    
-                    pass
-                    
-                    if current_format_for_check == '意味説明':
-                        if accuracy_data['accuracy'] >= 70:
-                            add_completed_format(topic, '意味説明')
-                            
-                            current_index = TOPICS.index(topic) if topic in TOPICS else 0
-                            if current_index < len(TOPICS) - 1:
-                                next_topic = TOPICS[current_index + 1]
-                                next_format = '選択式'
-                                update_learning_progress(user_id, next_topic, next_format)
-                                current_format = next_format
-                                
-                                session.pop('topic_explained', None)
-                                
-                                pass
-                            else:
-                                pass
-                        else:
-                            next_format = '記述式'
-                            update_learning_progress(user_id, topic, next_format)
-                            current_format = next_format
-                            pass
-                    else:
-                        next_format = get_next_format(current_format_for_check, accuracy_data['accuracy'])
-                        
-                        pass
-                        
-                        if next_format != current_format_for_check:
-                            add_completed_format(topic, next_format)
-                            
-                            update_learning_progress(user_id, topic, next_format)
-                            current_format = next_format
-                            pass
+                    transition = compute_adaptive_transition(user_id, topic, progress, test_mode, log_version)
                 
-                save_learning_progress(
-                    user_id,
-                    progress.get('current_topic', 'SELECT'),
-                    progress.get('current_format', '選択式'),
-                    progress.get('format_question_count', 0),
-                    progress.get('format_start_time')
-                )
+                apply_adaptive_transition(user_id, topic, transition)
             
             if mode == "adaptive" and not session.get('topic_explained') and not session.get('is_reviewing'):
                 progress = session.get('learning_progress', {})
@@ -1987,53 +3161,19 @@ def practice():
                     topic = progress['current_topic']
                     current_format = progress['current_format']
                 
-                pass
-                
-                topic_prefix_map = {
-                    'SELECT': 'SELECT_',
-                    'WHERE': 'WHERE_',
-                    'ORDER BY': 'ORDERBY_',
-                    'ORDERBY': 'ORDERBY_',
-                    '集約関数': 'AGG_',
-                    'GROUP BY': 'GROUPBY_',
-                    'GROUPBY': 'GROUPBY_',
-                    'HAVING': 'HAVING_',
-                    'JOIN': 'JOIN_',
-                    'サブクエリ': 'SUBQUERY_'
-                }
-                
-                prefix = topic_prefix_map.get(topic, 'SELECT_')
+                prefix = get_topic_prefix(topic)
                 topic_problems = [p for p in all_problems if p['id'].startswith(prefix)]
                 
                 if topic_problems:
-                    recent_problem_ids = session.get('recent_problem_ids', {})
-                    recent_ids_for_topic = recent_problem_ids.get(topic, [])
-                    
-                    available_problems = [p for p in topic_problems if p['id'] not in recent_ids_for_topic]
-                    
-                    if not available_problems:
-                        pass
-                        recent_ids_for_topic = []
-                        available_problems = topic_problems.copy()
-                    
-                    selected_problem = random.choice(available_problems)
-                    session["current_problem"] = selected_problem
-                    
-                    recent_ids_for_topic.append(selected_problem['id'])
-                    if len(recent_ids_for_topic) > 15:
-                        recent_ids_for_topic.pop(0)
-                    
-                    recent_problem_ids[topic] = recent_ids_for_topic
-                    session['recent_problem_ids'] = recent_problem_ids
-                    
-                    pass
+                    session["current_problem"] = select_topic_problem(user_id, topic, topic_problems,
+                                                                      preferred_id=prefetched_problem_id)
                 else:
                     session["current_problem"] = random.choice(all_problems)
                     pass
                     
             elif mode == "random":
                 if "remaining_problems" not in session or not session["remaining_problems"]:
-                    session["remaining_problems"] = all_problems.copy()
+                    session["remaining_problems"] = list(all_problems)
                     random.shuffle(session["remaining_problems"])
                     if "current_problem" in session:
                         current_id = session["current_problem"]["id"]
@@ -2041,7 +3181,7 @@ def practice():
                 if session["remaining_problems"]:
                     session["current_problem"] = session["remaining_problems"].pop()
                 else:
-                    session["remaining_problems"] = all_problems.copy()
+                    session["remaining_problems"] = list(all_problems)
                     random.shuffle(session["remaining_problems"])
                     session["current_problem"] = session["remaining_problems"].pop()
             else:
@@ -2057,7 +3197,7 @@ def practice():
                     'current_topic': 'SELECT',
                     'current_format': '選択式',
                     'format_question_count': 0,
-                    'format_start_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    'format_start_time': current_epoch()
                 })
                 
                 if 'learning_progress' not in session:
@@ -2084,19 +3224,15 @@ def practice():
                 topic_problems = [p for p in all_problems if p['id'].startswith(prefix)]
                 
                 if topic_problems:
-                    selected_problem = random.choice(topic_problems)
-                    session["current_problem"] = selected_problem
+                    session["current_problem"] = select_topic_problem(user_id, current_topic, topic_problems)
                     
                     add_completed_format(current_topic, current_format)
                     
-                    recent_problem_ids = {current_topic: [selected_problem['id']]}
-                    session['recent_problem_ids'] = recent_problem_ids
-                    
                     pass
                 else:
                     session["current_problem"] = all_problems[0]
             elif mode == "random":
-                session["remaining_problems"] = all_problems.copy()
+                session["remaining_problems"] = list(all_problems)
                 random.shuffle(session["remaining_problems"])
                 session["current_problem"] = session["remaining_problems"].pop()
             else:
@@ -2111,6 +3247,12 @@ def practice():
         problem = all_problems[0]
         session["current_problem"] = problem
     
+    # 回答までの時間を測るため、問題を表示した時刻を覚えておく（再読み込みではリセットしない）
+    if request.method == "GET":
+        shown = session.get('problem_shown')
+        if not shown or shown[0] != problem["id"]:
+            session['problem_shown'] = [problem["id"], current_epoch()]
+    
     if 'temp_format' in session and 'temp_topic' in session:
         current_topic = session['temp_topic']
         current_format = session['temp_format']
@@ -2129,7 +3271,7 @@ def practice():
     
     is_reviewing = session.get('is_reviewing', False)
 
-    return render_template_string(HTML_TEMPLATE, problem=problem, formats=FORMATS, current_format=current_format, current_topic=current_topic, result=result, sql_result=sql_result, sql_feedback=sql_feedback, exp_result=exp_result, exp_feedback=exp_feedback, mode=mode, request=request, time_elapsed=time_elapsed, enable_gpt_feedback=enable_gpt_feedback, back_buttons=back_buttons, is_reviewing=is_reviewing)
+    return render_template("practice.html", problem=problem, formats=FORMATS, current_format=current_format, current_topic=current_topic, result=result, sql_result=sql_result, sql_feedback=sql_feedback, exp_result=exp_result, exp_feedback=exp_feedback, mode=mode, request=request, time_elapsed=time_elapsed, enable_gpt_feedback=enable_gpt_feedback, back_buttons=back_buttons, is_reviewing=is_reviewing)
 
 @app.route("/select_group")
 def select_group():
@@ -2155,18 +3297,7 @@ def select_group():
     if progress:
         pass
     
-    topic_names = {
-        'SELECT': 'SELECT句',
-        'WHERE': 'WHERE句',
-        'ORDERBY': 'ORDER BY句',
-        '集約関数': '集約関数',
-        'GROUPBY': 'GROUP BY句',
-        'HAVING': 'HAVING句',
-        'JOIN': 'JOIN句',
-        'サブクエリ': 'サブクエリ'
-    }
-    
-    continue_button = ""
+    show_continue = False
     if progress:
         is_select = progress.get('current_topic') == 'SELECT'
         is_choice = progress.get('current_format') == '選択式'
@@ -2174,100 +3305,22 @@ def select_group():
         pass
         
         if not (is_select and is_choice):
-            topic_name = topic_names.get(progress['current_topic'], progress['current_topic'])
-            continue_button = f"""
-            <div style="background-color:#d4edda;padding:20px;border-radius:8px;margin-bottom:20px;border-left:5px solid #28a745;">
-                <h3>✅ 前回の続きから再開</h3>
-                <a href="/practice?mode=adaptive" style="background-color:#28a745;color:white;padding:15px 30px;border:none;border-radius:8px;font-size:18px;cursor:pointer;text-decoration:none;display:inline-block;margin-top:10px;">
-                    ▶️ 続きから再開する
-                </a>
-            </div>
-            """
+            show_continue = True
             pass
         else:
             pass
     else:
         pass
     
-    jump_buttons = ""
-    topics = ['SELECT', 'WHERE', 'ORDERBY', '集約関数', 'GROUPBY', 'HAVING', 'JOIN', 'サブクエリ']
-    formats = ['選択式', '穴埋め式', '記述式', '意味説明']
-    
-    for topic in topics:
-        jump_buttons += f"<div style='margin-bottom:20px;'><h4>{topic_names.get(topic, topic)}</h4><div style='display:flex;gap:10px;flex-wrap:wrap;'>"
-        for format in formats:
-            jump_buttons += f"""
-            <a href='/jump_to?topic={topic}&format={format}' style='text-decoration:none;'>
-                <button style='padding:10px 20px;background:#667eea;color:white;border:none;border-radius:5px;cursor:pointer;'>
-                    {format}
-                </button>
-            </a>
-            """
-        jump_buttons += "</div></div>"
-    
-    html = f"""<!doctype html>
-<html>
-<head>
-    <title>学習位置を選択 - SQL学習支援システム</title>
-    <meta charset="utf-8">
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            margin: 20px;
-            background-color: #f5f5f5;
-        }}
-        .container {{
-            max-width: 900px;
-            margin: 0 auto;
-            background: white;
-            padding: 30px;
-            border-radius: 10px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }}
-        .group-info {{
-            background-color: {'#e3f2fd' if group == 'A' else '#ffe3e3'};
-            padding: 20px;
-            border-radius: 10px;
-            margin-bottom: 30px;
-            border-left: 5px solid {'#2196f3' if group == 'A' else '#f44336'};
-        }}
-        h4 {{
-            color: #667eea;
-            margin-top: 0;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>📍 学習開始位置を選択</h1>
-        
-        <div class="group-info">
-            <h3>選択中: {group_name}</h3>
-            <p>{group_desc}</p>
-        </div>
-        
-        {continue_button}
-        
-        <div style="background-color:#e3f2fd;padding:15px;border-radius:5px;margin-bottom:30px;border-left:5px solid #2196f3;">
-            <h3>💡 どこから始めますか？</h3>
-            <p><strong>✅ 初めての方：</strong> 「SELECT句 - 選択式」を選んでください（一番上）</p>
-        </div>
-        
-        <h2>学習位置を選択:</h2>
-        <p style="font-size:14px;color:#666;margin-bottom:20px;">
-            ※システムトラブルで履歴がリセットされた場合は、ここから再開位置を選んでください
-        </p>
-        
-        {jump_buttons}
-        
-        <div style="margin-top:30px;">
-            <a href="/home" style="color:#667eea;text-decoration:none;">← ホームに戻る</a>
-        </div>
-    </div>
-</body>
-</html>"""
+    # 「続きから再開」は学習進捗で決まるので、回答がなくても位置の移動で変わる
+    validators = page_validators(user_id, group, show_continue)
+    if not is_page_modified(*validators):
+        return conditional_page('', *validators, status=304)
     
-    return html
+    return conditional_page(render_template("select_group.html", group=group, group_name=group_name,
+                                            group_desc=group_desc, show_continue=show_continue,
+                                            topics=[(topic, TOPIC_NAMES[topic]) for topic in TOPICS],
+                                            formats=FORMATS), *validators)
 
 @app.route("/jump_to")
 def jump_to():
@@ -2287,7 +3340,7 @@ def jump_to():
         'current_topic': topic,
         'current_format': format,
         'format_question_count': 0,
-        'format_start_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        'format_start_time': current_epoch()
     }
     session['learning_progress'] = progress
     session['topic_explained'] = True
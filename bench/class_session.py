@@ -0,0 +1,311 @@
+"""授業1コマ分の負荷試験（ログインから適応的学習の回答・次の問題までを学生の人数分同時に流す）
+
+使い方（リポジトリのルートで実行）:
+    python -m bench.class_session
+    python -m bench.class_session --students 40 --answers 30 --gpt-latency-ms 800
+    python -m bench.class_session --max-p95-ms 500 --max-error-rate 0 --json result.json   # CI 用
+    python -m bench.class_session --url http://127.0.0.1:8000   # 起動中のサーバー（bench.stub_app など）に対して
+
+--url と bench.server_modes は requests を使う（pip install -r requirements-dev.txt）。
+
+一時ディレクトリに SQLite の DB を作り（DATABASE_URL があればその PostgreSQL を使う）、
+学生ごとのスレッドが Flask のテストクライアントで次の順に画面を取得する。
+
+    / → POST /login → /home → /select_group（A・B を交互）→ /practice?mode=adaptive
+    → （構文の説明）→ 回答の POST /practice と /practice?next=1 を --answers 回 → /stats → /history
+
+回答は画面の問題IDから問題を引き、--accuracy の確率で正解を、それ以外は誤答を送る。
+--test-mode を付けると /test_mode でテストモードにして（形式ごとの問題数が少ない）、少ない回答数で全形式を回る。
+回答の前には形式ごとの回答時間（選択式 30秒〜意味説明 150秒）に --think-scale を掛けた時間だけ待つ。
+GPT（openai.ChatCompletion.create）は --gpt-latency-ms だけ待って判定を返すローカルのスタブに置き換える。
+--url を指定すると、テストクライアントの代わりに HTTP でそのサーバーにリクエストを送る
+（GPT のスタブはサーバー側で入れておく。bench.stub_app を参照）。
+
+ルートごとのリクエスト数・応答時間の分位点・DB のクエリ数と時間（DB_QUERY_HEADER=1 で付く応答ヘッダー）と
+全体のスループットを出力する。
+--max-p95-ms・--max-error-rate・--max-queries を超えると終了コード 1 で終わるので、CI で回帰を検出できる。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+# 形式ごとの回答にかかる時間（秒、tools.simulate_learners の既定値と同じ）
+THINK_SECONDS = {"選択式": 30, "穴埋め式": 45, "記述式": 120, "意味説明": 150}
+
+PROBLEM_ID_PATTERN = re.compile(r"<h3>問題 (\S+): ")
+FORMAT_PATTERN = re.compile(r'<input type="hidden" name="format" value="([^"]+)">')
+
+class Recorder:
+    """ルートごとの応答時間・ステータス・クエリ数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.queries = defaultdict(int)
+        self.db_ms = defaultdict(float)
+
+    def record(self, route, seconds, status, queries, db_ms):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.queries[route] += queries
+            self.db_ms[route] += db_ms
+            if status >= 400:
+                self.errors[route] += 1
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def install_gpt_stub(app_module, latency, accuracy, seed):
+    """GPT の呼び出しを、待ち時間のあと一定の割合で正解を返すスタブにする"""
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    def create(model=None, messages=None, **kwargs):
+        time.sleep(latency)
+        with rng_lock:
+            roll = rng.random()
+        if roll < accuracy:
+            verdict = "正解"
+        elif roll < (1 + accuracy) / 2:
+            verdict = "部分正解"
+        else:
+            verdict = "不正解"
+        content = f"判定結果: {verdict}\nフィードバック: 負荷試験用の応答です。"
+        return {"choices": [{"message": {"content": content}}]}
+
+    os.environ.setdefault("OPENAI_API_KEY", "load-test-stub")
+    app_module.get_openai().ChatCompletion.create = create
+
+class HttpClient:
+    """テストクライアントと同じ open() で、HTTP でサーバーに送るクライアント（Cookie を保持する）"""
+
+    def __init__(self, base_url):
+        import requests
+        self.session = requests.Session()
+        self.base_url = base_url.rstrip("/")
+
+    def open(self, path, method="GET", data=None):
+        return HttpResponse(self.session.request(method, self.base_url + path, data=data, allow_redirects=False))
+
+class HttpResponse:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.text = response.text
+
+    def get_data(self, as_text=False):
+        return self.text if as_text else self.text.encode("utf-8")
+
+class Student:
+    def __init__(self, index, args, client, problems, recorder):
+        self.user_id = f"load-{index:03d}"
+        self.group = "A" if index % 2 == 0 else "B"
+        self.args = args
+        self.client = client
+        self.problems = problems
+        self.recorder = recorder
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.answers = 0
+        self.formats = Counter()
+
+    def request(self, route, method, path, data=None):
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, data=data)
+        body = response.get_data(as_text=True)
+        self.recorder.record(route, time.perf_counter() - started, response.status_code,
+                             int(response.headers.get("X-DB-Queries", 0)), float(response.headers.get("X-DB-Time-Ms", 0)))
+        return response, body
+
+    def follow(self, response, body):
+        """リダイレクトをたどる（構文の説明に飛ばされたら読んでから問題に戻る）"""
+        while response.status_code in (301, 302, 303):
+            location = response.headers["Location"]
+            path = location.split("?")[0]
+            response, body = self.request(f"GET {path}", "GET", location)
+            if path == "/topic_explanation":
+                response, body = self.request("GET /practice", "GET", "/practice?mode=adaptive&skip_explanation=1")
+        return response, body
+
+    def think(self, format):
+        seconds = THINK_SECONDS.get(format, 60) * self.args.think_scale
+        if seconds > 0:
+            time.sleep(seconds * self.rng.uniform(0.5, 1.5))
+
+    def answer_form(self, problem, format):
+        correct = self.rng.random() < self.args.accuracy
+        form = {"format": format, "mode": "adaptive"}
+        if format == "意味説明":
+            form["student_explanation"] = problem["explanation"] if correct else "よくわかりません"
+        elif format == "穴埋め式" and problem.get("blank_answer"):
+            form["student_sql"] = problem["blank_answer"] if correct else "x"
+        elif format == "選択式":
+            wrong = [choice for choice in problem["choices"] if choice and choice != problem["answer_sql"]]
+            form["student_sql"] = problem["answer_sql"] if correct or not wrong else self.rng.choice(wrong)
+        else:
+            # 誤答も SELECT・FROM・WHERE の有無の判定を通り、GPT の評価まで進む形にする
+            form["student_sql"] = problem["answer_sql"] if correct else problem["answer_sql"].rstrip(";") + " LIMIT 1"
+        return form
+
+    def run(self):
+        self.request("GET /", "GET", "/")
+        self.follow(*self.request("POST /login", "POST", "/login", {"user_id": self.user_id}))
+        if self.args.test_mode:
+            self.request("GET /test_mode", "GET", "/test_mode")
+        self.request("GET /select_group", "GET", f"/select_group?group={self.group}")
+        response, body = self.follow(*self.request("GET /practice", "GET", "/practice?mode=adaptive"))
+
+        for _ in range(self.args.answers):
+            problem_match = PROBLEM_ID_PATTERN.search(body)
+            format_match = FORMAT_PATTERN.search(body)
+            if not problem_match or not format_match or problem_match.group(1) not in self.problems:
+                break
+            problem = self.problems[problem_match.group(1)]
+            format = format_match.group(1)
+
+            self.think(format)
+            self.request("POST /practice", "POST", "/practice", self.answer_form(problem, format))
+            self.answers += 1
+            self.formats[format] += 1
+            response, body = self.follow(*self.request("GET /practice?next=1", "GET",
+                                                       f"/practice?format={format}&mode=adaptive&next=1"))
+
+        self.request("GET /stats", "GET", "/stats")
+        self.request("GET /history", "GET", "/history")
+
+def run_class(args, make_client, problems):
+    """学生の人数分のスレッドで授業を流し、結果をまとめて返す"""
+    recorder = Recorder()
+    students = [Student(i, args, make_client(), problems, recorder) for i in range(args.students)]
+    threads = [threading.Thread(target=student.run) for student in students]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return report(recorder, time.perf_counter() - started, students)
+
+def load_problem_bank(app_module):
+    return {problem["id"]: problem for problem in app_module.get_problem_bank()}
+
+def report(recorder, elapsed, students):
+    rows = []
+    for route in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[route])
+        rows.append({
+            "route": route,
+            "requests": len(values),
+            "errors": recorder.errors[route],
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+            "queries_per_request": recorder.queries[route] / len(values),
+            "db_ms_per_request": recorder.db_ms[route] / len(values),
+        })
+    total = sum(row["requests"] for row in rows)
+    answers = sum(student.answers for student in students)
+    formats = Counter()
+    for student in students:
+        formats.update(student.formats)
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": total,
+        "errors": sum(row["errors"] for row in rows),
+        "requests_per_second": total / elapsed if elapsed else 0.0,
+        "answers": answers,
+        "answers_per_second": answers / elapsed if elapsed else 0.0,
+        "answers_by_format": dict(formats),
+        "routes": rows,
+    }
+
+def print_report(result):
+    print(f"{'ルート':<26}{'件数':>7}{'エラー':>7}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}"
+          f"{'クエリ/件':>10}{'DB(ms)/件':>10}")
+    for row in result["routes"]:
+        print(f"{row['route']:<26}{row['requests']:>7}{row['errors']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}{row['queries_per_request']:>10.1f}{row['db_ms_per_request']:>10.2f}")
+    print(f"合計 {result['requests']:,} リクエスト（エラー {result['errors']}）/ {result['elapsed_seconds']:.1f}秒: "
+          f"{result['requests_per_second']:.1f} リクエスト/秒, 回答 {result['answers_per_second']:.2f} 件/秒")
+    print("形式ごとの回答数: " + ", ".join(f"{format} {count}" for format, count in result["answers_by_format"].items()))
+
+def check_limits(result, args):
+    """CI 用の上限を超えたルートの一覧"""
+    failures = []
+    for row in result["routes"]:
+        if args.max_p95_ms is not None and row["p95_ms"] > args.max_p95_ms:
+            failures.append(f"{row['route']}: p95 {row['p95_ms']:.1f}ms > {args.max_p95_ms}ms")
+        if args.max_queries is not None and row["queries_per_request"] > args.max_queries:
+            failures.append(f"{row['route']}: クエリ {row['queries_per_request']:.1f}件/リクエスト > {args.max_queries}")
+    error_rate = result["errors"] / result["requests"] if result["requests"] else 0.0
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        failures.append(f"エラー率 {error_rate:.3f} > {args.max_error_rate}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="授業1コマ分の負荷試験")
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--answers", type=int, default=20, help="学生1人あたりの回答数")
+    parser.add_argument("--accuracy", type=float, default=0.7, help="正解を送る確率（GPT のスタブの正解率にも使う）")
+    parser.add_argument("--think-scale", type=float, default=0.001,
+                        help="回答時間に掛ける係数（1 で実時間、0 で待たない）")
+    parser.add_argument("--gpt-latency-ms", type=float, default=300)
+    parser.add_argument("--test-mode", action="store_true", help="テストモードで回る（形式ごとの問題数が少ない）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果を JSON で書き出すファイル")
+    parser.add_argument("--max-p95-ms", type=float, help="ルートごとの p95 の上限")
+    parser.add_argument("--max-error-rate", type=float, help="エラー（4xx・5xx）の割合の上限")
+    parser.add_argument("--max-queries", type=float, help="ルートごとの1リクエストあたりのクエリ数の上限")
+    parser.add_argument("--url", help="テストクライアントの代わりにリクエストを送るサーバー（例: http://127.0.0.1:8000）")
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    for name in ("problems.xlsx", "static", "templates"):
+        source = os.path.join(root, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(workdir, name))
+        elif os.path.exists(source):
+            shutil.copy(source, workdir)
+    os.chdir(workdir)
+    os.environ.setdefault("REQUEST_LOG", "0")
+    os.environ.setdefault("DASHBOARD_REFRESH_SECONDS", "0")
+    os.environ["DB_QUERY_HEADER"] = "1"
+
+    try:
+        import app_sqlite
+
+        if args.url:
+            def make_client():
+                return HttpClient(args.url)
+        else:
+            install_gpt_stub(app_sqlite, args.gpt_latency_ms / 1000, args.accuracy, args.seed)
+            make_client = app_sqlite.app.test_client
+
+        result = run_class(args, make_client, load_problem_bank(app_sqlite))
+        print_report(result)
+        if args.json:
+            with open(os.path.join(root, args.json), "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+        failures = check_limits(result, args)
+        for failure in failures:
+            print(f"上限超過: {failure}")
+        if failures:
+            raise SystemExit(1)
+    finally:
+        os.chdir(root)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
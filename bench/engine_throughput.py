@@ -0,0 +1,53 @@
+"""適応的学習エンジンのスループット計測
+
+使い方（リポジトリのルートで実行）:
+    python -m bench.engine_throughput --events 1000000
+"""
+import argparse
+import random
+import time
+
+import adaptive_engine
+
+def make_events(count, seed):
+    """正答率がばらつく合成の回答列（構文は step の遷移に従うので得点だけ作る）"""
+    rng = random.Random(seed)
+    return [rng.choice((1, 1, 1, 0.5, 0)) for _ in range(count)]
+
+def bench_step(scores, test_mode):
+    state = adaptive_engine.initial_state()
+    transitions = 0
+    started = time.perf_counter()
+    for score in scores:
+        state, transition = adaptive_engine.step(state, state.topic, score, test_mode)
+        if transition.next_topic:
+            transitions += 1
+        if state.topic == adaptive_engine.TOPICS[-1] and transition.completed:
+            state = adaptive_engine.initial_state()
+    return time.perf_counter() - started, transitions
+
+def bench_decide(scores, test_mode):
+    window_size = adaptive_engine.get_window_size('選択式', test_mode)
+    windows = [tuple(scores[i:i + window_size]) for i in range(0, len(scores) - window_size, window_size)]
+    started = time.perf_counter()
+    for i, window in enumerate(windows):
+        adaptive_engine.decide_transition('SELECT', '選択式', i % 6, window, test_mode)
+    return time.perf_counter() - started, len(windows)
+
+def main():
+    parser = argparse.ArgumentParser(description="適応的学習エンジンのスループット計測")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--test-mode", action="store_true")
+    args = parser.parse_args()
+
+    scores = make_events(args.events, args.seed)
+
+    elapsed, transitions = bench_step(scores, args.test_mode)
+    print(f"step:              {args.events / elapsed:12,.0f} 件/秒（{args.events:,}件, 遷移 {transitions:,}回, {elapsed:.2f}秒）")
+
+    elapsed, count = bench_decide(scores, args.test_mode)
+    print(f"decide_transition: {count / elapsed:12,.0f} 回/秒（{count:,}回, {elapsed:.2f}秒）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""画面ごとの応答時間・応答サイズのベンチマーク
+
+使い方（リポジトリのルートで実行）:
+    python -m bench.page_render
+    python -m bench.page_render --repeat 200
+
+一時ディレクトリに SQLite の DB を作り、回答履歴を入れてから Flask のテストクライアントで
+各画面を繰り返し取得する。/practice は問題の読み込みを含む。
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+PAGES = [
+    ("ログイン", "/", False),
+    ("ホーム", "/home", True),
+    ("学習統計", "/stats", True),
+    ("履歴", "/history", True),
+    ("構文の説明", "/topic_explanation?topic=JOIN", True),
+    ("学習位置の選択", "/select_group?group=A", True),
+    ("テストモード", "/test_mode", True),
+    ("問題", "/practice?mode=adaptive&skip_explanation=1", True),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="画面ごとの応答時間・応答サイズを測る")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--answers", type=int, default=200, help="事前に入れておく回答数")
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    for name in ("problems.xlsx", "static", "templates"):
+        source = os.path.join(root, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(workdir, name))
+        elif os.path.exists(source):
+            shutil.copy(source, workdir)
+    os.chdir(workdir)
+    os.environ.pop("DATABASE_URL", None)
+
+    try:
+        import app_sqlite
+
+        with app_sqlite.app.test_request_context():
+            for i in range(args.answers):
+                app_sqlite.save_log("bench", f"SELECT_{i % 10 + 1}", app_sqlite.FORMATS[i % 4], "SELECT 1", "",
+                                    "正解 ✅" if i % 3 else "不正解 ❌", "", "", "")
+
+        client = app_sqlite.app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = "bench"
+        guest = app_sqlite.app.test_client()
+
+        print(f"{'画面':<14}{'平均(ms)':>10}{'サイズ(bytes)':>16}")
+        for label, path, logged_in in PAGES:
+            page_client = client if logged_in else guest
+            response = page_client.get(path)
+            size = len(response.get_data())
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                page_client.get(path).get_data()
+            elapsed = (time.perf_counter() - started) / args.repeat * 1000
+            print(f"{label:<14}{elapsed:>10.2f}{size:>16,}")
+    finally:
+        os.chdir(root)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""gunicorn のワーカー構成ごとの比較（sync と gthread、preload の有無）
+
+使い方（リポジトリのルートで実行、gunicorn が必要）:
+    python -m bench.server_modes
+    python -m bench.server_modes --students 30 --answers 10 --gpt-latency-ms 800
+    python -m bench.server_modes --workers 2 --threads 8      # ワーカー数・スレッド数をそろえて比べる
+
+構成ごとに一時ディレクトリに SQLite の DB を作り、gunicorn.conf.py で gunicorn（アプリは GPT をスタブにした
+bench.stub_app）を起動して、bench.class_session と同じ授業を HTTP で流す。
+構成ごとのスループット、回答（POST /practice）と次の問題（next=1）の p50・p95、エラー数、
+負荷をかけ終えた時点のワーカーの RSS と PSS の合計を出力する。RSS はワーカー間で共有しているページも
+ワーカーごとに数えるので、preload でコピーオンライトで共有した分は PSS（共有ページをプロセス数で割った値）に出る。
+"""
+import argparse
+import os
+import runpy
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench.class_session import HttpClient, load_problem_bank, run_class
+
+MODES = [
+    ("sync", {"GUNICORN_WORKER_CLASS": "sync"}),
+    ("gthread", {"GUNICORN_WORKER_CLASS": "gthread"}),
+    ("gthread（preload なし）", {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_PRELOAD": "0"}),
+]
+
+def copy_app_files(root, workdir):
+    for name in ("problems.xlsx", "static", "templates"):
+        source = os.path.join(root, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(workdir, name))
+        elif os.path.exists(source):
+            shutil.copy(source, workdir)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def server_config(config_path, env):
+    """その環境変数で gunicorn.conf.py を読んだときのワーカー数・スレッド数"""
+    saved = dict(os.environ)
+    os.environ.update(env)
+    try:
+        config = runpy.run_path(config_path)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    return config["workers"], config["threads"]
+
+def wait_until_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn が起動しませんでした")
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn の起動を待ちきれませんでした")
+
+def worker_memory_mb(master_pid, path, field):
+    """マスターの子プロセス（ワーカー）の /proc/<pid>/<path> の field の合計（Linux 以外や読めなければ None）"""
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            pids = f.read().split()
+    except OSError:
+        return None
+    total_kb = 0
+    found = False
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/{path}") as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        total_kb += int(line.split()[1])
+                        found = True
+        except OSError:
+            pass
+    return total_kb / 1024 if found else None
+
+def worker_rss_mb(master_pid):
+    return worker_memory_mb(master_pid, "status", "VmRSS")
+
+def worker_pss_mb(master_pid):
+    return worker_memory_mb(master_pid, "smaps_rollup", "Pss")
+
+def route_row(result, route):
+    for row in result["routes"]:
+        if row["route"] == route:
+            return row
+    return {"p50_ms": 0.0, "p95_ms": 0.0}
+
+def main():
+    parser = argparse.ArgumentParser(description="gunicorn のワーカー構成ごとの比較")
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--answers", type=int, default=8, help="学生1人あたりの回答数")
+    parser.add_argument("--accuracy", type=float, default=0.7)
+    parser.add_argument("--think-scale", type=float, default=0.001)
+    parser.add_argument("--gpt-latency-ms", type=float, default=300)
+    parser.add_argument("--workers", type=int, help="ワーカー数（既定は gunicorn.conf.py の CPU 数からの値）")
+    parser.add_argument("--threads", type=int, help="gthread のスレッド数")
+    args = parser.parse_args()
+    args.test_mode = True
+    args.seed = 0
+
+    root = os.getcwd()
+    config_path = os.path.join(root, "gunicorn.conf.py")
+    driver_dir = tempfile.mkdtemp()
+    copy_app_files(root, driver_dir)
+    os.chdir(driver_dir)
+    os.environ.setdefault("DASHBOARD_REFRESH_SECONDS", "0")
+
+    rows = []
+    try:
+        import app_sqlite
+        problems = load_problem_bank(app_sqlite)
+
+        for mode, mode_env in MODES:
+            env = dict(mode_env, REQUEST_LOG="0", DASHBOARD_REFRESH_SECONDS="0", DB_QUERY_HEADER="1",
+                       STUB_GPT_LATENCY_MS=str(args.gpt_latency_ms), STUB_ACCURACY=str(args.accuracy))
+            if args.workers:
+                env["WEB_CONCURRENCY"] = str(args.workers)
+            if args.threads:
+                env["GUNICORN_THREADS"] = str(args.threads)
+            workers, threads = server_config(config_path, env)
+
+            workdir = tempfile.mkdtemp()
+            copy_app_files(root, workdir)
+            port = free_port()
+            url = f"http://127.0.0.1:{port}"
+            process = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", config_path, "-b", f"127.0.0.1:{port}", "bench.stub_app:app"],
+                cwd=workdir, env=dict(os.environ, PYTHONPATH=root, **env),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_until_ready(url + "/", process)
+                result = run_class(args, lambda: HttpClient(url), problems)
+                rss = worker_rss_mb(process.pid)
+                pss = worker_pss_mb(process.pid)
+            finally:
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=60)
+                shutil.rmtree(workdir, ignore_errors=True)
+            rows.append((mode, workers, threads, result, rss, pss))
+            print(f"{mode}: 完了（{result['elapsed_seconds']:.1f}秒）", file=sys.stderr)
+    finally:
+        os.chdir(root)
+        shutil.rmtree(driver_dir, ignore_errors=True)
+
+    print(f"{'構成':<18}{'ワーカー×スレッド':>12}{'リクエスト/秒':>12}{'回答/秒':>10}{'回答 p50':>10}{'回答 p95':>10}"
+          f"{'次 p50':>10}{'次 p95':>10}{'エラー':>8}{'RSS(MB)':>10}{'PSS(MB)':>10}")
+    for mode, workers, threads, result, rss, pss in rows:
+        post = route_row(result, "POST /practice")
+        next_page = route_row(result, "GET /practice?next=1")
+        rss_text = f"{rss:.0f}" if rss is not None else "-"
+        pss_text = f"{pss:.0f}" if pss is not None else "-"
+        print(f"{mode:<18}{f'{workers}×{threads}':>12}{result['requests_per_second']:>12.1f}{result['answers_per_second']:>10.2f}"
+              f"{post['p50_ms']:>10.0f}{post['p95_ms']:>10.0f}{next_page['p50_ms']:>10.0f}{next_page['p95_ms']:>10.0f}"
+              f"{result['errors']:>8}{rss_text:>10}{pss_text:>10}")
+
+if __name__ == "__main__":
+    main()
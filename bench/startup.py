@@ -0,0 +1,107 @@
+"""ワーカー起動時間のベンチマーク（import とスキーマ確認・テンプレート準備・問題の読み込みの内訳）
+
+使い方（リポジトリのルートで実行）:
+    python -m bench.startup
+    python -m bench.startup --repeat 10
+    DATABASE_URL=postgresql://... python -m bench.startup   # PostgreSQL のスキーマ確認も測る
+
+起動ごとに新しい Python プロセスで app_sqlite を import し、次の時間を測る（中央値）。
+
+    フレームワーク      flask・jinja2・werkzeug の import
+    app_sqlite 本体     app_sqlite の import から下の4つを除いた分（自前のモジュールを含む）
+    schema              ensure_schema（印が一致すれば init_db を省く）
+    templates           テンプレートのコンパイル
+    topic_pages         構文説明のページの作成
+    problems            問題バンクの読み込み（openpyxl の import を含む。preload ならマスターで1回だけ）
+
+「DB 初回」はまだ DB がない状態、「2回目以降」は印が一致する状態、「FORCE_INIT_DB=1」は毎回 init_db を
+実行する状態（以前の起動と同じ）。最後に、起動時に読み込まない重いモジュールの初回利用時の時間を出す。
+SQLite は一時ディレクトリに DB を作る。
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+STEPS = ("schema", "templates", "topic_pages", "problems")
+
+MEASURE_STARTUP = '''
+import json, sys, time
+started = time.perf_counter()
+import flask, jinja2, werkzeug
+framework = time.perf_counter() - started
+started = time.perf_counter()
+import app_sqlite
+total = time.perf_counter() - started
+print(json.dumps({
+    "framework": framework,
+    "total": total,
+    "steps": app_sqlite.STARTUP_SECONDS,
+    "loaded": [name for name in ("openai", "openpyxl", "psycopg2") if name in sys.modules],
+}))
+'''
+
+MEASURE_FIRST_USE = '''
+import json, time
+import app_sqlite
+started = time.perf_counter()
+app_sqlite.get_openai()
+openai = time.perf_counter() - started
+print(json.dumps({"openai": openai}))
+'''
+
+def run(code, workdir, root, extra_env=None):
+    env = dict(os.environ, PYTHONPATH=root, REQUEST_LOG="0", DASHBOARD_REFRESH_SECONDS="0", **(extra_env or {}))
+    output = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def print_row(label, results):
+    def median(values):
+        return statistics.median(values) * 1000
+    framework = median([r["framework"] for r in results])
+    total = median([r["total"] for r in results])
+    steps = [median([r["steps"].get(step, 0.0) for r in results]) for step in STEPS]
+    body = median([r["total"] - sum(r["steps"].values()) for r in results])
+    print(f"{label:<18}{framework:>10.1f}{body:>14.1f}" + "".join(f"{value:>12.1f}" for value in steps)
+          + f"{framework + total:>10.1f}   {','.join(results[-1]['loaded']) or '-'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="ワーカー起動時間の内訳")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    for name in ("problems.xlsx", "static", "templates"):
+        source = os.path.join(root, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(workdir, name))
+        elif os.path.exists(source):
+            shutil.copy(source, workdir)
+
+    try:
+        print(f"{'(ms, 中央値)':<18}{'フレームワーク':>10}{'app_sqlite本体':>14}"
+              + "".join(f"{step:>12}" for step in STEPS) + f"{'合計':>10}   起動時に読み込んだ重いモジュール")
+        if not os.environ.get("DATABASE_URL"):
+            first = []
+            for _ in range(args.repeat):
+                if os.path.exists(os.path.join(workdir, "学習履歴.db")):
+                    os.remove(os.path.join(workdir, "学習履歴.db"))
+                first.append(run(MEASURE_STARTUP, workdir, root))
+            print_row("DB 初回", first)
+        print_row("2回目以降", [run(MEASURE_STARTUP, workdir, root) for _ in range(args.repeat)])
+        print_row("FORCE_INIT_DB=1", [run(MEASURE_STARTUP, workdir, root, {"FORCE_INIT_DB": "1"})
+                                      for _ in range(args.repeat)])
+
+        first_use = [run(MEASURE_FIRST_USE, workdir, root) for _ in range(args.repeat)]
+        print(f"初回利用時: openai の読み込み {statistics.median(r['openai'] for r in first_use) * 1000:.1f}ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
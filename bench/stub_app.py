@@ -0,0 +1,17 @@
+"""負荷試験用の WSGI アプリ（GPT の呼び出しをスタブに置き換えた app_sqlite）
+
+使い方（リポジトリのルートで実行）:
+    STUB_GPT_LATENCY_MS=300 gunicorn -c gunicorn.conf.py bench.stub_app:app
+
+スタブは STUB_GPT_LATENCY_MS だけ待ってから、STUB_ACCURACY の割合で「正解」を返す
+（bench.class_session のスタブと同じ）。
+"""
+import os
+
+import app_sqlite
+from bench.class_session import install_gpt_stub
+
+install_gpt_stub(app_sqlite, float(os.environ.get("STUB_GPT_LATENCY_MS", "300")) / 1000,
+                 float(os.environ.get("STUB_ACCURACY", "0.7")), seed=0)
+
+app = app_sqlite.app
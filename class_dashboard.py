@@ -0,0 +1,295 @@
+"""教員用ダッシュボードの集計
+
+授業中に logs を直接集計しなくて済むよう、集計結果を別に持っておき定期的に作り直す。
+PostgreSQL ではマテリアライズドビュー（REFRESH ... CONCURRENTLY で読み込みを止めない）、
+SQLite では集計テーブルを使う（logs の集計は書き込みロックの外で行い、ロックは DELETE → INSERT の入れ替えの間だけ持つ）。
+最後に作り直した時刻は summary_refresh に記録し、複数のワーカーが同時に作り直さないようにする。
+
+- class_topic_summary: ユーザー × 問題IDの接頭辞 × 形式 ごとの回答数・正解数・部分正解数
+- class_problem_summary: 問題ごとの回答数・正解数・部分正解数・回答した人数
+- class_student_summary: ユーザーごとの回答数・正解数・部分正解数・最初と最後の回答時刻
+
+app_sqlite.py の init_db・/admin/dashboard と tools/refresh_dashboard.py から使う。
+"""
+import time
+from datetime import datetime, timezone
+
+from adaptive_engine import FORMATS, TOPICS, extract_topic_from_problem_id
+
+SUMMARY_NAME = 'class_dashboard'
+
+# 正解率の分布の区切り（%）
+ACCURACY_BUCKETS = [(0, 20), (20, 40), (40, 60), (60, 80), (80, 101)]
+
+# PostgreSQL の行ロック代わりに使う advisory lock のキー
+REFRESH_LOCK_KEY = 4204201
+
+SUMMARY_QUERIES = {
+    'class_topic_summary': '''
+        SELECT user_id, {prefix} AS prefix, COALESCE(format, '') AS format,
+               COUNT(*) AS attempts,
+               SUM(CASE WHEN verdict = 2 THEN 1 ELSE 0 END) AS correct,
+               SUM(CASE WHEN verdict = 1 THEN 1 ELSE 0 END) AS partial
+        FROM logs
+        GROUP BY user_id, {prefix}, COALESCE(format, '')
+    ''',
+    'class_problem_summary': '''
+        SELECT problem_id,
+               COUNT(*) AS attempts,
+               SUM(CASE WHEN verdict = 2 THEN 1 ELSE 0 END) AS correct,
+               SUM(CASE WHEN verdict = 1 THEN 1 ELSE 0 END) AS partial,
+               COUNT(DISTINCT user_id) AS students
+        FROM logs
+        GROUP BY problem_id
+    ''',
+    'class_student_summary': '''
+        SELECT user_id,
+               COUNT(*) AS attempts,
+               SUM(CASE WHEN verdict = 2 THEN 1 ELSE 0 END) AS correct,
+               SUM(CASE WHEN verdict = 1 THEN 1 ELSE 0 END) AS partial,
+               MIN(timestamp) AS first_answer,
+               MAX(timestamp) AS last_answer
+        FROM logs
+        GROUP BY user_id
+    '''
+}
+
+# 並行リフレッシュ・主キーに使う列
+SUMMARY_KEYS = {
+    'class_topic_summary': 'user_id, prefix, format',
+    'class_problem_summary': 'problem_id',
+    'class_student_summary': 'user_id'
+}
+
+SQLITE_SUMMARY_COLUMNS = {
+    'class_topic_summary': '''
+        user_id TEXT NOT NULL, prefix TEXT NOT NULL, format TEXT NOT NULL,
+        attempts INTEGER NOT NULL, correct INTEGER NOT NULL, partial INTEGER NOT NULL
+    ''',
+    'class_problem_summary': '''
+        problem_id TEXT NOT NULL, attempts INTEGER NOT NULL, correct INTEGER NOT NULL,
+        partial INTEGER NOT NULL, students INTEGER NOT NULL
+    ''',
+    'class_student_summary': '''
+        user_id TEXT NOT NULL, attempts INTEGER NOT NULL, correct INTEGER NOT NULL,
+        partial INTEGER NOT NULL, first_answer INTEGER, last_answer INTEGER
+    '''
+}
+
+def summary_query(name, db_type):
+    if db_type == "postgresql":
+        prefix = "split_part(problem_id, '_', 1)"
+    else:
+        prefix = "CASE WHEN instr(problem_id, '_') > 0 THEN substr(problem_id, 1, instr(problem_id, '_') - 1) ELSE problem_id END"
+    return SUMMARY_QUERIES[name].format(prefix=prefix)
+
+def create_summaries(cursor, db_type):
+    """集計のビュー・テーブルを作る（中身は refresh_summaries で入れる）"""
+    if db_type == "postgresql":
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS summary_refresh (
+                name TEXT PRIMARY KEY,
+                refreshed_at TIMESTAMPTZ NOT NULL,
+                seconds REAL
+            )
+        ''')
+        for name in SUMMARY_QUERIES:
+            # 起動を遅らせないよう WITH NO DATA で作り、最初のリフレッシュで中身を入れる
+            cursor.execute(f'CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {summary_query(name, db_type)} WITH NO DATA')
+            cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{name}_key ON {name} ({SUMMARY_KEYS[name]})')
+    else:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS summary_refresh (
+                name TEXT PRIMARY KEY,
+                refreshed_at INTEGER NOT NULL,
+                seconds REAL
+            )
+        ''')
+        for name, columns in SQLITE_SUMMARY_COLUMNS.items():
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {name} ({columns}, PRIMARY KEY ({SUMMARY_KEYS[name]}))')
+
+def drop_postgresql_summaries(cursor):
+    """logs を作り直す前にマテリアライズドビューを外す（依存があると古い logs を削除できない）"""
+    for name in SUMMARY_QUERIES:
+        cursor.execute(f'DROP MATERIALIZED VIEW IF EXISTS {name}')
+
+def get_refreshed_at(cursor, db_type):
+    """最後に作り直した UNIX時間（まだなら None）"""
+    placeholder = '%s' if db_type == "postgresql" else '?'
+    cursor.execute(f'SELECT refreshed_at FROM summary_refresh WHERE name = {placeholder}', (SUMMARY_NAME,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if isinstance(row[0], datetime):
+        return int(row[0].timestamp())
+    return int(row[0])
+
+def is_fresh(refreshed_at, now, max_age):
+    return bool(max_age) and refreshed_at is not None and now - refreshed_at < max_age
+
+def record_refresh(cursor, db_type, now, elapsed):
+    placeholder = '%s' if db_type == "postgresql" else '?'
+    refreshed_value = datetime.fromtimestamp(now, timezone.utc) if db_type == "postgresql" else now
+    cursor.execute(f'''
+        INSERT INTO summary_refresh (name, refreshed_at, seconds) VALUES ({placeholder}, {placeholder}, {placeholder})
+        ON CONFLICT (name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at, seconds = EXCLUDED.seconds
+    ''', (SUMMARY_NAME, refreshed_value, elapsed))
+
+def refresh_summaries(conn, db_type, max_age=0):
+    """集計を作り直し、かかった秒数を返す
+
+    max_age 秒以内にほかのワーカーが作り直していれば何もせず None を返す。
+    """
+    if db_type != "postgresql":
+        return refresh_sqlite_summaries(conn, max_age)
+
+    cursor = conn.cursor()
+    now = int(time.time())
+    # 同時に作り直すのは1つのワーカーだけ。定期実行では取れなければ（別のワーカーが作り直し中）諦め、
+    # すぐに作り直す指定（max_age=0）なら終わるのを待つ
+    if max_age:
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (REFRESH_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return None
+    else:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', (REFRESH_LOCK_KEY,))
+
+    try:
+        if is_fresh(get_refreshed_at(cursor, db_type), now, max_age):
+            conn.rollback()
+            return None
+
+        started = time.perf_counter()
+        for name in SUMMARY_QUERIES:
+            cursor.execute('SELECT ispopulated FROM pg_matviews WHERE matviewname = %s', (name,))
+            concurrently = 'CONCURRENTLY ' if cursor.fetchone()[0] else ''
+            cursor.execute(f'REFRESH MATERIALIZED VIEW {concurrently}{name}')
+        elapsed = time.perf_counter() - started
+
+        record_refresh(cursor, db_type, now, elapsed)
+        conn.commit()
+        return elapsed
+    except Exception:
+        conn.rollback()
+        raise
+
+def refresh_sqlite_summaries(conn, max_age=0):
+    """SQLite の集計テーブルを作り直す
+
+    SQLite の書き込みロックはデータベース全体にかかり、その間は回答の保存（save_log）が待たされる。
+    そのため間隔の確認と logs の集計はロックを取らずに行い、BEGIN IMMEDIATE は集計テーブルの入れ替えの間だけにする。
+    """
+    cursor = conn.cursor()
+    conn.isolation_level = None
+    now = int(time.time())
+    if is_fresh(get_refreshed_at(cursor, "sqlite"), now, max_age):
+        return None
+
+    started = time.perf_counter()
+    # 3つの集計が同じ時点の logs から作られるよう、読み取りのトランザクションにまとめる
+    cursor.execute('BEGIN')
+    try:
+        rows = {}
+        for name in SQLITE_SUMMARY_COLUMNS:
+            cursor.execute(summary_query(name, "sqlite"))
+            rows[name] = cursor.fetchall()
+    finally:
+        cursor.execute('ROLLBACK')
+
+    # 集計している間にほかのワーカーが作り直していれば、書き込まずに終える
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        if is_fresh(get_refreshed_at(cursor, "sqlite"), now, max_age):
+            cursor.execute('ROLLBACK')
+            return None
+        for name, values in rows.items():
+            cursor.execute(f'DELETE FROM {name}')
+            if values:
+                marks = ', '.join('?' * len(values[0]))
+                cursor.executemany(f'INSERT INTO {name} VALUES ({marks})', values)
+        elapsed = time.perf_counter() - started
+        record_refresh(cursor, "sqlite", now, elapsed)
+        cursor.execute('COMMIT')
+        return elapsed
+    except Exception:
+        cursor.execute('ROLLBACK')
+        raise
+
+def accuracy(correct, partial, attempts):
+    """正解1・部分正解0.5として正解率（%）を計算"""
+    if not attempts:
+        return 0.0
+    return round((correct + partial * 0.5) / attempts * 100, 1)
+
+def load_dashboard(cursor, db_type, active_since, hardest_limit=10, min_attempts=5):
+    """ダッシュボードに表示する内容を集計から読む（logs は読まない）"""
+    placeholder = '%s' if db_type == "postgresql" else '?'
+
+    # 構文 × 形式 ごとに、学習者ごとの正解率の分布とクラス全体の正解率
+    cells = {(topic, format): {'students': 0, 'attempts': 0, 'correct': 0, 'partial': 0,
+                               'buckets': [0] * len(ACCURACY_BUCKETS)}
+             for topic in TOPICS for format in FORMATS}
+    cursor.execute('SELECT user_id, prefix, format, attempts, correct, partial FROM class_topic_summary')
+    per_student = {}
+    for user_id, prefix, format, attempts, correct, partial in cursor.fetchall():
+        key = (user_id, extract_topic_from_problem_id(f"{prefix}_"), format)
+        totals = per_student.setdefault(key, [0, 0, 0])
+        totals[0] += attempts
+        totals[1] += correct
+        totals[2] += partial
+    for (user_id, topic, format), (attempts, correct, partial) in per_student.items():
+        cell = cells.get((topic, format))
+        if cell is None:
+            continue
+        cell['students'] += 1
+        cell['attempts'] += attempts
+        cell['correct'] += correct
+        cell['partial'] += partial
+        student_accuracy = accuracy(correct, partial, attempts)
+        for i, (low, high) in enumerate(ACCURACY_BUCKETS):
+            if low <= student_accuracy < high:
+                cell['buckets'][i] += 1
+                break
+    topic_rows = []
+    for topic in TOPICS:
+        formats = []
+        for format in FORMATS:
+            cell = cells[(topic, format)]
+            cell['accuracy'] = accuracy(cell['correct'], cell['partial'], cell['attempts'])
+            formats.append((format, cell))
+        topic_rows.append((topic, formats))
+
+    # 正解率の低い問題（回答数が少ない問題は除く）
+    cursor.execute(f'''
+        SELECT problem_id, attempts, correct, partial, students FROM class_problem_summary
+        WHERE attempts >= {placeholder}
+        ORDER BY (correct + partial * 0.5) * 1.0 / attempts, attempts DESC
+        LIMIT {placeholder}
+    ''', (min_attempts, hardest_limit))
+    hardest = [{'problem_id': problem_id, 'attempts': attempts, 'students': students,
+                'accuracy': accuracy(correct, partial, attempts)}
+               for problem_id, attempts, correct, partial, students in cursor.fetchall()]
+
+    # 最近回答した学習者
+    since = datetime.fromtimestamp(active_since, timezone.utc) if db_type == "postgresql" else active_since
+    cursor.execute(f'''
+        SELECT user_id, attempts, correct, partial, last_answer FROM class_student_summary
+        WHERE last_answer >= {placeholder}
+        ORDER BY last_answer DESC
+    ''', (since,))
+    active = [{'user_id': user_id, 'attempts': attempts, 'accuracy': accuracy(correct, partial, attempts),
+               'last_answer': last_answer}
+              for user_id, attempts, correct, partial, last_answer in cursor.fetchall()]
+
+    cursor.execute('SELECT COUNT(*), COALESCE(SUM(attempts), 0) FROM class_student_summary')
+    student_count, answer_count = cursor.fetchone()
+
+    return {
+        'refreshed_at': get_refreshed_at(cursor, db_type),
+        'student_count': student_count,
+        'answer_count': answer_count,
+        'topics': topic_rows,
+        'hardest': hardest,
+        'active': active
+    }
@@ -0,0 +1,61 @@
+"""gunicorn の設定（Procfile から gunicorn -c gunicorn.conf.py app_sqlite:app で読み込む）
+
+応答時間の大半は OpenAI と DB の待ちなので、既定はスレッドで待ちを重ねる gthread ワーカーにする。
+
+    GUNICORN_WORKER_CLASS   gthread（既定）または sync
+    WEB_CONCURRENCY         ワーカー数（既定: gthread は CPU 数 + 1、sync は CPU 数 × 2 + 1）
+    GUNICORN_THREADS        gthread のワーカーあたりのスレッド数（既定: CPU 数 × 2、4 以上）
+    GUNICORN_PRELOAD        0 なら preload しない（既定は preload する）
+    GUNICORN_TIMEOUT        ワーカーのタイムアウト（秒、GPT の評価を待つので既定 60）
+
+preload するとマスターで app_sqlite を読み込んでから fork するので、問題バンク（problems.xlsx）、
+テンプレートのコンパイル結果、構文説明のページはワーカー間でコピーオンライトで共有され、
+スキーマの確認（ensure_schema）も1回で済む。fork の前に gc.freeze() して、ワーカーの GC が
+共有したオブジェクトの GC ヘッダに書き込んでページを複製しないようにする。
+gevent は使わない（psycopg2 の待ちで止まるうえ、preload と monkey patch の順番が合わない）。
+CPU 数はコンテナに割り当てられた分（sched_getaffinity）で数える。
+"""
+import gc
+import multiprocessing
+import os
+import random
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+CPUS = cpu_count()
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "sync":
+    workers = int(os.environ.get("WEB_CONCURRENCY", CPUS * 2 + 1))
+    threads = 1
+else:
+    workers = int(os.environ.get("WEB_CONCURRENCY", CPUS + 1))
+    threads = int(os.environ.get("GUNICORN_THREADS", max(4, CPUS * 2)))
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+# メモリの断片化や漏れに備えてワーカーを入れ替える（一斉に再起動しないようずらす）
+max_requests = 1000
+max_requests_jitter = 100
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+# ワーカーの生存確認のファイルはメモリ上に置く（コンテナのディスクが遅いと誤って再起動される）
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+def post_fork(server, worker):
+    # preload したマスターの乱数の状態を引き継ぐと、全ワーカーが同じ順で問題を選んでしまう
+    random.seed()
+
+def pre_fork(server, worker):
+    # マスターで読み込んだオブジェクトを GC の対象から外す（ワーカーの GC が共有ページに書き込まないように）
+    # fork の直前のゴミを先に回収しておく。ワーカーを入れ替えるたびに呼ばれるが、何度呼んでもよい
+    gc.collect()
+    gc.freeze()
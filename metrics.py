@@ -0,0 +1,133 @@
+"""処理時間の計測と Prometheus 形式の出力
+
+span("名前") で囲んだ区間（または @timed("名前") を付けた関数）の処理時間をヒストグラムに足し、
+リクエストの処理中であればリクエストごとの合計にも足す（1リクエスト1行のログに出す）。
+握りつぶしている例外は record_error("場所") で数える。
+
+METRICS_ENABLED=0 で止められる。止めると timed は関数をそのまま返し、span は何もしない。
+値はワーカー（プロセス）ごとに持つので、gunicorn の複数ワーカーではスクレイプしたワーカーの分になる。
+Flask や DB には依存しない。
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+
+# ヒストグラムの区切り（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# 名前 -> (説明, ラベル名, {ラベル値のタプル: [区切りごとの件数..., 合計秒, 件数]})
+_histograms = {}
+# 名前 -> (説明, ラベル名, {ラベル値のタプル: 件数})
+_counters = {}
+
+# 処理中のリクエストの区間ごとの合計（スレッドごと）
+_request_spans = threading.local()
+
+def define_histogram(name, help_text, label_names):
+    _histograms.setdefault(name, (help_text, tuple(label_names), {}))
+
+def define_counter(name, help_text, label_names):
+    _counters.setdefault(name, (help_text, tuple(label_names), {}))
+
+define_histogram('app_span_seconds', '区間ごとの処理時間', ['span'])
+define_counter('app_errors_total', '握りつぶした例外の件数', ['where'])
+
+def observe(name, labels, seconds):
+    series = _histograms[name][2]
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        values = series.get(labels)
+        if values is None:
+            values = series[labels] = [0] * (len(BUCKETS) + 2)
+        values[index] += 1 if index < len(BUCKETS) else 0
+        values[-2] += seconds
+        values[-1] += 1
+
+def increment(name, labels, amount=1):
+    series = _counters[name][2]
+    with _lock:
+        series[labels] = series.get(labels, 0) + amount
+
+def record_error(where):
+    if ENABLED:
+        increment('app_errors_total', (where,))
+
+def start_request():
+    """このスレッドでのリクエストの計測を始める"""
+    _request_spans.totals = {}
+
+def finish_request():
+    """リクエスト中の区間ごとの合計（ミリ秒）を返して計測を終える"""
+    totals = getattr(_request_spans, 'totals', None)
+    _request_spans.totals = None
+    if not totals:
+        return {}
+    return {name: round(seconds * 1000, 2) for name, seconds in totals.items()}
+
+def record_span(name, seconds):
+    observe('app_span_seconds', (name,), seconds)
+    totals = getattr(_request_spans, 'totals', None)
+    if totals is not None:
+        totals[name] = totals.get(name, 0.0) + seconds
+
+@contextmanager
+def span(name):
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+def timed(name):
+    """関数の処理時間を name の区間として計測するデコレーター"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_span(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def _format_labels(label_names, values, extra=()):
+    pairs = list(zip(label_names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def render_prometheus():
+    """Prometheus のテキスト形式（text/plain; version=0.0.4）"""
+    lines = []
+    with _lock:
+        for name, (help_text, label_names, series) in sorted(_counters.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in sorted(series.items()):
+                lines.append(f'{name}{_format_labels(label_names, labels)} {value}')
+        for name, (help_text, label_names, series) in sorted(_histograms.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, values in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(label_names, labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(label_names, labels, [("le", "+Inf")])} {values[-1]}')
+                lines.append(f'{name}_sum{_format_labels(label_names, labels)} {values[-2]:.6f}')
+                lines.append(f'{name}_count{_format_labels(label_names, labels)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,146 @@
+"""出題する問題の重み付き選択
+
+間違えた問題ほど出やすく、直前に解いた問題はしばらく出さない（間隔反復）。
+構文ごとに Fenwick 木で重みの累積和を持ち、抽選・更新とも O(log n) で行う。
+解いた問題はクールダウンの終了時刻のヒープに入れ、その間は重みを 0 にしておく。
+Flask や DB には依存しない。
+"""
+import heapq
+import random
+
+# まだ解いていない問題の重み
+UNSEEN_WEIGHT = 1.0
+# 正解済みの問題の重み（未出題より出にくくする）
+MASTERED_WEIGHT = 0.5
+# 不正解率1あたりに加える重み
+ERROR_WEIGHT = 3.0
+# 解いた問題を再出題しない時間（秒）
+COOLDOWN_SECONDS = 600
+# クラス全体の不正解率1あたりに未出題の重みから引く割合（みんなが間違える問題は後回しにする）
+CLASS_DIFFICULTY_DAMPING = 0.5
+
+def problem_weight(attempts, score_total, class_miss_rate=None):
+    """回答回数と得点の合計（正解1・部分正解0.5）から重みを計算"""
+    if attempts == 0:
+        if class_miss_rate is None:
+            return UNSEEN_WEIGHT
+        return UNSEEN_WEIGHT * (1 - CLASS_DIFFICULTY_DAMPING * class_miss_rate)
+    miss_rate = (attempts - score_total) / attempts
+    return MASTERED_WEIGHT + ERROR_WEIGHT * miss_rate
+
+class FenwickTree:
+    """重みの累積和（加算・累積和・累積和からの位置検索が O(log n)）"""
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.tree = [0.0] * (self.size + 1)
+        for i, weight in enumerate(weights, 1):
+            self.tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+
+    def add(self, index, delta):
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        result = 0.0
+        i = self.size
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+
+    def find(self, value):
+        """累積和が value を超える最初の位置"""
+        position = 0
+        bit = 1 << self.size.bit_length()
+        while bit:
+            next_position = position + bit
+            if next_position <= self.size and self.tree[next_position] <= value:
+                position = next_position
+                value -= self.tree[next_position]
+            bit >>= 1
+        return min(position, self.size - 1)
+
+class TopicSelector:
+    """1ユーザー・1構文分の出題インデックス"""
+
+    def __init__(self, problem_ids, stats, now, class_miss_rates=None):
+        """
+        problem_ids: 構文内の問題IDのリスト
+        stats: {問題ID: (回答回数, 得点の合計, 最後に解いた時刻のエポック秒)}
+        class_miss_rates: {問題ID: クラス全体の不正解率}（まだ解いていない問題の重みに使う）
+        """
+        class_miss_rates = class_miss_rates or {}
+        self.problem_ids = tuple(problem_ids)
+        self.positions = {problem_id: i for i, problem_id in enumerate(self.problem_ids)}
+        self.attempts = [0] * len(self.problem_ids)
+        self.scores = [0.0] * len(self.problem_ids)
+        self.weights = [UNSEEN_WEIGHT] * len(self.problem_ids)
+        self.cooldown_until = [None] * len(self.problem_ids)
+        self.cooldowns = []
+
+        active_weights = []
+        for i, problem_id in enumerate(self.problem_ids):
+            attempts, score_total, last_seen = stats.get(problem_id, (0, 0.0, None))
+            self.attempts[i] = attempts
+            self.scores[i] = score_total
+            self.weights[i] = problem_weight(attempts, score_total, class_miss_rates.get(problem_id))
+            if last_seen is not None and last_seen + COOLDOWN_SECONDS > now:
+                self.cooldown_until[i] = last_seen + COOLDOWN_SECONDS
+                self.cooldowns.append((self.cooldown_until[i], i))
+                active_weights.append(0.0)
+            else:
+                active_weights.append(self.weights[i])
+
+        heapq.heapify(self.cooldowns)
+        self.tree = FenwickTree(active_weights)
+
+    def _release(self, now):
+        """クールダウンが終わった問題の重みを戻す"""
+        while self.cooldowns and self.cooldowns[0][0] <= now:
+            until, i = heapq.heappop(self.cooldowns)
+            if self.cooldown_until[i] == until:
+                self.cooldown_until[i] = None
+                self.tree.add(i, self.weights[i])
+
+    def record(self, problem_id, score, seen_at):
+        """回答を反映し、その問題をクールダウンに入れる"""
+        i = self.positions.get(problem_id)
+        if i is None:
+            return
+
+        if self.cooldown_until[i] is None:
+            self.tree.add(i, -self.weights[i])
+        self.attempts[i] += 1
+        self.scores[i] += score
+        self.weights[i] = problem_weight(self.attempts[i], self.scores[i])
+
+        self.cooldown_until[i] = seen_at + COOLDOWN_SECONDS
+        heapq.heappush(self.cooldowns, (self.cooldown_until[i], i))
+
+    def is_available(self, problem_id, now):
+        i = self.positions.get(problem_id)
+        if i is None:
+            return False
+        self._release(now)
+        return self.cooldown_until[i] is None
+
+    def sample(self, now, rng=random):
+        """重みに比例して問題IDを1つ選ぶ（全てクールダウン中なら最も早く終わるもの）"""
+        self._release(now)
+
+        total = self.tree.total()
+        if total > 1e-9:
+            return self.problem_ids[self.tree.find(rng.random() * total)]
+
+        while self.cooldowns:
+            until, i = self.cooldowns[0]
+            if self.cooldown_until[i] == until:
+                return self.problem_ids[i]
+            heapq.heappop(self.cooldowns)
+        return rng.choice(self.problem_ids)
@@ -0,0 +1,118 @@
+"""管理者向けのプロファイラ
+
+- RequestProfile: cProfile で1リクエストを計測し、pstats のテキストまたは .prof ファイルにする
+- SamplingProfiler: 指定した時間のあいだ、プロセス内の全スレッドのスタックを一定間隔で集め、
+  flamegraph.pl や speedscope で読める collapsed 形式（「関数;関数;... 件数」）で書き出す
+
+サンプリングはバックグラウンドのスレッドで動くので、そのワーカーが通常のリクエストを
+処理している様子がそのまま取れる。対象は開始を受け付けたワーカー（プロセス）だけ。
+Flask や DB には依存しない。
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+# サンプリングの上限（長時間動かしっぱなしにしない）
+MAX_SAMPLE_SECONDS = 120
+DEFAULT_INTERVAL_SECONDS = 0.005
+# pstats のテキストに出す関数の数
+STATS_LIMIT = 60
+
+class RequestProfile:
+    """1リクエスト分の cProfile（enable したスレッドだけを計測する）"""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def as_text(self, sort='cumulative', limit=STATS_LIMIT):
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def as_pstats_file(self):
+        """pstats.Stats(ファイル名) や snakeviz で読める形式"""
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+def frame_stack(frame):
+    """外側から順に「ファイル名:関数名」を ; でつなぐ"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class SamplingProfiler:
+    """一定時間スタックを集めてファイルに書き出す（同時に動くのはプロセスごとに1つ）"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self, seconds, interval=DEFAULT_INTERVAL_SECONDS):
+        """サンプリングを始めて書き出し先のファイル名を返す（動いている最中なら None）"""
+        seconds = max(0.1, min(float(seconds), MAX_SAMPLE_SECONDS))
+        interval = max(0.001, float(interval))
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"stacks-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.txt"
+        thread = threading.Thread(target=self._run, args=(os.path.join(self.output_dir, name), seconds, interval),
+                                  daemon=True)
+        thread.start()
+        return name
+
+    def _run(self, path, seconds, interval):
+        try:
+            counts = self.sample(seconds, interval)
+            # 書き終わるまでは一覧に出さない
+            with open(path + '.part', 'w', encoding='utf-8') as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            os.replace(path + '.part', path)
+        finally:
+            with self.lock:
+                self.running = False
+
+    def sample(self, seconds, interval):
+        own = threading.get_ident()
+        counts = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    counts[frame_stack(frame)] += 1
+            time.sleep(interval)
+        return counts
+
+    def list_outputs(self):
+        """書き出し済みのファイル（新しい順）"""
+        try:
+            names = [name for name in os.listdir(self.output_dir)
+                     if name.startswith('stacks-') and name.endswith('.txt')]
+        except OSError:
+            return []
+        return sorted(names, reverse=True)
+
+    def read_output(self, name):
+        if name not in self.list_outputs():
+            return None
+        with open(os.path.join(self.output_dir, name), encoding='utf-8') as f:
+            return f.read()
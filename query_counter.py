@@ -0,0 +1,74 @@
+"""DB のクエリ数・時間をリクエストごとに数える
+
+get_db_connection が返す接続のカーソルを数えるクラス（counting_cursor_class、
+SQLite は CountingSQLiteConnection）にしておき、start_request から finish_request までに
+そのスレッドで実行した文の件数・合計時間・文ごとの回数を集める。
+同じ文を何度も実行していれば（ループの中のクエリ、いわゆる N+1）most_repeated でわかる。
+リクエスト外（先読みのスレッドなど）で実行した文は数えない。Flask には依存しない。
+"""
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+_local = threading.local()
+
+class RequestQueries:
+    """1リクエストで実行した文"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def most_repeated(self):
+        """最も多く実行した文と回数（なければ (None, 0)）"""
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+def start_request():
+    _local.queries = RequestQueries()
+
+def finish_request():
+    """このスレッドのリクエストで集めた RequestQueries を返して集計を終える"""
+    queries = getattr(_local, 'queries', None)
+    _local.queries = None
+    return queries
+
+def record(statement, seconds):
+    queries = getattr(_local, 'queries', None)
+    if queries is None:
+        return
+    queries.count += 1
+    queries.seconds += seconds
+    queries.statements[statement if isinstance(statement, str) else str(statement)] += 1
+
+def counting_cursor_class(base):
+    """execute・executemany を数えるカーソルのクラス（sqlite3.Cursor や psycopg2 のカーソルを継承する）"""
+
+    class CountingCursor(base):
+        def execute(self, statement, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().execute(statement, *args, **kwargs)
+            finally:
+                record(statement, time.perf_counter() - started)
+
+        def executemany(self, statement, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().executemany(statement, *args, **kwargs)
+            finally:
+                record(statement, time.perf_counter() - started)
+
+    CountingCursor.__name__ = CountingCursor.__qualname__ = f"Counting{base.__name__}"
+    return CountingCursor
+
+CountingSQLiteCursor = counting_cursor_class(sqlite3.Cursor)
+
+class CountingSQLiteConnection(sqlite3.Connection):
+    """cursor()（と、それを使う execute()）が数えるカーソルを返す SQLite の接続"""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or CountingSQLiteCursor)
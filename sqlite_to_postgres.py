@@ -0,0 +1,167 @@
+"""SQLite（学習履歴.db）から PostgreSQL への一括移行
+
+logs は SQLite の id 順に execute_values でまとめて挿入し、バッチごとに
+移行済みの最大 id（ハイウォーターマーク）を PostgreSQL の migration_state に記録する。
+途中で止まっても、次回はその続きから移行する。PostgreSQL 側の id は新しく振り直す。
+移行した回答は、バッチごとに問題ごとの集計（problem_stats）にも足す。
+learning_progress は user_id ごとに last_updated が新しい方を残す（upsert）。
+PostgreSQL のテーブルはアプリの起動時（init_db）に作られたものを使う。
+
+app_sqlite.py の /migrate_sqlite_to_postgres と tools/migrate_sqlite_to_postgres.py から使う。
+"""
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import adaptive_engine
+
+BATCH_SIZE = 5000
+
+LOG_COLUMNS = ['user_id', 'timestamp', 'problem_id', 'format', 'user_sql', 'user_explanation',
+               'sql_result', 'sql_feedback', 'meaning_result', 'meaning_feedback', 'verdict']
+
+# 回答時間は記録がないので回答数・正解数・部分正解数だけ足す
+PROBLEM_STATS_UPSERT = '''
+    INSERT INTO problem_stats (problem_id, attempts, correct, partial, timed_attempts, total_answer_seconds, updated_at)
+    VALUES %s
+    ON CONFLICT (problem_id) DO UPDATE SET
+        attempts = problem_stats.attempts + EXCLUDED.attempts,
+        correct = problem_stats.correct + EXCLUDED.correct,
+        partial = problem_stats.partial + EXCLUDED.partial,
+        updated_at = EXCLUDED.updated_at
+'''
+
+PROGRESS_COLUMNS = ['user_id', 'current_topic', 'current_format', 'format_question_count',
+                    'format_start_time', 'last_updated']
+
+def to_utc(value):
+    """SQLite の時刻（UNIX時間、または旧形式のローカル時刻の文字列）を UTC の datetime に変換"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str) and not value.lstrip('-').isdigit():
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").astimezone(timezone.utc)
+    return datetime.fromtimestamp(int(value), timezone.utc)
+
+def get_high_water_mark(pg_cursor, name):
+    pg_cursor.execute('''
+        CREATE TABLE IF NOT EXISTS migration_state (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        )
+    ''')
+    pg_cursor.execute('SELECT last_id FROM migration_state WHERE name = %s', (name,))
+    row = pg_cursor.fetchone()
+    return row[0] if row else 0
+
+def set_high_water_mark(pg_cursor, name, last_id):
+    pg_cursor.execute('''
+        INSERT INTO migration_state (name, last_id, updated_at) VALUES (%s, %s, now())
+        ON CONFLICT (name) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = EXCLUDED.updated_at
+    ''', (name, last_id))
+
+def get_sqlite_columns(sqlite_conn, table):
+    return [column[1] for column in sqlite_conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def count_pending_logs(sqlite_conn, pg_conn, name='sqlite_logs'):
+    """まだ移行していない logs の件数"""
+    pg_cursor = pg_conn.cursor()
+    last_id = get_high_water_mark(pg_cursor, name)
+    pg_conn.commit()
+    return sqlite_conn.execute('SELECT COUNT(*) FROM logs WHERE id > ?', (last_id,)).fetchone()[0]
+
+def migrate_logs(sqlite_conn, pg_conn, name='sqlite_logs', batch_size=BATCH_SIZE):
+    """logs を移行し、移行した件数を返す"""
+    from psycopg2.extras import execute_values
+
+    available = set(get_sqlite_columns(sqlite_conn, 'logs'))
+    # 古いDBには format・verdict 列がないことがある
+    select_list = ", ".join(column if column in available else "NULL" for column in LOG_COLUMNS)
+
+    pg_cursor = pg_conn.cursor()
+    last_id = get_high_water_mark(pg_cursor, name)
+    pg_cursor.execute("SELECT to_regclass('problem_stats')")
+    has_problem_stats = pg_cursor.fetchone()[0] is not None
+    pg_conn.commit()
+
+    migrated = 0
+    while True:
+        rows = sqlite_conn.execute(
+            f'SELECT id, {select_list} FROM logs WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        values = []
+        problem_counts = Counter()
+        for row in rows:
+            record = dict(zip(LOG_COLUMNS, row[1:]))
+            record['timestamp'] = to_utc(record['timestamp'])
+            # 判定不明を不正解（0）として埋めていた古いDBもあるので、0 も文字列から判定し直す
+            if record['verdict'] in (None, adaptive_engine.VERDICT_INCORRECT):
+                record['verdict'] = adaptive_engine.verdict_code(record['sql_result'], record['meaning_result'])
+            values.append(tuple(record[column] for column in LOG_COLUMNS))
+            problem_counts[(record['problem_id'], record['verdict'])] += 1
+
+        # 挿入・集計・ハイウォーターマークの更新を同じトランザクションで行う
+        execute_values(pg_cursor, f'INSERT INTO logs ({", ".join(LOG_COLUMNS)}) VALUES %s', values, page_size=1000)
+        if has_problem_stats:
+            totals = {}
+            for (problem_id, verdict), count in problem_counts.items():
+                attempts, correct, partial = totals.get(problem_id, (0, 0, 0))
+                totals[problem_id] = (attempts + count,
+                                      correct + (count if verdict == adaptive_engine.VERDICT_CORRECT else 0),
+                                      partial + (count if verdict == adaptive_engine.VERDICT_PARTIAL else 0))
+            now = datetime.now(timezone.utc)
+            execute_values(pg_cursor, PROBLEM_STATS_UPSERT,
+                           [(problem_id, attempts, correct, partial, 0, 0, now)
+                            for problem_id, (attempts, correct, partial) in totals.items()])
+        last_id = rows[-1][0]
+        set_high_water_mark(pg_cursor, name, last_id)
+        pg_conn.commit()
+        migrated += len(rows)
+
+    return migrated
+
+def merge_learning_progress(sqlite_conn, pg_conn):
+    """learning_progress を upsert し、対象の件数を返す（last_updated が新しい方を残す）"""
+    from psycopg2.extras import execute_values
+
+    if not get_sqlite_columns(sqlite_conn, 'learning_progress'):
+        return 0
+    rows = sqlite_conn.execute(f'SELECT {", ".join(PROGRESS_COLUMNS)} FROM learning_progress').fetchall()
+    if not rows:
+        return 0
+
+    values = [(user_id, topic, format, count, to_utc(start_time), to_utc(last_updated))
+              for user_id, topic, format, count, start_time, last_updated in rows]
+    pg_cursor = pg_conn.cursor()
+    execute_values(pg_cursor, f'''
+        INSERT INTO learning_progress ({", ".join(PROGRESS_COLUMNS)}) VALUES %s
+        ON CONFLICT (user_id) DO UPDATE SET
+            current_topic = EXCLUDED.current_topic,
+            current_format = EXCLUDED.current_format,
+            format_question_count = EXCLUDED.format_question_count,
+            format_start_time = EXCLUDED.format_start_time,
+            last_updated = EXCLUDED.last_updated
+        WHERE learning_progress.last_updated < EXCLUDED.last_updated
+    ''', values, page_size=1000)
+    pg_conn.commit()
+    return len(rows)
+
+def migrate(sqlite_conn, pg_conn, batch_size=BATCH_SIZE):
+    """logs と learning_progress を移行し、件数と所要時間を返す"""
+    started = time.perf_counter()
+    try:
+        logs = migrate_logs(sqlite_conn, pg_conn, batch_size=batch_size)
+        progress = merge_learning_progress(sqlite_conn, pg_conn)
+    except Exception:
+        pg_conn.rollback()
+        raise
+    elapsed = time.perf_counter() - started
+    return {
+        'logs': logs,
+        'learning_progress': progress,
+        'seconds': elapsed,
+        'rows_per_second': logs / elapsed if elapsed > 0 else 0.0
+    }
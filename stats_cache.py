@@ -0,0 +1,87 @@
+"""学習統計の結果キャッシュ
+
+キーは「種類:ユーザーID:バージョン」。バージョンはユーザーごとのカウンタで、
+回答を保存するたびに bump_version で1増やすので、古いエントリは二度と読まれず
+LRU や有効期限で消えていく。
+
+LocalStatsCache はプロセス内の LRU（ワーカーごと）、RedisStatsCache は
+ワーカー間で共有する。同じメソッド（get・set・get_version・bump_version・clear）を
+持つオブジェクトなら、ほかの保存先も使える。Flask や DB には依存しない。
+"""
+import json
+import threading
+from collections import OrderedDict
+
+# プロセス内に保持するエントリ数の上限
+LOCAL_MAX_ENTRIES = 2000
+# 共有キャッシュのエントリの有効期間（秒）
+SHARED_TTL_SECONDS = 24 * 3600
+
+class LocalStatsCache:
+    """プロセス内の LRU"""
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_version(self, user_id):
+        with self.lock:
+            return self.versions.get(user_id, 0)
+
+    def bump_version(self, user_id):
+        with self.lock:
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+class RedisStatsCache:
+    """Redis に置く共有キャッシュ（値は JSON で保存する）"""
+
+    def __init__(self, url, prefix='stats:', ttl=SHARED_TTL_SECONDS):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def get_version(self, user_id):
+        value = self.client.get(f"{self.prefix}version:{user_id}")
+        return int(value) if value is not None else 0
+
+    def bump_version(self, user_id):
+        self.client.incr(f"{self.prefix}version:{user_id}")
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+def create_stats_cache(url=None):
+    """url（redis://...）があれば共有キャッシュ、なければプロセス内の LRU を返す"""
+    if url:
+        return RedisStatsCache(url)
+    return LocalStatsCache()
@@ -0,0 +1,105 @@
+"""古い期間の logs パーティションを切り離して圧縮CSVに書き出す（PostgreSQL、LOG_PARTITION 使用時）
+
+使い方（リポジトリのルートで実行、DATABASE_URL が必要）:
+    python -m tools.archive_logs --before 2025-04-01              # 2025年3月以前の期間を書き出して削除
+    python -m tools.archive_logs --before 2025-04-01 --dry-run    # 対象のパーティションを表示するだけ
+    python -m tools.archive_logs --before 2025-04-01 --keep       # 切り離すだけでテーブルは残す
+
+終了が --before 以前のパーティションごとに DETACH → COPY TO（gzip圧縮のCSV）→ DROP を
+1つのトランザクションで行う。ファイルを書き終える前に失敗した場合は何も変わらない。
+戻すときは同じ列のテーブルを作って \\copy で読み込み、ATTACH PARTITION する。
+"""
+import argparse
+import gzip
+import os
+import re
+import time
+from datetime import datetime
+
+# pg_get_expr(relpartbound) の "FOR VALUES FROM ('...') TO ('...')"
+BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def connect():
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise SystemExit("DATABASE_URL を設定してください（パーティション分割は PostgreSQL のみ）")
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    import psycopg2
+    return psycopg2.connect(database_url)
+
+def list_partitions(cursor):
+    """logs のパーティションを [(名前, 開始, 終了)] で返す（既定パーティションは除く）"""
+    cursor.execute('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'logs'::regclass
+        ORDER BY c.relname
+    ''')
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = BOUND_PATTERN.search(bound or '')
+        if match:
+            partitions.append((name, match.group(1), match.group(2)))
+    return partitions
+
+def archive_partition(conn, name, out_dir, keep=False):
+    """1つのパーティションを切り離して書き出す。戻り値は (行数, ファイル)"""
+    path = os.path.join(out_dir, f"{name}.csv.gz")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f'ALTER TABLE logs DETACH PARTITION {name}')
+        cursor.execute(f'SELECT COUNT(*) FROM {name}')
+        rows = cursor.fetchone()[0]
+        with gzip.open(path + ".tmp", "wb") as f:
+            cursor.copy_expert(f'COPY (SELECT * FROM {name} ORDER BY id) TO STDOUT WITH CSV HEADER', f)
+        os.replace(path + ".tmp", path)
+        if not keep:
+            cursor.execute(f'DROP TABLE {name}')
+        conn.commit()
+        return rows, path
+    except Exception:
+        conn.rollback()
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        raise
+
+def main():
+    parser = argparse.ArgumentParser(description="古い期間の logs パーティションを圧縮CSVに書き出して切り離す")
+    parser.add_argument("--before", required=True, help="この日付（YYYY-MM-DD）までに終わる期間を対象にする")
+    parser.add_argument("--out-dir", default="log_archive", help="書き出し先のディレクトリ")
+    parser.add_argument("--keep", action="store_true", help="切り離したテーブルを削除しない")
+    parser.add_argument("--dry-run", action="store_true", help="対象を表示するだけ")
+    args = parser.parse_args()
+
+    before = datetime.strptime(args.before, "%Y-%m-%d").astimezone()
+    conn = connect()
+    cursor = conn.cursor()
+    targets = [(name, start, end) for name, start, end in list_partitions(cursor)
+               if datetime.fromisoformat(end) <= before]
+    conn.rollback()
+
+    if not targets:
+        print("対象のパーティションはありません")
+        return
+
+    if args.dry_run:
+        for name, start, end in targets:
+            print(f"{name}: {start} 〜 {end}")
+        conn.close()
+        return
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    total_rows = 0
+    started = time.perf_counter()
+    for name, start, end in targets:
+        rows, path = archive_partition(conn, name, args.out_dir, args.keep)
+        total_rows += rows
+        print(f"{name}: {rows}件 → {path}")
+
+    conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"{len(targets)}パーティション, {total_rows}件, {elapsed:.2f}秒")
+
+if __name__ == "__main__":
+    main()
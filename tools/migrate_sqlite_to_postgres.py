@@ -0,0 +1,43 @@
+"""SQLite の学習履歴を PostgreSQL に移行する
+
+使い方（リポジトリのルートで実行、DATABASE_URL が必要）:
+    python -m tools.migrate_sqlite_to_postgres                     # 学習履歴.db を移行
+    python -m tools.migrate_sqlite_to_postgres --db backup.db --batch-size 10000
+
+途中で止めても、もう一度実行すれば続きから移行する（sqlite_to_postgres を参照）。
+"""
+import argparse
+import os
+import sqlite3
+
+import sqlite_to_postgres
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite の logs・learning_progress を PostgreSQL に移行する")
+    parser.add_argument("--db", default="学習履歴.db", help="移行元の SQLite ファイル")
+    parser.add_argument("--batch-size", type=int, default=sqlite_to_postgres.BATCH_SIZE)
+    args = parser.parse_args()
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise SystemExit("DATABASE_URL を設定してください")
+    if not os.path.exists(args.db):
+        raise SystemExit(f"{args.db} が見つかりません")
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+
+    import psycopg2
+    sqlite_conn = sqlite3.connect(args.db)
+    pg_conn = psycopg2.connect(database_url)
+    try:
+        print(f"未移行の logs: {sqlite_to_postgres.count_pending_logs(sqlite_conn, pg_conn)}件")
+        result = sqlite_to_postgres.migrate(sqlite_conn, pg_conn, args.batch_size)
+    finally:
+        sqlite_conn.close()
+        pg_conn.close()
+
+    print(f"logs: {result['logs']}件, learning_progress: {result['learning_progress']}件, "
+          f"{result['seconds']:.2f}秒（{result['rows_per_second']:,.0f} 件/秒）")
+
+if __name__ == "__main__":
+    main()
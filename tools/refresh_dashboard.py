@@ -0,0 +1,41 @@
+"""教員用ダッシュボードの集計を作り直す
+
+使い方（リポジトリのルートで実行）:
+    python -m tools.refresh_dashboard               # DATABASE_URL があれば PostgreSQL、なければ 学習履歴.db
+    python -m tools.refresh_dashboard --db backup.db
+
+アプリ側で作り直さない設定（DASHBOARD_REFRESH_SECONDS=0）のときに cron 等から実行する。
+集計のビュー・テーブルはアプリの起動時（init_db）に作られたものを使う。
+"""
+import argparse
+import os
+import sqlite3
+
+import class_dashboard
+
+def main():
+    parser = argparse.ArgumentParser(description="教員用ダッシュボードの集計を作り直す")
+    parser.add_argument("--db", default="学習履歴.db", help="SQLite のファイル（DATABASE_URL がないとき）")
+    args = parser.parse_args()
+
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url:
+        if database_url.startswith("postgres://"):
+            database_url = database_url.replace("postgres://", "postgresql://", 1)
+        import psycopg2
+        conn = psycopg2.connect(database_url)
+        db_type = "postgresql"
+    else:
+        if not os.path.exists(args.db):
+            raise SystemExit(f"{args.db} が見つかりません")
+        conn = sqlite3.connect(args.db)
+        db_type = "sqlite"
+
+    try:
+        seconds = class_dashboard.refresh_summaries(conn, db_type)
+    finally:
+        conn.close()
+    print(f"集計を作り直しました（{seconds:.2f}秒）")
+
+if __name__ == "__main__":
+    main()
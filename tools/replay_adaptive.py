@@ -0,0 +1,130 @@
+"""logs テーブルの回答履歴を適応的学習エンジンで再シミュレーションする
+
+使い方（リポジトリのルートで実行）:
+    python -m tools.replay_adaptive                 # 学習履歴.db（DATABASE_URL があれば PostgreSQL）
+    python -m tools.replay_adaptive --db other.db --user student001 --test-mode
+
+ユーザーごとに回答を id 順にエンジンへ流し、最終的な構文・形式を
+learning_progress テーブルの値と比較する。
+ログには復習・jump_to による移動が残らないため、エンジンの現在の形式と異なる回答は
+「コース外」として読み飛ばし、同じ構文・形式のコース外回答が2件続いたらそこへ移動したとみなす。
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+import adaptive_engine
+
+FETCH_SIZE = 5000
+
+def connect(db_file):
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url and not db_file:
+        import psycopg2
+        if database_url.startswith("postgres://"):
+            database_url = database_url.replace("postgres://", "postgresql://", 1)
+        return psycopg2.connect(database_url), '%s'
+    return sqlite3.connect(db_file or "学習履歴.db"), '?'
+
+def iter_user_events(conn, placeholder, user_id=None):
+    """(user_id, [(構文, 形式, 得点), ...]) をユーザーごとに返す"""
+    cursor = conn.cursor()
+    query = 'SELECT user_id, problem_id, format, verdict FROM logs'
+    params = ()
+    if user_id:
+        query += f' WHERE user_id = {placeholder}'
+        params = (user_id,)
+    cursor.execute(query + ' ORDER BY user_id, id', params)
+
+    current_user = None
+    events = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for row_user, problem_id, format, verdict in rows:
+            if row_user != current_user:
+                if current_user is not None:
+                    yield current_user, events
+                current_user = row_user
+                events = []
+            events.append((adaptive_engine.extract_topic_from_problem_id(problem_id), format,
+                           adaptive_engine.verdict_score(verdict)))
+
+    if current_user is not None:
+        yield current_user, events
+
+def replay_user(events, test_mode=False):
+    """1ユーザー分の回答を再生し、(最終状態, 遷移回数, コース外回答数) を返す"""
+    state = adaptive_engine.initial_state()
+    transitions = 0
+    off_track = 0
+    last_off_track = None
+
+    for topic, format, score in events:
+        if format != state.format:
+            off_track += 1
+            if last_off_track == (topic, format):
+                state = adaptive_engine.initial_state(topic, format)
+                last_off_track = None
+            else:
+                last_off_track = (topic, format)
+                continue
+        last_off_track = None
+
+        state, transition = adaptive_engine.step(state, topic, score, test_mode)
+        if transition.next_topic:
+            transitions += 1
+
+    return state, transitions, off_track
+
+def load_stored_progress(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT user_id, current_topic, current_format FROM learning_progress')
+    except Exception as e:
+        return {}
+    return {user_id: (topic, format) for user_id, topic, format in cursor.fetchall()}
+
+def main():
+    parser = argparse.ArgumentParser(description="logs の回答履歴を適応的学習エンジンで再生する")
+    parser.add_argument("--db", help="SQLite ファイル（省略時は DATABASE_URL または 学習履歴.db）")
+    parser.add_argument("--user", help="特定のユーザーのみ再生する")
+    parser.add_argument("--test-mode", action="store_true", help="テストモード（各形式2問）のルールで再生する")
+    parser.add_argument("--quiet", action="store_true", help="ユーザーごとの結果を表示しない")
+    args = parser.parse_args()
+
+    conn, placeholder = connect(args.db)
+    stored = load_stored_progress(conn)
+
+    users = events_total = mismatches = 0
+    replay_seconds = 0.0
+    started = time.perf_counter()
+
+    for user_id, events in iter_user_events(conn, placeholder, args.user):
+        replay_started = time.perf_counter()
+        state, transitions, off_track = replay_user(events, args.test_mode)
+        replay_seconds += time.perf_counter() - replay_started
+
+        users += 1
+        events_total += len(events)
+        stored_state = stored.get(user_id)
+        matched = stored_state is None or stored_state == (state.topic, state.format)
+        if not matched:
+            mismatches += 1
+
+        if not args.quiet:
+            stored_label = f"{stored_state[0]} - {stored_state[1]}" if stored_state else "（なし）"
+            print(f"{user_id}: {len(events)}件 → {state.topic} - {state.format} "
+                  f"（遷移 {transitions}回, コース外 {off_track}件, DB: {stored_label}{'' if matched else ' ≠'}）")
+
+    conn.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"ユーザー数: {users}, 回答数: {events_total}, DBの進捗と不一致: {mismatches}")
+    if replay_seconds > 0:
+        print(f"再生: {events_total / replay_seconds:,.0f} 件/秒（読み込み込み全体 {elapsed:.2f} 秒）")
+
+if __name__ == "__main__":
+    main()
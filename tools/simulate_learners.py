@@ -0,0 +1,199 @@
+"""合成学習者による適応的学習ルールのシミュレーション（閾値調整用）
+
+使い方（リポジトリのルートで実行、numpy が必要: pip install -r requirements-dev.txt）:
+    python -m tools.simulate_learners                       # 現行ルールで 5000 人
+    python -m tools.simulate_learners --threshold 2 3 5 --windows 5,5,3,3 5,5,5,5 --advance 80 75
+
+全学習者を NumPy の配列で同時に1問ずつ進め、TOPICS×FORMATS を現行ルール
+（adaptive_engine.decide_transition と同じ判定）で移動させる。
+学習者は構文ごとの能力値を持ち、形式ごとの難易度との差から正解・部分正解の確率が決まる。
+回答するたびにその構文の能力値が少しずつ上がる。
+最後の構文の意味説明に合格した時点を修了とし、修了までの回答数・学習時間の分布を出力する。
+"""
+import argparse
+import itertools
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import adaptive_engine
+
+# 判定ルールのパラメータ
+# window_sizes は FORMATS の順（選択式, 穴埋め式, 記述式, 意味説明）
+RuleParams = namedtuple('RuleParams', ['question_threshold', 'window_sizes', 'advance_cutoff', 'stay_cutoff', 'meaning_cutoff'])
+
+# 合成学習者のパラメータ
+LearnerParams = namedtuple('LearnerParams', ['ability_mean', 'ability_sd', 'learning_rate', 'format_difficulty',
+                                             'partial_share', 'seconds_per_answer'])
+
+DEFAULT_LEARNERS = LearnerParams(
+    ability_mean=1.0,
+    ability_sd=0.8,
+    learning_rate=0.02,
+    format_difficulty=(-0.5, 0.0, 0.8, 1.0),
+    # 完全一致で判定する選択式・穴埋め式には部分正解がない
+    partial_share=(0.0, 0.0, 0.4, 0.5),
+    seconds_per_answer=(30, 45, 120, 150),
+)
+
+def current_rules(test_mode=False):
+    """adaptive_engine の現行ルール"""
+    return RuleParams(
+        question_threshold=adaptive_engine.get_format_question_threshold(test_mode),
+        window_sizes=tuple(adaptive_engine.get_window_size(f, test_mode) for f in adaptive_engine.FORMATS),
+        advance_cutoff=80,
+        stay_cutoff=70,
+        meaning_cutoff=70,
+    )
+
+def simulate(rules, learners=DEFAULT_LEARNERS, students=5000, max_answers=3000, seed=0):
+    """
+    全学習者を最大 max_answers 問まで進める
+    戻り値: 修了までの回答数（未修了は -1）、修了までの秒数、最終的な構文・形式の番号
+    """
+    rng = np.random.default_rng(seed)
+    n_topics = len(adaptive_engine.TOPICS)
+    meaning = len(adaptive_engine.FORMATS) - 1
+    window_sizes = np.asarray(rules.window_sizes)
+    max_window = int(window_sizes.max())
+    format_difficulty = np.asarray(learners.format_difficulty, dtype=float)
+    partial_share = np.asarray(learners.partial_share, dtype=float)
+    seconds_per_answer = np.asarray(learners.seconds_per_answer, dtype=float)
+
+    ability = rng.normal(learners.ability_mean, learners.ability_sd, size=(students, n_topics))
+    topic = np.zeros(students, dtype=np.int64)
+    format = np.zeros(students, dtype=np.int64)
+    question_count = np.zeros(students, dtype=np.int64)
+    filled = np.zeros(students, dtype=np.int64)
+    # 直近の得点（列0が最新）
+    window = np.zeros((students, max_window))
+    seconds = np.zeros(students)
+    answers_to_finish = np.full(students, -1, dtype=np.int64)
+    active = np.ones(students, dtype=bool)
+    rows = np.arange(students)
+    columns = np.arange(max_window)
+    trapped = window_sizes < rules.question_threshold
+    active[trapped[format]] = False
+
+    for answer in range(1, max_answers + 1):
+        idx = rows[active]
+        if idx.size == 0:
+            break
+        t = topic[idx]
+        f = format[idx]
+
+        # 回答
+        p_correct = 1.0 / (1.0 + np.exp(format_difficulty[f] - ability[idx, t]))
+        p_partial = (1.0 - p_correct) * partial_share[f]
+        u = rng.random(idx.size)
+        score = np.where(u < p_correct, 1.0, np.where(u < p_correct + p_partial, 0.5, 0.0))
+        ability[idx, t] += learners.learning_rate
+        seconds[idx] += seconds_per_answer[f]
+
+        window[idx, 1:] = window[idx, :-1]
+        window[idx, 0] = score
+        filled[idx] = np.minimum(filled[idx] + 1, max_window)
+        question_count[idx] += 1
+
+        # 「次の問題」での判定
+        size = window_sizes[f]
+        total = np.minimum(filled[idx], size)
+        in_window = columns[None, :] < total[:, None]
+        correct = (window[idx] * in_window).sum(axis=1)
+        accuracy = np.round(correct / np.maximum(total, 1) * 100, 1)
+        decided = (question_count[idx] >= rules.question_threshold) & (total >= rules.question_threshold)
+
+        next_topic = t.copy()
+        next_format = f.copy()
+        finished = np.zeros(idx.size, dtype=bool)
+
+        is_meaning = f == meaning
+        passed = decided & is_meaning & (accuracy >= rules.meaning_cutoff)
+        finished[passed & (t == n_topics - 1)] = True
+        moved_on = passed & (t < n_topics - 1)
+        next_topic[moved_on] += 1
+        next_format[moved_on] = 0
+        next_format[decided & is_meaning & ~passed] = 2
+
+        others = decided & ~is_meaning
+        up = others & (accuracy >= rules.advance_cutoff)
+        down = others & (accuracy < rules.stay_cutoff)
+        next_format[up] = np.minimum(f[up] + 1, meaning)
+        next_format[down] = np.maximum(f[down] - 1, 0)
+
+        # 形式・構文が変わったら format_start_time が更新され、それまでの結果は数えない
+        changed = (next_topic != t) | (next_format != f)
+        reset = idx[changed]
+        topic[idx] = next_topic
+        format[idx] = next_format
+        question_count[reset] = 0
+        filled[reset] = 0
+        window[reset] = 0.0
+
+        done = idx[finished]
+        answers_to_finish[done] = answer
+        active[done] = False
+
+        # 窓が閾値より小さい形式に入ると二度と判定されないので、そこで打ち切る
+        active[idx[trapped[next_format]]] = False
+
+    seconds_to_finish = np.where(answers_to_finish >= 0, seconds, -1.0)
+    return answers_to_finish, seconds_to_finish, topic, format
+
+def summarize(rules, answers_to_finish, seconds_to_finish, topic, format):
+    finished = answers_to_finish >= 0
+    rate = finished.mean() * 100
+    line = (f"閾値={rules.question_threshold} 窓={','.join(map(str, rules.window_sizes))} "
+            f"進む≥{rules.advance_cutoff:g} 留まる≥{rules.stay_cutoff:g} 意味≥{rules.meaning_cutoff:g} | "
+            f"修了 {rate:5.1f}%")
+    if finished.any():
+        a10, a50, a90 = np.percentile(answers_to_finish[finished], [10, 50, 90])
+        m10, m50, m90 = np.percentile(seconds_to_finish[finished] / 60, [10, 50, 90])
+        line += f" | 回答数 p10/50/90 = {a10:.0f}/{a50:.0f}/{a90:.0f} | 時間(分) = {m10:.0f}/{m50:.0f}/{m90:.0f}"
+    if not finished.all():
+        stuck = np.bincount(format[~finished], minlength=len(adaptive_engine.FORMATS))
+        where = ", ".join(f"{name} {count}" for name, count in zip(adaptive_engine.FORMATS, stuck) if count)
+        line += f" | 未修了の形式: {where}"
+    return line
+
+def parse_windows(text):
+    sizes = tuple(int(v) for v in text.split(','))
+    if len(sizes) != len(adaptive_engine.FORMATS):
+        raise argparse.ArgumentTypeError("窓の大きさは形式の数（4つ）をカンマ区切りで指定してください")
+    return sizes
+
+def main():
+    defaults = current_rules()
+    parser = argparse.ArgumentParser(description="合成学習者で適応的学習のルールを評価する")
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--max-answers", type=int, default=3000, help="学習者1人あたりの最大回答数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--test-mode", action="store_true", help="テストモードの現行ルールを既定値にする")
+    parser.add_argument("--threshold", type=int, nargs="+", help="形式変更までの問題数")
+    parser.add_argument("--windows", type=parse_windows, nargs="+", help="形式ごとの正答率の窓（例: 5,5,3,3）")
+    parser.add_argument("--advance", type=float, nargs="+", default=[defaults.advance_cutoff])
+    parser.add_argument("--stay", type=float, nargs="+", default=[defaults.stay_cutoff])
+    parser.add_argument("--meaning", type=float, nargs="+", default=[defaults.meaning_cutoff])
+    parser.add_argument("--ability", type=float, default=DEFAULT_LEARNERS.ability_mean, help="能力値の平均")
+    parser.add_argument("--learning-rate", type=float, default=DEFAULT_LEARNERS.learning_rate)
+    args = parser.parse_args()
+
+    base = current_rules(args.test_mode)
+    learners = DEFAULT_LEARNERS._replace(ability_mean=args.ability, learning_rate=args.learning_rate)
+    grid = itertools.product(args.threshold or [base.question_threshold], args.windows or [base.window_sizes],
+                             args.advance, args.stay, args.meaning)
+
+    started = time.perf_counter()
+    runs = 0
+    for threshold, windows, advance, stay, meaning in grid:
+        rules = RuleParams(threshold, windows, advance, stay, meaning)
+        # 同じ乱数列を使い、ルールの違いだけを比較する
+        result = simulate(rules, learners, args.students, args.max_answers, args.seed)
+        print(summarize(rules, *result))
+        runs += 1
+
+    print(f"{runs}通り × {args.students}人: {time.perf_counter() - started:.2f}秒")
+
+if __name__ == "__main__":
+    main()